@@ -0,0 +1,215 @@
+"""
+Admission control for slash-command reports.
+
+Interactive reports are counted while they run and their durations are
+kept for a short window. Reports beyond capacity (the number the bot can
+generate at once, i.e. the Gemini dispatcher's concurrency) are waiting
+in a queue. From the queue depth and recent latency, each new command is
+admitted at one of three levels:
+
+- normal: the full Gemini report.
+- degraded: a precomputed report if one exists, otherwise a quick
+  numbers-only report built from the cached data without Gemini. It
+  never fetches: if anything it needs is not cached, the reply is busy.
+- busy: an immediate "try again shortly" reply, sent before the command
+  is deferred so the user never sees a "thinking..." placeholder.
+
+Configured in the "admission" section of config.json; it is off unless
+enabled is set:
+
+    "admission": {
+        "enabled": true,
+        "capacity": 4,
+        "degrade_queue_depth": 8,
+        "max_queue_depth": 24,
+        "degrade_latency": 60,
+        "max_latency": 180,
+        "latency_window": 300
+    }
+
+Latency is the 90th percentile of interactive reports finished within
+latency_window seconds. It only counts while reports are queued, so a
+slow spell ends as soon as the backlog drains. The check and the count
+of a newly admitted report happen under one lock, so a burst of commands
+can't all pass the check before any of them is counted. Scheduled daily
+and precompute reports are never shed and don't count towards the load.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import app_config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    "capacity": 4,
+    "degrade_queue_depth": 8,
+    "max_queue_depth": 24,
+    "degrade_latency": 60,
+    "max_latency": 180,
+    "latency_window": 300,
+}
+
+NORMAL, DEGRADED, BUSY = "normal", "degraded", "busy"
+
+BUSY_MESSAGE = "🎣 The bot is swamped with requests right now. Please try again in a few minutes."
+
+
+def get_settings():
+    settings = app_config.section("admission", DEFAULT_SETTINGS)
+    return settings
+
+
+class Admission:
+    """The level a report was admitted at
+
+    A normal admission holds the report's place in flight from admit()
+    on; use it as a context manager around the report to release it and
+    record the report's latency, or release() it if no report runs.
+    """
+
+    __slots__ = ("level", "_controller", "_started", "_held")
+
+    def __init__(self, controller, level, started):
+        self.level = level
+        self._controller = controller
+        self._started = started
+        self._held = level == NORMAL
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._held:
+            self._held = False
+            self._controller._finish(self._started)
+
+    def release(self):
+        """Give the place in flight back without recording a latency (e.g. a precomputed report was served)"""
+        if self._held:
+            self._held = False
+            self._controller._release()
+
+
+class AdmissionController:
+    """Tracks interactive reports in flight and recent report latency"""
+
+    def __init__(self, settings=None, clock=time.monotonic):
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._latencies = deque(maxlen=256)
+
+    def in_flight(self):
+        with self._lock:
+            return self._in_flight
+
+    def queue_depth(self):
+        """Reports in flight beyond capacity, waiting for their turn"""
+        with self._lock:
+            return max(0, self._in_flight - self.settings["capacity"])
+
+    def _latency(self):
+        cutoff = self._clock() - self.settings["latency_window"]
+        values = sorted(seconds for finished, seconds in self._latencies if finished >= cutoff)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(round(0.9 * (len(values) - 1))))]
+
+    def latency(self):
+        """90th percentile of recent report durations in seconds, or None"""
+        with self._lock:
+            return self._latency()
+
+    def _level(self):
+        # Called with the lock held
+        if not self.settings["enabled"]:
+            return NORMAL, 0, 0
+        queued = max(0, self._in_flight - self.settings["capacity"])
+        latency = (self._latency() or 0) if queued else 0
+        if queued >= self.settings["max_queue_depth"] or latency >= self.settings["max_latency"]:
+            return BUSY, queued, latency
+        if queued >= self.settings["degrade_queue_depth"] or latency >= self.settings["degrade_latency"]:
+            return DEGRADED, queued, latency
+        return NORMAL, queued, latency
+
+    def level(self):
+        """normal, degraded or busy for the next interactive report, without admitting it"""
+        with self._lock:
+            return self._level()[0]
+
+    def admit(self):
+        """Admission for the next interactive report; a normal one is counted in flight at once"""
+        with self._lock:
+            level, queued, latency = self._level()
+            if level == NORMAL:
+                self._in_flight += 1
+                metrics.set_gauge("reports_in_flight", self._in_flight)
+        if level != NORMAL:
+            logger.warning("Report load is %s: %d queued, p90 latency %.1fs", level, queued, latency)
+        return Admission(self, level, self._clock())
+
+    def _start(self):
+        with self._lock:
+            self._in_flight += 1
+            metrics.set_gauge("reports_in_flight", self._in_flight)
+        return self._clock()
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+            metrics.set_gauge("reports_in_flight", self._in_flight)
+
+    def _finish(self, started):
+        finished = self._clock()
+        with self._lock:
+            self._latencies.append((finished, finished - started))
+            self._in_flight -= 1
+            metrics.set_gauge("reports_in_flight", self._in_flight)
+
+    @contextmanager
+    def track(self):
+        """Count a report that skipped admission as in flight and record how long it took"""
+        started = self._start()
+        try:
+            yield
+        finally:
+            self._finish(started)
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(get_settings())
+        return _controller
+
+
+def configure(controller=None):
+    """Replace the process-wide admission controller (used by tests)"""
+    global _controller
+    with _controller_lock:
+        _controller = controller if controller is not None else AdmissionController(get_settings())
+        return _controller
+
+
+def admit():
+    """Admission for the next interactive report, counted in report_admissions_total"""
+    admission = get_controller().admit()
+    metrics.increment("report_admissions_total", level=admission.level)
+    return admission
+
+
+def track():
+    return get_controller().track()
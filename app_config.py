@@ -0,0 +1,61 @@
+"""
+config.json, read once per process.
+
+Each module takes its settings from one section of config.json. section()
+serves them from a single cached read, so hot paths (choose_model on
+every Gemini call, the cache and upstream layers) never reopen and parse
+the file. The cached copy is only refreshed by reload(); the bot does not
+call it, so edits to the settings sections take effect on restart.
+User preferences change while the bot runs; read() always reads the
+file and is what code that needs them uses.
+"""
+
+import copy
+import json
+import threading
+
+CONFIG_FILE = "config.json"
+
+_config = None
+_lock = threading.Lock()
+
+
+def read(path=None):
+    """config.json as a dict, read from disk now; {} if missing or invalid"""
+    try:
+        with open(path or CONFIG_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        return {}
+
+
+def load():
+    """The cached config.json, read on first use"""
+    global _config
+    with _lock:
+        if _config is None:
+            _config = read()
+        return _config
+
+
+def section(name, defaults=None):
+    """A copy of one section of the cached config, over defaults"""
+    settings = dict(defaults or {})
+    settings.update(copy.deepcopy(load().get(name, {})))
+    return settings
+
+
+def reload():
+    """Read config.json again on next use"""
+    global _config
+    with _lock:
+        _config = None
+
+
+def configure(config=None):
+    """Use config instead of config.json, or read the file again when None (used by tests)"""
+    global _config
+    with _lock:
+        _config = config
@@ -0,0 +1,126 @@
+"""
+Decode benchmark for upstream payloads.
+
+Compares parsing the stub One Call, NOAA and iNaturalist responses into
+plain dicts (json.loads, as the bot used to) with decoding them into the
+compact models in models.py, and measures the memory one report's data
+takes in each form. NOAA is also timed as a format=csv response and, when
+numpy is installed, decoded into columnar NumPy arrays.
+
+Usage (from the repository root):
+
+    python -m benchmarks.decode_benchmark --iterations 200 --days 7 --interval 6
+"""
+
+import argparse
+import csv
+import json
+import time
+import tracemalloc
+
+import models
+from benchmarks.stub_servers import _inaturalist_payload, _noaa_csv, _noaa_payload, _onecall_payload
+
+
+def payloads(days=7, interval="h"):
+    """Response bodies (bytes) for one report, as the stubs would serve them"""
+    noaa_params = {"product": "water_level", "begin_date": "20250101",
+                   "end_date": f"202501{days:02d}", "interval": interval}
+    return {
+        "openweather": json.dumps(_onecall_payload(32.78, -79.93)).encode(),
+        "noaa": json.dumps(_noaa_payload(noaa_params)).encode(),
+        "inaturalist": json.dumps(_inaturalist_payload()).encode(),
+        "noaa_csv": _noaa_csv(noaa_params).encode(),
+    }
+
+
+# Report data is the JSON responses; noaa_csv is the same NOAA series in CSV
+REPORT_SOURCES = ("openweather", "noaa", "inaturalist")
+
+DECODERS = {
+    "openweather": models.decode_onecall,
+    "noaa": models.decode_noaa,
+    "inaturalist": lambda body: models.decode_species_counts(body, 32.78, -79.93),
+    "noaa_csv": lambda body: models.decode_noaa(body, format="csv"),
+}
+
+PARSERS = {
+    "noaa_csv": lambda body: list(csv.DictReader(body.decode("utf-8").splitlines())),
+}
+
+COLUMNAR_DECODERS = {
+    "noaa": lambda body: models.decode_noaa(body, columnar=True),
+    "noaa_csv": lambda body: models.decode_noaa(body, format="csv", columnar=True),
+}
+
+
+def _time(function, body, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function(body)
+    return (time.perf_counter() - started) / iterations
+
+
+def _retained(build):
+    """Bytes still allocated after build() while its result is alive"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        value = build()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del value
+    return after - before
+
+
+def run_benchmark(iterations=200, days=7, interval="h"):
+    bodies = payloads(days, interval)
+    results = {"iterations": iterations, "days": days, "interval": interval, "sources": {}}
+    for source, body in bodies.items():
+        stats = results["sources"][source] = {
+            "bytes": len(body),
+            "dict_seconds": _time(PARSERS.get(source, json.loads), body, iterations),
+            "model_seconds": _time(DECODERS[source], body, iterations),
+            "columnar_seconds": None,
+        }
+        if models.numpy is not None and source in COLUMNAR_DECODERS:
+            stats["columnar_seconds"] = _time(COLUMNAR_DECODERS[source], body, iterations)
+    results["dict_bytes_per_report"] = _retained(
+        lambda: [json.loads(bodies[source]) for source in REPORT_SOURCES])
+    results["model_bytes_per_report"] = _retained(
+        lambda: [DECODERS[source](bodies[source]) for source in REPORT_SOURCES])
+    return results
+
+
+def format_results(results):
+    lines = [
+        f"Iterations: {results['iterations']}  NOAA days: {results['days']}  "
+        f"interval: {results['interval']}",
+        f"{'Source':<12} {'Bytes':>8} {'dict (ms)':>10} {'model (ms)':>11} {'columnar (ms)':>14}",
+    ]
+    for source, stats in results["sources"].items():
+        columnar = stats["columnar_seconds"]
+        columnar = f"{columnar * 1000:>14.3f}" if columnar is not None else f"{'-':>14}"
+        lines.append(f"{source:<12} {stats['bytes']:>8} {stats['dict_seconds'] * 1000:>10.3f} "
+                     f"{stats['model_seconds'] * 1000:>11.3f} {columnar}")
+    lines.append(f"Memory per report: dict {results['dict_bytes_per_report'] / 1024:.1f} KiB, "
+                 f"model {results['model_bytes_per_report'] / 1024:.1f} KiB")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dict vs model decoding of upstream payloads")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--days", type=int, default=7, help="Days of NOAA readings")
+    parser.add_argument("--interval", default="h", choices=("h", "6"),
+                        help="NOAA interval: h (hourly) or 6 (6-minute)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(iterations=args.iterations, days=args.days, interval=args.interval)
+    print(json.dumps(results, indent=2) if args.json else format_results(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Import-time benchmark for bot start-up.
+
+Imports each module in a fresh interpreter with `python -X importtime`,
+several times, and reports the median cumulative import time plus the
+slowest modules it pulled in. Start-up regressions fail the run: a
+module listed in --forbid (by default google.genai and numpy, which
+the bot loads lazily) being imported at all, or an import slower than
+--budget-ms.
+
+Usage (from the repository root):
+
+    python -m benchmarks.import_benchmark --runs 5 --budget-ms 600
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = ("command_logic", "main")
+
+# Heavy dependencies that must stay out of start-up
+DEFAULT_FORBIDDEN = ("google.genai", "numpy")
+
+
+def parse_importtime(stderr):
+    """{module: (self_us, cumulative_us)} from -X importtime output"""
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if self_us.isdigit():
+            timings[name] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def measure(module, env=None):
+    """Import timings of module in a fresh interpreter"""
+    environment = dict(os.environ)
+    # main reads CHANNEL_ID at import time
+    environment.setdefault("CHANNEL_ID", "0")
+    environment.update(env or {})
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=environment, capture_output=True, text=True, timeout=120,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def run_benchmark(modules=DEFAULT_MODULES, runs=5, forbidden=DEFAULT_FORBIDDEN, budget_ms=None, top=8):
+    results = {"runs": runs, "modules": {}, "failures": []}
+    for module in modules:
+        samples = [measure(module) for _ in range(runs)]
+        totals = [timings[module][1] / 1000 for timings in samples]
+        last = samples[-1]
+        loaded = sorted(name for name in forbidden if name in last)
+        slowest = sorted(last.items(), key=lambda item: -item[1][0])[:top]
+        results["modules"][module] = {
+            "median_ms": statistics.median(totals),
+            "min_ms": min(totals),
+            "imported": len(last),
+            "forbidden_loaded": loaded,
+            "slowest": [(name, self_us / 1000) for name, (self_us, _) in slowest],
+        }
+        if loaded:
+            results["failures"].append(f"{module} imports {', '.join(loaded)} at start-up")
+        if budget_ms is not None and statistics.median(totals) > budget_ms:
+            results["failures"].append(
+                f"{module} took {statistics.median(totals):.0f} ms to import (budget {budget_ms:.0f} ms)")
+    return results
+
+
+def format_results(results):
+    lines = [f"Import times over {results['runs']} fresh interpreters"]
+    for module, stats in results["modules"].items():
+        lines.append(f"\n{module}: median {stats['median_ms']:.1f} ms, min {stats['min_ms']:.1f} ms, "
+                     f"{stats['imported']} modules")
+        for name, self_ms in stats["slowest"]:
+            lines.append(f"  {self_ms:8.1f} ms  {name}")
+    for failure in results["failures"]:
+        lines.append(f"\nFAIL: {failure}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure bot start-up import time")
+    parser.add_argument("--modules", nargs="+", default=list(DEFAULT_MODULES))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--forbid", nargs="*", default=list(DEFAULT_FORBIDDEN),
+                        help="modules that must not be imported at start-up")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="fail if a module's median import time exceeds this")
+    args = parser.parse_args(argv)
+    results = run_benchmark(args.modules, args.runs, args.forbid, args.budget_ms)
+    print(format_results(results))
+    return 1 if results["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
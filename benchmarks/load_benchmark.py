@@ -0,0 +1,250 @@
+"""
+Offline end-to-end load benchmark.
+
+Starts the stub upstream servers, points weather, fish, NOAA and Gemini at
+them and drives today_logic / week_logic / species_logic with concurrent
+fake Discord interactions. Reports p50/p95/p99 latency, throughput and
+thread usage per command.
+
+Usage (from the repository root):
+
+    python -m benchmarks.load_benchmark --concurrency 20 --requests 200 \
+        --latency noaa=lognormal:0.2:0.8 --error-rate inaturalist=0.05
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import cache
+import metrics
+import quota
+import report_workers
+import warehouse
+from benchmarks.stub_servers import Latency, start_stubs, stop_stubs
+
+COMMANDS = ("today", "week", "species")
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def defer(self, thinking=False):
+        self._interaction.deferred_at = time.perf_counter()
+
+    async def send_message(self, content, ephemeral=False):
+        self._interaction.finish(content)
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content, ephemeral=False):
+        self._interaction.finish(content)
+
+
+class FakeInteraction:
+    """Just enough of discord.Interaction for the *_logic handlers"""
+
+    def __init__(self, user_id):
+        self.user = SimpleNamespace(id=user_id, name=f"bench-user-{user_id}")
+        self.channel_id = 1
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.deferred_at = None
+        self.finished_at = None
+        self.content = None
+
+    def finish(self, content):
+        self.finished_at = time.perf_counter()
+        self.content = content
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+def configure_upstreams(stubs):
+    """Point every upstream client at the local stub servers"""
+    import call_gemini
+    import fish
+    import weather
+    from noaa_tides_currents import NOAACoOpsAPI
+
+    os.environ.setdefault("OPEN_WEATHER_TOKEN", "stub-token")
+    os.environ.setdefault("GEMINI_API_KEY", "stub-key")
+    # Environment variables reach report worker processes; the attributes
+    # cover modules that are already imported in this process
+    os.environ["GEMINI_BASE_URL"] = stubs["gemini"].url
+    os.environ["OPEN_WEATHER_BASE_URL"] = weather.OPEN_WEATHER_BASE_URL = stubs["openweather"].url
+    os.environ["INATURALIST_BASE_URL"] = fish.INATURALIST_BASE_URL = f"{stubs['inaturalist'].url}/v1"
+    os.environ["NOAA_BASE_URL"] = NOAACoOpsAPI.BASE_URL = f"{stubs['noaa'].url}/api/prod"
+    os.environ["NOAA_METADATA_URL"] = NOAACoOpsAPI.METADATA_URL = f"{stubs['noaa'].url}/mdapi/prod/webapi"
+    call_gemini._client = None
+    # Production quotas must not throttle or spend budget on the stubs
+    os.environ["UPSTREAM_QUOTAS"] = "off"
+    # Start every run with a cold cache, and keep stub readings out of the warehouse
+    cache.configure()
+    warehouse.configure(None)
+    quota.configure()
+
+
+async def _run_one(command, user_id, zip_code, fishing_type):
+    import command_logic
+
+    interaction = FakeInteraction(user_id)
+    choice = SimpleNamespace(value=fishing_type)
+    started = time.perf_counter()
+    if command == "today":
+        await command_logic.today_logic(interaction, zip_code, choice)
+    elif command == "week":
+        await command_logic.week_logic(interaction, zip_code, choice)
+    else:
+        await command_logic.species_logic(interaction, None, zip_code, choice)
+    finished = interaction.finished_at or time.perf_counter()
+    failed = not interaction.content or interaction.content.startswith("❌")
+    return command, finished - started, failed
+
+
+async def _sample_threads(samples, stop):
+    while not stop.is_set():
+        samples.append(threading.active_count())
+        await asyncio.sleep(0.01)
+
+
+async def run_load(concurrency, total_requests, commands=COMMANDS, zip_code="29414",
+                   fishing_type="kayak", executor_workers=None):
+    loop = asyncio.get_running_loop()
+    if executor_workers:
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=executor_workers))
+
+    semaphore = asyncio.Semaphore(concurrency)
+    thread_samples = []
+    stop = asyncio.Event()
+    sampler = asyncio.ensure_future(_sample_threads(thread_samples, stop))
+
+    async def bounded(i):
+        async with semaphore:
+            return await _run_one(commands[i % len(commands)], 100000 + i, zip_code, fishing_type)
+
+    wall_start = time.perf_counter()
+    results = await asyncio.gather(*(bounded(i) for i in range(total_requests)))
+    wall = time.perf_counter() - wall_start
+    stop.set()
+    await sampler
+
+    per_command = {}
+    for command in commands:
+        latencies = [lat for cmd, lat, _ in results if cmd == command]
+        per_command[command] = {
+            "requests": len(latencies),
+            "errors": sum(1 for cmd, _, failed in results if cmd == command and failed),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+        }
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "wall_seconds": wall,
+        "throughput_rps": total_requests / wall if wall else None,
+        "threads_peak": max(thread_samples) if thread_samples else threading.active_count(),
+        "threads_mean": sum(thread_samples) / len(thread_samples) if thread_samples else None,
+        "commands": per_command,
+    }
+
+
+def run_benchmark(concurrency=10, total_requests=50, commands=COMMANDS, latencies=None,
+                  error_rates=None, seed=None, executor_workers=None):
+    """Start the stubs, run the load and return a results dict"""
+    stubs = start_stubs(latencies, error_rates, seed)
+    try:
+        configure_upstreams(stubs)
+        results = asyncio.run(run_load(concurrency, total_requests, tuple(commands),
+                                       executor_workers=executor_workers))
+        results["upstream_requests"] = {name: stub.requests for name, stub in stubs.items()}
+        results["upstream_errors"] = {name: stub.errors for name, stub in stubs.items()}
+        results["hedges"] = {name: {"fired": metrics.get_counter("upstream_hedges_total", provider=name),
+                                    "won": metrics.get_counter("upstream_hedge_wins_total", provider=name)}
+                             for name in stubs}
+        return results
+    finally:
+        report_workers.shutdown()
+        stop_stubs(stubs)
+
+
+def format_results(results):
+    lines = [
+        f"Requests: {results['requests']}  Concurrency: {results['concurrency']}  "
+        f"Wall: {results['wall_seconds']:.2f}s  Throughput: {results['throughput_rps']:.2f} req/s",
+        f"Threads: peak {results['threads_peak']}, mean {results['threads_mean'] or 0:.1f}",
+        f"{'Command':<10} {'N':>5} {'Errors':>7} {'p50 (s)':>9} {'p95 (s)':>9} {'p99 (s)':>9}",
+    ]
+    for command, stats in results["commands"].items():
+        if not stats["requests"]:
+            continue
+        lines.append(f"{command:<10} {stats['requests']:>5} {stats['errors']:>7} "
+                     f"{stats['p50']:>9.3f} {stats['p95']:>9.3f} {stats['p99']:>9.3f}")
+    lines.append(f"Upstream requests: {results['upstream_requests']}")
+    lines.append(f"Upstream errors: {results['upstream_errors']}")
+    lines.append(f"Hedges: {results['hedges']}")
+    return "\n".join(lines)
+
+
+def _parse_mapping(items, parse):
+    mapping = {}
+    for item in items or []:
+        name, _, value = item.partition("=")
+        mapping[name] = parse(value)
+    return mapping
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load benchmark against stub upstreams")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--commands", default=",".join(COMMANDS),
+                        help="Comma-separated subset of: " + ", ".join(COMMANDS))
+    parser.add_argument("--latency", action="append",
+                        help="upstream=kind:a[:b], e.g. noaa=lognormal:0.2:0.8 (repeatable)")
+    parser.add_argument("--error-rate", action="append",
+                        help="upstream=rate, e.g. gemini=0.02 (repeatable)")
+    parser.add_argument("--executor-workers", type=int, default=None,
+                        help="Size of the default thread pool (Python default if omitted)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Run reports in this many worker processes (sets REPORT_WORKERS)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper())
+    logging.getLogger().setLevel(args.log_level.upper())
+    if args.workers is not None:
+        os.environ["REPORT_WORKERS"] = str(args.workers)
+
+    results = run_benchmark(
+        concurrency=args.concurrency,
+        total_requests=args.requests,
+        commands=[c.strip() for c in args.commands.split(",") if c.strip()],
+        latencies=_parse_mapping(args.latency, Latency.parse),
+        error_rates=_parse_mapping(args.error_rate, float),
+        seed=args.seed,
+        executor_workers=args.executor_workers,
+    )
+    print(json.dumps(results, indent=2) if args.json else format_results(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+"""
+Local stub HTTP servers that imitate the upstream APIs used by the bot.
+
+Each stub serves realistic payload shapes for one upstream (OpenWeather
+geo + One Call, NOAA datagetter, iNaturalist species_counts and Gemini
+generateContent) with a configurable latency distribution and error rate.
+RedisStub is an in-memory stand-in for a Redis server, enough for the
+redis cache backend.
+"""
+
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class Latency:
+    """Latency distribution in seconds
+
+    kind is one of "fixed" (a), "uniform" (a..b) or "lognormal"
+    (median a, shape sigma b, which gives a realistic long tail).
+    """
+
+    def __init__(self, kind="fixed", a=0.0, b=0.0):
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        self.kind = kind
+        self.a = a
+        self.b = b
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse "fixed:0.05", "uniform:0.02:0.2" or "lognormal:0.1:0.6" """
+        parts = spec.split(":")
+        values = [float(p) for p in parts[1:]] + [0.0, 0.0]
+        return cls(parts[0], values[0], values[1])
+
+    def sample(self, rng=random):
+        if self.kind == "fixed":
+            return self.a
+        if self.kind == "uniform":
+            return rng.uniform(self.a, self.b)
+        return rng.lognormvariate(0, self.b) * self.a
+
+    def __repr__(self):
+        return f"Latency({self.kind!r}, {self.a}, {self.b})"
+
+
+def _onecall_payload(lat, lon):
+    now = int(time.time())
+    hour = now - now % 3600
+    day = now - now % 86400
+    return {
+        "lat": float(lat), "lon": float(lon), "timezone": "America/New_York", "timezone_offset": -18000,
+        "current": {"dt": now, "temp": 291.4, "feels_like": 291.0, "pressure": 1018, "humidity": 71,
+                    "dew_point": 286.0, "uvi": 3.1, "clouds": 20, "visibility": 10000,
+                    "wind_speed": 4.1, "wind_deg": 200,
+                    "weather": [{"id": 801, "main": "Clouds", "description": "few clouds", "icon": "02d"}]},
+        "minutely": [{"dt": now + 60 * i, "precipitation": 0} for i in range(61)],
+        "hourly": [{"dt": hour + 3600 * i, "temp": 290 + (i % 12) * 0.4, "feels_like": 289.5,
+                    "pressure": 1018 - (i % 7), "humidity": 70, "dew_point": 285.2, "uvi": 0.0,
+                    "clouds": 20, "visibility": 10000, "wind_speed": 3.0 + (i % 5), "wind_deg": 190,
+                    "wind_gust": 6.2, "pop": 0.1,
+                    "weather": [{"id": 801, "main": "Clouds", "description": "few clouds", "icon": "02d"}]}
+                   for i in range(48)],
+        "daily": [{"dt": day + 86400 * i + 61200, "sunrise": day + 86400 * i + 40000,
+                   "sunset": day + 86400 * i + 80000, "moonrise": day + 86400 * i + 50000,
+                   "moonset": day + 86400 * i + 10000, "moon_phase": (i * 0.125) % 1,
+                   "summary": "Expect a day of partly cloudy with clear spells",
+                   "temp": {"day": 292.1, "min": 285.3, "max": 294.8, "night": 287.1, "eve": 290.4, "morn": 286.0},
+                   "feels_like": {"day": 291.8, "night": 286.6, "eve": 290.0, "morn": 285.5},
+                   "pressure": 1016 + i, "humidity": 65, "dew_point": 284.9, "wind_speed": 5.1,
+                   "wind_deg": 210, "wind_gust": 9.3, "clouds": 30, "pop": 0.2, "uvi": 5.2,
+                   "weather": [{"id": 802, "main": "Clouds", "description": "scattered clouds", "icon": "03d"}]}
+                  for i in range(8)],
+    }
+
+
+def _noaa_payload(params):
+    product = params.get("product", "water_level")
+    station = params.get("station", "8665530")
+    if product == "metadata":
+        return {"metadata": {"id": station, "name": "Stub Station", "lat": "32.7808", "lon": "-79.9236"}}
+    begin = datetime.strptime(params.get("begin_date", "20250101")[:8], "%Y%m%d")
+    end = datetime.strptime(params.get("end_date", "20250102")[:8], "%Y%m%d") + timedelta(days=1)
+    if product == "predictions" and params.get("interval") == "hilo":
+        return {"predictions": _noaa_events(begin, end, lambda i, stamp: {
+            "t": stamp, "v": "1.834" if i % 2 else "-0.112", "type": "H" if i % 2 else "L"})}
+    if product == "currents_predictions":
+        return {"current_predictions": {"units": "knots", "cp": _noaa_events(begin, end, lambda i, stamp: {
+            "Time": stamp, "Velocity_Major": (0.0, 1.62, 0.0, -1.85)[i % 4], "meanFloodDir": 300,
+            "meanEbbDir": 125, "Bin": "1", "Depth": "4.5", "Type": ("slack", "flood", "slack", "ebb")[i % 4]})}}
+    step = timedelta(minutes=6) if params.get("interval") == "6" else timedelta(hours=1)
+    rows = []
+    t = begin
+    while t < end:
+        stamp = t.strftime("%Y-%m-%d %H:%M")
+        if product == "currents":
+            rows.append({"t": stamp, "s": "1.23", "d": "145", "b": "1"})
+        else:
+            rows.append({"t": stamp, "v": "1.234", "s": "0.012", "f": "0,0,0,0", "q": "p"})
+        t += step
+    key = "data"
+    return {"metadata": {"id": station, "name": "Stub Station", "lat": "32.7808", "lon": "-79.9236"}, key: rows}
+
+
+def _noaa_events(begin, end, row):
+    """One row per tide or current event, about every 6h 12m like a semidiurnal tide"""
+    rows = []
+    t = begin + timedelta(hours=2, minutes=14)
+    while t < end:
+        rows.append(row(len(rows), t.strftime("%Y-%m-%d %H:%M")))
+        t += timedelta(hours=6, minutes=12)
+    return rows
+
+
+STUB_STATIONS = (
+    ("8665530", "Charleston, Cooper River Entrance", "SC", 32.7808, -79.9236),
+    ("8661070", "Springmaid Pier", "SC", 33.6550, -78.9183),
+    ("8670870", "Fort Pulaski", "GA", 32.0367, -80.9017),
+    ("8518750", "The Battery", "NY", 40.7006, -74.0142),
+)
+
+
+def _noaa_stations():
+    return {"count": len(STUB_STATIONS), "stations": [
+        {"id": id, "name": name, "state": state, "lat": lat, "lng": lng}
+        for id, name, state, lat, lng in STUB_STATIONS]}
+
+
+# Approximate Charleston harmonic constants (metres, degrees) for the five main constituents
+STUB_HARCON = (("M2", 0.785, 223.8, 28.9841042), ("S2", 0.124, 245.2, 30.0), ("N2", 0.178, 204.6, 28.4397295),
+               ("K1", 0.102, 108.3, 15.0410686), ("O1", 0.077, 110.9, 13.9430356))
+
+
+def _noaa_metadata(path, params):
+    """Metadata API station details, harmonic constituents and datums"""
+    station = path.rsplit("/stations/", 1)[-1].split("/")[0].split(".")[0]
+    scale = 3.2808 if params.get("units") == "english" else 1.0
+    if path.endswith("/harcon.json"):
+        return {"units": params.get("units", "metric"), "HarmonicConstituents": [
+            {"number": i + 1, "name": name, "amplitude": round(amplitude * scale, 3), "phase_GMT": phase,
+             "speed": speed} for i, (name, amplitude, phase, speed) in enumerate(STUB_HARCON)]}
+    if path.endswith("/datums.json"):
+        return {"datums": [{"name": name, "value": round(value * scale, 3)}
+                           for name, value in (("MHHW", 1.76), ("MSL", 0.86), ("MLLW", 0.0))]}
+    name = next((row[1] for row in STUB_STATIONS if row[0] == station), "Stub Station")
+    return {"stations": [{"id": station, "name": name, "lat": 32.7808, "lng": -79.9236,
+                          "timezonecorr": -5, "observedst": True}]}
+
+
+def _noaa_csv(params):
+    """_noaa_payload rows as a NOAA format=csv body"""
+    rows = _noaa_payload(params).get("data", [])
+    if params.get("product") == "currents":
+        lines = ["Date Time, Speed, Direction, Bin"]
+        lines += [f"{row['t']},{row['s']},{row['d']},{row['b']}" for row in rows]
+    else:
+        lines = ["Date Time, Water Level, Sigma, O or I (for verified), F, R, L, Quality"]
+        lines += [f"{row['t']},{row['v']},{row['s']},{row['f']},{row['q']}" for row in rows]
+    return "\n".join(lines) + "\n"
+
+
+def _inaturalist_payload():
+    return {
+        "total_results": 50, "page": 1, "per_page": 50,
+        "results": [{"count": 500 - i * 7, "taxon": {"id": 47000 + i, "name": f"Stubfish species{i}",
+                                                        "preferred_common_name": f"Stub Fish {i}", "rank": "species"}}
+                    for i in range(50)],
+    }
+
+
+def _gemini_payload(request_body):
+    try:
+        prompt = request_body["contents"][0]["parts"][0]["text"]
+    except (KeyError, IndexError, TypeError):
+        prompt = ""
+    text = ("🎣 **Stub Fishing Report**\n"
+            "**Best Window:** 6-9 AM\n"
+            "**Reason:** Incoming tide with light winds.\n")
+    prompt_tokens = max(1, len(prompt) // 4)
+    output_tokens = max(1, len(text) // 4)
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+        "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+                          "totalTokenCount": prompt_tokens + output_tokens},
+        "modelVersion": "stub",
+    }
+
+
+ROUTES = {
+    "openweather": ("/geo/1.0/zip", "/data/3.0/onecall"),
+    "noaa": ("/api/prod/datagetter", ".json"),
+    "inaturalist": ("/v1/observations/species_counts",),
+    "gemini": (":generateContent",),
+}
+
+
+class StubServer:
+    """One stub upstream running in a background thread"""
+
+    def __init__(self, name, latency=None, error_rate=0.0, seed=None):
+        if name not in ROUTES:
+            raise ValueError(f"Unknown stub upstream: {name}")
+        self.name = name
+        self.latency = latency or Latency()
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub._handle(self, None)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                stub._handle(self, body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name=f"stub-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handle(self, handler, body):
+        with self._lock:
+            self.requests += 1
+            delay = self.latency.sample(self._rng)
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if delay > 0:
+            time.sleep(delay)
+
+        parsed = urlparse(handler.path)
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        if failed:
+            self._send(handler, 503, {"error": {"message": "stub upstream unavailable"}})
+            return
+        if not any(parsed.path.endswith(route) for route in ROUTES[self.name]):
+            self._send(handler, 404, {"error": {"message": f"no stub route for {parsed.path}"}})
+            return
+
+        if self.name == "openweather" and parsed.path.endswith("/zip"):
+            payload = {"zip": params.get("zip", "").split(",")[0], "name": "Stub City",
+                       "lat": 32.7808, "lon": -79.9236, "country": "US"}
+        elif self.name == "openweather":
+            payload = _onecall_payload(params.get("lat", 0), params.get("lon", 0))
+        elif self.name == "noaa" and parsed.path.endswith("/stations.json"):
+            payload = _noaa_stations()
+        elif self.name == "noaa" and parsed.path.endswith(".json"):
+            payload = _noaa_metadata(parsed.path, params)
+        elif self.name == "noaa" and params.get("format") == "csv":
+            self._send(handler, 200, _noaa_csv(params), "text/csv")
+            return
+        elif self.name == "noaa":
+            payload = _noaa_payload(params)
+        elif self.name == "inaturalist":
+            payload = _inaturalist_payload()
+        else:
+            payload = _gemini_payload(json.loads(body or b"{}"))
+        self._send(handler, 200, payload)
+
+    @staticmethod
+    def _send(handler, status, payload, content_type="application/json"):
+        data = (payload if isinstance(payload, str) else json.dumps(payload)).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+def start_stubs(latencies=None, error_rates=None, seed=None):
+    """Start one stub per upstream and return them keyed by name"""
+    latencies = latencies or {}
+    error_rates = error_rates or {}
+    stubs = {}
+    for i, name in enumerate(ROUTES):
+        stubs[name] = StubServer(name, latencies.get(name), error_rates.get(name, 0.0),
+                                 seed=None if seed is None else seed + i).start()
+    return stubs
+
+
+def stop_stubs(stubs):
+    for stub in stubs.values():
+        stub.stop()
+
+
+class RedisStub:
+    """Speaks enough RESP2 for the cache: PING, SELECT, GET, SET [PX], MGET, DEL, FLUSHDB"""
+
+    def __init__(self):
+        self.data = {}
+        self.commands = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        stub = self
+
+        class Handler(StreamRequestHandler):
+            def handle(self):
+                while True:
+                    command = stub._read_command(self.rfile)
+                    if command is None:
+                        return
+                    self.wfile.write(stub._execute(command))
+
+        ThreadingTCPServer.allow_reuse_address = True
+        self._server = ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="stub-redis", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @staticmethod
+    def _read_command(rfile):
+        line = rfile.readline()
+        if not line or not line.startswith(b"*"):
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(rfile.readline()[1:])
+            args.append(rfile.read(length + 2)[:-2])
+        return args
+
+    @staticmethod
+    def _bulk(value):
+        if value is None:
+            return b"$-1\r\n"
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _get(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def _execute(self, args):
+        name = args[0].upper()
+        with self._lock:
+            self.commands += 1
+            if name in (b"PING", b"SELECT", b"FLUSHDB"):
+                if name == b"FLUSHDB":
+                    self.data.clear()
+                return b"+PONG\r\n" if name == b"PING" else b"+OK\r\n"
+            if name == b"GET":
+                return self._bulk(self._get(args[1]))
+            if name == b"MGET":
+                return b"*%d\r\n" % (len(args) - 1) + b"".join(self._bulk(self._get(k)) for k in args[1:])
+            if name == b"SET":
+                expires_at = None
+                if len(args) >= 5 and args[3].upper() == b"PX":
+                    expires_at = time.time() + int(args[4]) / 1000
+                self.data[args[1]] = (args[2], expires_at)
+                return b"+OK\r\n"
+            if name == b"DEL":
+                removed = sum(1 for k in args[1:] if self.data.pop(k, None) is not None)
+                return b":%d\r\n" % removed
+        return b"-ERR unknown command\r\n"
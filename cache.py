@@ -0,0 +1,561 @@
+"""
+Pluggable cache shared by the upstream fetchers and the Gemini layer.
+
+Backends:
+    memory  - in-process LRU (default)
+    sqlite  - local SQLite file, shared by every process on the host
+    redis   - any Redis-protocol server, shared by every bot instance
+
+Configured in the "cache" section of config.json, or with CACHE_BACKEND
+and CACHE_URL (a file path for sqlite, redis://host:port/db for redis):
+
+    "cache": {
+        "backend": "sqlite",
+        "url": "cache.sqlite3",
+        "max_entries": 2048,
+        "ttl": {"openweather": 600, "noaa": 1800, "inaturalist": 21600, "gemini": 1800},
+        "stale_ttl": 86400,
+        "stale_while_revalidate": 900
+    }
+
+Values are JSON-serialisable objects, stored compressed with zlib. Classes
+registered with register_type (the models in models.py) are stored through
+their to_dict/from_dict methods and come back as objects.
+
+get_or_load() adds stale-while-revalidate on top of any backend: for
+stale_while_revalidate seconds after an entry's TTL it is still returned
+immediately while a single background refresh per key replaces it.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import app_config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "backend": "memory",
+    "url": "cache.sqlite3",
+    "max_entries": 2048,
+    "ttl": {"openweather": 600, "noaa": 1800, "inaturalist": 21600, "gemini": 1800},
+    "stale_ttl": 86400,
+    "stale_while_revalidate": 900,
+}
+
+# Payloads smaller than this are stored uncompressed
+COMPRESS_MIN_BYTES = 512
+
+
+_types = {}
+
+
+def register_type(cls):
+    """Class decorator: store instances by to_dict() and rebuild them with from_dict()"""
+    _types[cls.__name__] = cls
+    return cls
+
+
+def _encode_default(value):
+    name = type(value).__name__
+    if _types.get(name) is type(value):
+        return {"__type__": name, "value": value.to_dict()}
+    raise TypeError(f"Object of type {name} is not JSON serializable")
+
+
+def _decode_hook(data):
+    if len(data) == 2 and "__type__" in data and data["__type__"] in _types:
+        return _types[data["__type__"]].from_dict(data["value"])
+    return data
+
+
+def encode(value):
+    """Serialise a value to bytes, compressing larger payloads"""
+    raw = json.dumps(value, separators=(",", ":"), default=_encode_default).encode("utf-8")
+    if len(raw) >= COMPRESS_MIN_BYTES:
+        return b"z" + zlib.compress(raw, 6)
+    return b"j" + raw
+
+
+def decode(data):
+    if data is None:
+        return None
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if data[:1] == b"z":
+        return json.loads(zlib.decompress(data[1:]).decode("utf-8"), object_hook=_decode_hook)
+    return json.loads(data[1:].decode("utf-8"), object_hook=_decode_hook)
+
+
+class CacheBackend:
+    """Interface every backend implements. ttl is in seconds (None = no expiry)"""
+
+    name = "base"
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+    def get_many(self, keys):
+        """Return {key: value} for the keys that are present"""
+        raise NotImplementedError
+
+    def set_many(self, mapping, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """Thread-safe in-process LRU"""
+
+    name = "memory"
+
+    def __init__(self, max_entries=2048, clock=time.time):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = self._clock()
+        found = {}
+        with self._lock:
+            for key in keys:
+                item = self._items.get(key)
+                if item is None:
+                    continue
+                data, expires_at = item
+                if expires_at is not None and expires_at <= now:
+                    del self._items[key]
+                    continue
+                self._items.move_to_end(key)
+                found[key] = data
+        return {k: decode(v) for k, v in found.items()}
+
+    def set_many(self, mapping, ttl=None):
+        expires_at = self._clock() + ttl if ttl is not None else None
+        encoded = {k: encode(v) for k, v in mapping.items()}
+        with self._lock:
+            for key, data in encoded.items():
+                self._items[key] = (data, expires_at)
+                self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class SQLiteCache(CacheBackend):
+    """Disk cache in a single SQLite file; safe to share between processes"""
+
+    name = "sqlite"
+
+    def __init__(self, path="cache.sqlite3", clock=time.time):
+        self.path = path
+        self._clock = clock
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        now = self._clock()
+        found = {}
+        conn = self._connect()
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT key, value FROM cache WHERE key IN ({placeholders}) "
+                "AND (expires_at IS NULL OR expires_at > ?)",
+                (*chunk, now),
+            ).fetchall()
+            found.update({key: decode(value) for key, value in rows})
+        return found
+
+    def set_many(self, mapping, ttl=None):
+        expires_at = self._clock() + ttl if ttl is not None else None
+        rows = [(key, sqlite3.Binary(encode(value)), expires_at) for key, value in mapping.items()]
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)", rows)
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache")
+
+    def purge_expired(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (self._clock(),))
+
+
+class RedisError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+
+class _RedisConnection:
+    """Minimal RESP2 client connection"""
+
+    def __init__(self, host, port, db, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile("rb")
+        if db:
+            self.execute("SELECT", db)
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+    @staticmethod
+    def pack(*args):
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(out)
+
+    def read_reply(self):
+        reply = self._read()
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    def _read(self):
+        # Error replies come back as RedisError instances rather than being
+        # raised, so callers can consume every reply they are owed first
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by Redis server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            return RedisError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(rest)
+            if count < 0:
+                return None
+            items = [self._read() for _ in range(count)]
+            return next((i for i in items if isinstance(i, RedisError)), items)
+        # Nothing after this line can be trusted to line up with a command
+        raise ConnectionError(f"Unexpected reply from Redis: {line!r}")
+
+    def execute(self, *args):
+        self.sock.sendall(self.pack(*args))
+        return self.read_reply()
+
+    def pipeline(self, commands):
+        self.sock.sendall(b"".join(self.pack(*cmd) for cmd in commands))
+        # Drain all N replies before raising, or the next command on this
+        # connection would read a reply meant for this pipeline
+        replies = [self._read() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+
+class RedisCache(CacheBackend):
+    """Cache on any Redis-protocol server (one connection per thread)"""
+
+    name = "redis"
+
+    def __init__(self, url="redis://127.0.0.1:6379/0", prefix="boomhauer:", timeout=2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.strip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = _RedisConnection(self.host, self.port, self.db, self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _call(self, fn):
+        try:
+            return self._attempt(fn)
+        except (OSError, ConnectionError):
+            # Reconnect once on a dropped connection
+            return self._attempt(fn)
+
+    def _attempt(self, fn):
+        try:
+            return fn(self._conn())
+        except RedisError:
+            # An error reply leaves the connection in sync; anything else
+            # may have stopped part way through a reply
+            raise
+        except Exception:
+            self._drop()
+            raise
+
+    def _drop(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self._call(lambda c: c.execute("MGET", *(self.prefix + k for k in keys)))
+        return {k: decode(v) for k, v in zip(keys, values) if v is not None}
+
+    def set_many(self, mapping, ttl=None):
+        commands = []
+        for key, value in mapping.items():
+            if ttl is not None:
+                commands.append(("SET", self.prefix + key, encode(value), "PX", max(1, int(ttl * 1000))))
+            else:
+                commands.append(("SET", self.prefix + key, encode(value)))
+        if commands:
+            self._call(lambda c: c.pipeline(commands))
+
+    def delete(self, key):
+        self._call(lambda c: c.execute("DEL", self.prefix + key))
+
+    def clear(self):
+        self._call(lambda c: c.execute("FLUSHDB"))
+
+
+def get_settings():
+    settings = dict(DEFAULT_SETTINGS)
+    configured = app_config.section("cache")
+    settings.update(configured)
+    settings["ttl"] = {**DEFAULT_SETTINGS["ttl"], **configured.get("ttl", {})}
+    if os.getenv("CACHE_BACKEND"):
+        settings["backend"] = os.getenv("CACHE_BACKEND")
+    if os.getenv("CACHE_URL"):
+        settings["url"] = os.getenv("CACHE_URL")
+    return settings
+
+
+def create_backend(settings):
+    backend = settings.get("backend", "memory")
+    if backend == "memory":
+        return MemoryCache(settings.get("max_entries", DEFAULT_SETTINGS["max_entries"]))
+    if backend == "sqlite":
+        return SQLiteCache(settings.get("url", DEFAULT_SETTINGS["url"]))
+    if backend == "redis":
+        return RedisCache(settings.get("url", "redis://127.0.0.1:6379/0"))
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+_cache = None
+_settings = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache, _settings
+    with _cache_lock:
+        if _cache is None:
+            _settings = get_settings()
+            _cache = create_backend(_settings)
+            logger.info("Using %s cache backend", _cache.name)
+        return _cache
+
+
+def configure(backend=None, settings=None):
+    """Replace the process-wide cache (used by tests and benchmarks)"""
+    global _cache, _settings
+    with _cache_lock:
+        _settings = {**get_settings(), **(settings or {})}
+        _cache = backend if backend is not None else create_backend(_settings)
+        return _cache
+
+
+def ttl_for(provider):
+    get_cache()
+    return _settings["ttl"].get(provider, 0)
+
+
+def stale_ttl():
+    get_cache()
+    return _settings["stale_ttl"]
+
+
+def swr_grace():
+    get_cache()
+    return _settings["stale_while_revalidate"]
+
+
+def get(key):
+    """Fetch a value, treating backend failures as a miss"""
+    try:
+        value = get_cache().get(key)
+    except Exception as e:
+        logger.warning("Cache read failed: %s", e)
+        metrics.increment("cache_errors_total", op="get")
+        return None
+    metrics.increment("cache_requests_total", outcome="hit" if value is not None else "miss")
+    return value
+
+
+def get_many(keys):
+    try:
+        found = get_cache().get_many(keys)
+    except Exception as e:
+        logger.warning("Cache read failed: %s", e)
+        metrics.increment("cache_errors_total", op="get_many")
+        return {}
+    metrics.increment("cache_requests_total", len(found), outcome="hit")
+    metrics.increment("cache_requests_total", len(keys) - len(found), outcome="miss")
+    return found
+
+
+def set(key, value, ttl=None):
+    """Store a value, logging (not raising) on backend failures"""
+    try:
+        get_cache().set(key, value, ttl)
+    except Exception as e:
+        logger.warning("Cache write failed: %s", e)
+        metrics.increment("cache_errors_total", op="set")
+
+
+def set_many(mapping, ttl=None):
+    try:
+        get_cache().set_many(mapping, ttl)
+    except Exception as e:
+        logger.warning("Cache write failed: %s", e)
+        metrics.increment("cache_errors_total", op="set_many")
+
+
+_refresh_executor = None
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _get_refresh_executor():
+    global _refresh_executor
+    with _inflight_lock:
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cache-refresh")
+        return _refresh_executor
+
+
+def _claim(key):
+    """Return (future, owner); only the owner runs the loader for key"""
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future, False
+        future = _inflight[key] = Future()
+        return future, True
+
+
+def _run_load(key, future, loader, ttl, grace, is_valid):
+    try:
+        value = loader()
+        fetched_at = time.time()
+        if is_valid is None or is_valid(value):
+            set(key, {"value": value, "fetched_at": fetched_at}, ttl=ttl + grace)
+        future.set_result((value, fetched_at))
+    except BaseException as e:
+        future.set_exception(e)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+    return future.result()
+
+
+def _refresh_in_background(key, loader, ttl, grace, is_valid):
+    future, owner = _claim(key)
+    if not owner:
+        return
+    metrics.increment("cache_swr_total", outcome="refresh")
+
+    def refresh():
+        try:
+            _run_load(key, future, loader, ttl, grace, is_valid)
+        except Exception as e:
+            logger.warning("Background refresh of %s failed: %s", key, e)
+            metrics.increment("cache_swr_total", outcome="refresh_failed")
+
+    _get_refresh_executor().submit(refresh)
+
+
+def get_or_load(key, loader, ttl, grace=0, is_valid=None):
+    """Return (value, fetched_at) for key, calling loader() on a miss
+
+    Entries younger than ttl are fresh. Up to grace seconds past ttl the
+    cached value is still returned and loader() runs once in the
+    background. Concurrent misses for the same key share one loader call.
+    Values rejected by is_valid are returned but not cached.
+    """
+    if ttl:
+        entry = get(key)
+        if entry is not None:
+            age = time.time() - entry["fetched_at"]
+            if age <= ttl:
+                metrics.increment("cache_swr_total", outcome="fresh")
+                return entry["value"], entry["fetched_at"]
+            if age <= ttl + grace:
+                metrics.increment("cache_swr_total", outcome="stale")
+                _refresh_in_background(key, loader, ttl, grace, is_valid)
+                return entry["value"], entry["fetched_at"]
+
+    metrics.increment("cache_swr_total", outcome="miss")
+    future, owner = _claim(key)
+    if not owner:
+        return future.result()
+    return _run_load(key, future, loader, ttl, grace, is_valid if ttl else (lambda value: False))
@@ -1,9 +1,25 @@
-from google import genai
+import heapq
+import itertools
 import json
 import os
 import logging
+import threading
+import time
+from datetime import datetime, timezone
+import app_config
+import cache
+import logs
+import quota
+import upstream
+import resilience
+import weekly
+import metrics
+from gemini_usage import usage_tracker, choose_model
+from lazy import lazy_import
 from fish import get_fish
-from weather import get_weather, zip_to_coords
+from weather import get_weather, get_weather_history, zip_to_coords
+from time_window import TimeWindow, NOAA_TIME_ZONE
+from models import SpeciesReport, WeatherSnapshot, to_plain
 from noaa_tides_currents import get_tide
 
 try: # pragma: no cover
@@ -12,13 +28,11 @@ try: # pragma: no cover
 except ImportError: # pragma: no cover
     pass
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-    ) # pragma: no cover
 logger = logging.getLogger(__name__) # pragma: no cover
 
+# The SDK takes about a second to import; it loads when the first client is created
+genai = lazy_import("google.genai")
+
 _client = None # pragma: no cover
 
 def get_client(): # pragma: no cover
@@ -29,83 +43,276 @@ def get_client(): # pragma: no cover
         if not api_key:
             logger.error("GEMINI_API_KEY not set")
             raise ValueError("GEMINI_API_KEY not set")
-        _client = genai.Client(api_key=api_key)
+        base_url = os.getenv("GEMINI_BASE_URL")
+        _, read_timeout = resilience.get_timeout("gemini", "generate_content", default=(10, 60))
+        # The SDK takes a single timeout in milliseconds
+        http_options = genai.types.HttpOptions(base_url=base_url, timeout=int(read_timeout * 1000))
+        _client = genai.Client(api_key=api_key, http_options=http_options)
         logger.info("Gemini client initialized successfully")
     return _client
 
 
-def combine_api_data(zip_code=None, fishing_type=None):
-    logger.info(f"Combining API data for location: {zip_code}, fishing_type: {fishing_type}") # pragma: no cover
+# Lower ranks are dispatched first; aging_seconds of waiting is worth one rank
+PRIORITIES = {"interactive": 0, "daily": 1, "prewarm": 2}
+
+DEFAULT_DISPATCHER_SETTINGS = {
+    "concurrency": 4,
+    "aging_seconds": 30,
+}
+
+
+def get_dispatcher_settings():
+    settings = app_config.section("gemini_dispatcher", DEFAULT_DISPATCHER_SETTINGS)
+    return settings
+
+
+class GeminiDispatcher:
+    """Runs Gemini calls at most concurrency at a time, in priority order
+
+    Waiting requests are ordered by enqueue time plus rank * aging_seconds,
+    so a prewarm request queued a minute before an interactive one (with
+    the default 30s aging) is dispatched first instead of starving.
+    Request and token rates are paced by the gemini limits in quota.py,
+    the same buckets every other Gemini call uses: a dispatched request
+    waits there for as long as the limits need instead of failing.
+    Report worker processes each have a dispatcher, so besides the local
+    queue a request holds a quota.concurrency_slot, which caps Gemini calls
+    at concurrency across all processes sharing the quota state.
+    """
+
+    def __init__(self, settings=None, clock=time.monotonic, acquire=quota.acquire, slot=quota.concurrency_slot):
+        self.settings = {**DEFAULT_DISPATCHER_SETTINGS, **(settings or {})}
+        self._clock = clock
+        self._acquire = acquire
+        self._slot = slot
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._active = 0
+
+    def depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def _export(self):
+        metrics.set_gauge("gemini_queue_depth", len(self._queue))
+        metrics.set_gauge("gemini_requests_in_flight", self._active)
+
+    def run(self, call, priority="interactive"):
+        """Wait for a slot and for the gemini quota, then return call()"""
+        rank = PRIORITIES.get(priority, PRIORITIES["interactive"])
+        enqueued = self._clock()
+        entry = (enqueued + rank * self.settings["aging_seconds"], next(self._seq))
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            self._export()
+            while self._active >= self.settings["concurrency"] or self._queue[0] is not entry:
+                self._cond.wait()
+            heapq.heappop(self._queue)
+            self._active += 1
+            self._export()
+            # The new head may be able to take another free slot
+            self._cond.notify_all()
+        try:
+            with self._slot("gemini:dispatch", self.settings["concurrency"]):
+                waited = self._clock() - enqueued
+                waited += self._acquire("gemini", "generate_content", max_wait=float("inf")) or 0.0
+                metrics.observe("gemini_queue_wait_seconds", waited, priority=priority)
+                if waited >= 1:
+                    logger.info("Gemini %s request waited %.1fs for dispatch", priority, waited)
+                return call()
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._export()
+                self._cond.notify_all()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = GeminiDispatcher(get_dispatcher_settings())
+        return _dispatcher
+
+
+def configure_dispatcher(dispatcher=None):
+    """Replace the process-wide Gemini dispatcher (used by tests and benchmarks)"""
+    global _dispatcher
+    with _dispatcher_lock:
+        _dispatcher = dispatcher if dispatcher is not None else GeminiDispatcher(get_dispatcher_settings())
+        return _dispatcher
+
+
+def _usable(value):
+    return bool(value) and not (isinstance(value, dict) and "error" in value)
+
+
+def _as_of(fetched_at):
+    return datetime.fromtimestamp(fetched_at, timezone.utc).isoformat(timespec="seconds")
+
+
+def _fetch_cached(source, key, provider, loader):
+    """Load upstream data with stale-while-revalidate; returns (value, as_of)
+
+    Data stays fresh for longer while the provider's quota is running low.
+    Inside upstream.cache_only() nothing is loaded: a miss raises CacheOnlyMiss.
+    """
+    cache_key = f"data:{source}:{key}"
+    if upstream.is_cache_only():
+        entry = cache.get(cache_key)
+        if entry is None:
+            raise upstream.CacheOnlyMiss(f"No cached {source} data")
+        return entry["value"], _as_of(entry["fetched_at"])
+    ttl = cache.ttl_for(provider) * quota.ttl_multiplier(provider)
+    with logs.stage(logger, f"{source}_data", provider=provider):
+        value, fetched_at = cache.get_or_load(cache_key, loader, ttl, cache.swr_grace(), is_valid=_usable)
+    return value, _as_of(fetched_at)
+
+
+def _load_fish(lat, lon):
+    return get_fish(lat, lon)
+
+
+def _load_tides(window=None):
+    if window:
+        begin_date, end_date = window.noaa_range()
+        tides = get_tide(quiet=True, begin_date=begin_date, end_date=end_date, time_zone=NOAA_TIME_ZONE)
+    else:
+        tides = get_tide(quiet=True)
+    return tides.get("data") if tides and "data" in tides else tides
+
+
+def _load_weather(lat, lon, window=None):
+    if window is None:
+        return get_weather(lat, lon)
+    exclude = window.onecall_exclude()
+    weather = get_weather(lat, lon, exclude=exclude) if exclude is not None else None
+    # Past hours are a nice-to-have, skipped once the One Call budget is nearly spent
+    times = window.history_times() if quota.optional_allowed("openweather", "timemachine") else []
+    history = [point for dt in times for point in get_weather_history(lat, lon, dt)]
+    if history:
+        base = weather if isinstance(weather, WeatherSnapshot) else WeatherSnapshot(lat=lat, lon=lon)
+        weather = base.copy(history=history)
+    if weather is None:
+        return {"note": "No forecast is available this far ahead"}
+    return weather
+
+
+def combine_api_data(zip_code=None, fishing_type=None, window=None):
+    """Collect fish, tide and weather data; a TimeWindow limits fetching and rows to that window"""
+    logger.info("Combining API data for location: %s, fishing_type: %s", zip_code, fishing_type) # pragma: no cover
     data = {
         "location": zip_code or "Not specified",
         "fishing_type": fishing_type or "All types",
         "fish_data": None,
         "tides_data": None,
-        "weather_data": None
+        "weather_data": None,
+        # UTC time each source was fetched; cached data may be a few minutes old
+        "as_of": {}
     }
     
     # Convert zip_code to lat/lon if provided
     lat = None
     lon = None
     if zip_code:
-        logger.info(f"Converting ZIP code {zip_code} to coordinates...") # pragma: no cover
+        logger.info("Converting ZIP code %s to coordinates...", zip_code) # pragma: no cover
         lat, lon = zip_to_coords(str(zip_code))
         if lat and lon:
-            logger.info(f"✓ ZIP code converted to coordinates: lat={lat}, lon={lon}") # pragma: no cover
+            logger.info("✓ ZIP code converted to coordinates: lat=%s, lon=%s", lat, lon) # pragma: no cover
+        elif upstream.is_cache_only():
+            # Not the default location: that would be a report for the wrong place
+            raise upstream.CacheOnlyMiss(f"No cached coordinates for {zip_code}")
         else:
-            logger.warning(f"Failed to convert ZIP code {zip_code} to coordinates, using default location") # pragma: no cover
+            logger.warning("Failed to convert ZIP code %s to coordinates, using default location", zip_code) # pragma: no cover
     
     logger.info("Calling iNaturalist API (get_fish)...") # pragma: no cover
     try:
-        fish_json = get_fish(lat, lon)
-        data["fish_data"] = json.loads(fish_json) if isinstance(fish_json, str) else fish_json
-        if "error" in data["fish_data"]:
-            logger.warning(f"iNaturalist API returned error: {data['fish_data'].get('error')}")
+        # Nearby locations share one lookup while the budget is low
+        fish_lat, fish_lon = quota.geocell("inaturalist", lat, lon)
+        data["fish_data"], data["as_of"]["fish_data"] = _fetch_cached(
+            "fish", f"{fish_lat}:{fish_lon}", "inaturalist", lambda: _load_fish(fish_lat, fish_lon))
+        if isinstance(data["fish_data"], SpeciesReport):
+            species_count = data["fish_data"].species_found
+            logger.info("✓ iNaturalist API success - Found %s fish species", species_count)
         else:
-            species_count = len(data["fish_data"].get("fish_species", []))
-            logger.info(f"✓ iNaturalist API success - Found {species_count} fish species")
+            logger.warning("iNaturalist API returned error: %s", data['fish_data'].get('error'))
+    except upstream.CacheOnlyMiss:
+        raise
     except Exception as e: # pragma: no cover
-        logger.error(f"✗ iNaturalist API failed: {str(e)}")
+        logger.error("✗ iNaturalist API failed: %s", e)
         data["fish_data"] = {"error": str(e)}
     
     logger.info("Calling NOAA Tides API (get_tide)...") # pragma: no cover
     try:
-        tides = get_tide(quiet=True)
-        data["tides_data"] = tides.get("data") if tides and "data" in tides else tides
+        tides_key = f"config:{window.key()}" if window else "config"
+        data["tides_data"], data["as_of"]["tides_data"] = _fetch_cached(
+            "tides", tides_key, "noaa", lambda: _load_tides(window))
+        if window:
+            data["tides_data"] = window.slice_tides(data["tides_data"])
         if data["tides_data"] and "error" not in str(data["tides_data"]):
             logger.info("✓ NOAA Tides API success")
         else:
-            logger.warning(f"NOAA Tides API returned error or empty data")
+            logger.warning("NOAA Tides API returned error or empty data")
+    except upstream.CacheOnlyMiss:
+        raise
     except Exception as e: # pragma: no cover
-        logger.error(f"✗ NOAA Tides API failed: {str(e)}")
+        logger.error("✗ NOAA Tides API failed: %s", e)
         data["tides_data"] = {"error": str(e)}
     
     logger.info("Calling Weather API (get_weather)...") # pragma: no cover
     try:
-        data["weather_data"] = get_weather(lat, lon)
+        weather_lat, weather_lon = quota.geocell("openweather", lat, lon)
+        weather_key = f"{weather_lat}:{weather_lon}"
+        weather_key = f"{weather_key}:{window.key()}" if window else weather_key
+        data["weather_data"], data["as_of"]["weather_data"] = _fetch_cached(
+            "weather", weather_key, "openweather", lambda: _load_weather(weather_lat, weather_lon, window))
+        if window:
+            data["weather_data"] = window.slice_weather(data["weather_data"])
         if data["weather_data"] and "error" not in str(data["weather_data"]):
             logger.info("✓ Weather API success")
         else:
-            logger.warning(f"Weather API returned error or empty data")
+            logger.warning("Weather API returned error or empty data")
+    except upstream.CacheOnlyMiss:
+        raise
     except Exception as e: # pragma: no cover
-        logger.error(f"✗ Weather API failed: {str(e)}")
+        logger.error("✗ Weather API failed: %s", e)
         data["weather_data"] = {"error": str(e)}
     
     logger.info("API data collection complete") # pragma: no cover
     return data
 
-def call_gemini_fishing(data, template_path, model="gemini-2.5-flash"): # pragma: no cover
-    logger.info(f"Calling Gemini API with template: {template_path}, model: {model}")
+def generate_content(prompt, model="gemini-2.5-flash", report_type=None, template=None, fishing_type=None, user_id=None, priority="interactive"): # pragma: no cover
+    """Send a prompt to Gemini through the dispatcher and record its token usage"""
+    model = choose_model(model, user_id)
+    client = None if upstream.UPSTREAM_MODE == "replay" else get_client()
+    dispatch = lambda call: get_dispatcher().run(call, priority)
+    with logs.stage(logger, "gemini", model=model, priority=priority):
+        response = upstream.generate(client, model, prompt, template=template, dispatch=dispatch)
+    if getattr(response, "from_cache", False):
+        logger.info("Gemini response served from cache")
+        return response
+    usage_tracker.record(response, model, report_type=report_type, template=template,
+                         fishing_type=fishing_type, user_id=user_id)
+    return response
+
+def call_gemini_fishing(data, template_path, model="gemini-2.5-flash", report_type=None, user_id=None, priority="interactive"): # pragma: no cover
+    logger.info("Calling Gemini API with template: %s, model: %s", template_path, model)
     try:
         with open(template_path, "r") as f:
             template = f.read()
-        logger.debug(f"Template loaded from {template_path}")
+        logger.debug("Template loaded from %s", template_path)
 
         prompt = f"""You are a fishing expert.
 
 IMPORTANT: Keep total response under 1800 characters. All "Reason" or "Why" fields must be ONE SENTENCE ONLY.
 
 Analyze the data and provide recommendations. Follow the template format exactly.
+The "as_of" field gives the UTC time each data source was fetched; do not describe older data as live.
 
 For location recommendations, provide specific spots based on the fishing_type (shore, boat, or kayak):
 - Shore: Recommend piers, jetties, beaches, docks, accessible shorelines
@@ -123,61 +330,95 @@ TEMPLATE:
 
 DATA:
 ```json
-{json.dumps(data, indent=2)}
+{json.dumps(data, indent=2, default=to_plain)}
 ```
 """
         
-        client = get_client()
         logger.info("Sending request to Gemini API...")
-        response = client.models.generate_content(model=model, contents=prompt)
+        response = generate_content(prompt, model, report_type=report_type, template=template_path,
+                                    fishing_type=data.get("fishing_type"), user_id=user_id, priority=priority)
         response_length = len(response.text)
-        logger.info(f"✓ Gemini API success - Response length: {response_length} characters")
+        logger.info("✓ Gemini API success - Response length: %s characters", response_length)
         return response.text
     except Exception as e:
-        logger.error(f"✗ Gemini API failed: {str(e)}")
+        logger.error("✗ Gemini API failed: %s", e)
         raise
 
 
-def get_fishing_report(zip_code=None, fishing_type=None, template="template_today.txt"): # pragma: no cover
-    logger.info(f"Generating fishing report (today) - location: {zip_code}, type: {fishing_type}")
+def get_fishing_report(zip_code=None, fishing_type=None, template="template_today.txt", user_id=None, priority="interactive"): # pragma: no cover
+    logger.info("Generating fishing report (today) - location: %s, type: %s", zip_code, fishing_type)
     try:
         data = combine_api_data(zip_code, fishing_type)
-        result = call_gemini_fishing(data, template)
+        result = call_gemini_fishing(data, template, report_type="today", user_id=user_id, priority=priority)
         logger.info("Fishing report generated successfully")
         return result
     except Exception as e:
-        logger.error(f"Failed to generate fishing report: {str(e)}")
+        logger.error("Failed to generate fishing report: %s", e)
         return f"❌ Error: {str(e)}"
 
 
-def get_fishing_report_time_window(start_time, end_time, zip_code=None, fishing_type=None, template="template_time_window.txt"): # pragma: no cover
-    logger.info(f"Generating fishing report (time window) - {start_time} to {end_time}, location: {zip_code}")
+def get_fishing_report_time_window(start_time, end_time, zip_code=None, fishing_type=None, template="template_time_window.txt", user_id=None, priority="interactive"): # pragma: no cover
+    logger.info("Generating fishing report (time window) - %s to %s, location: %s", start_time, end_time, zip_code)
     try:
-        data = combine_api_data(zip_code, fishing_type)
+        data = combine_api_data(zip_code, fishing_type, window=TimeWindow.parse(start_time, end_time))
         data["time_window"] = {"start": start_time, "end": end_time}
-        result = call_gemini_fishing(data, template)
+        result = call_gemini_fishing(data, template, report_type="time_window", user_id=user_id, priority=priority)
         logger.info("Time window report generated successfully")
         return result
     except Exception as e:
-        logger.error(f"Failed to generate time window report: {str(e)}")
+        logger.error("Failed to generate time window report: %s", e)
         return f"❌ Error: {str(e)}"
 
 
-def get_fishing_report_weekly(zip_code=None, fishing_type=None, template="template_weekly.txt"): # pragma: no cover
-    logger.info(f"Generating fishing report (weekly) - location: {zip_code}, type: {fishing_type}")
+def get_fishing_report_weekly(zip_code=None, fishing_type=None, template="template_weekly.txt", user_id=None, priority="interactive"): # pragma: no cover
+    logger.info("Generating fishing report (weekly) - location: %s, type: %s", zip_code, fishing_type)
     try:
         data = combine_api_data(zip_code, fishing_type)
         data["report_type"] = "weekly"
-        result = call_gemini_fishing(data, template)
+        days, rescored = weekly.score_week(data, zip_code, fishing_type)
+        if days:
+            logger.info("Weekly scores: %s of %s days rescored", rescored, len(days))
+            best_days = weekly.ranking(days)
+            cached = weekly.cached_report(zip_code, fishing_type, best_days)
+            if cached:
+                logger.info("Best days unchanged, reusing weekly report")
+                return cached
+            # Gemini writes the prose around the precomputed scores instead of the raw forecast
+            data["days"] = days
+            data["best_days"] = best_days
+            data["scoring_note"] = "Use the score, windows and summary from days for Best Days, in best_days order."
+            data["weather_data"] = data["weather_data"].copy(minutely=None, hourly=[], daily=[])
+        result = call_gemini_fishing(data, template, report_type="weekly", user_id=user_id, priority=priority)
+        if days and not result.startswith("❌"):
+            weekly.store_report(zip_code, fishing_type, best_days, result)
         logger.info("Weekly report generated successfully")
         return result
     except Exception as e:
-        logger.error(f"Failed to generate weekly report: {str(e)}")
+        logger.error("Failed to generate weekly report: %s", e)
         return f"❌ Error: {str(e)}"
 
 
-def get_species_recommendations_gemini(species_name=None, zip_code=None, fishing_type=None, model="gemini-2.5-flash"): # pragma: no cover
-    logger.info(f"Generating species recommendations - species: {species_name or 'all'}, location: {zip_code}")
+def get_quick_report(zip_code=None, fishing_type=None, first=None, last=None, days=1):
+    """Numbers-only report without Gemini, served by admission control under load
+
+    Built from cached data only, so it adds no upstream load; None when
+    something it needs is not cached.
+    """
+    logger.info("Generating quick report - location: %s, type: %s", zip_code, fishing_type)
+    try:
+        with upstream.cache_only():
+            data = combine_api_data(zip_code, fishing_type)
+        return weekly.quick_report(data, fishing_type, first=first, last=last, days=days)
+    except upstream.CacheOnlyMiss as e:
+        logger.info("No quick report for %s: %s", zip_code, e)
+        return None
+    except Exception as e:
+        logger.error("Failed to generate quick report: %s", e)
+        return f"❌ Error: {str(e)}"
+
+
+def get_species_recommendations_gemini(species_name=None, zip_code=None, fishing_type=None, model="gemini-2.5-flash", user_id=None, priority="interactive"): # pragma: no cover
+    logger.info("Generating species recommendations - species: %s, location: %s", species_name or 'all', zip_code)
     try:
         data = combine_api_data(zip_code, fishing_type)
         data["request_type"] = "species_recommendations"
@@ -186,7 +427,7 @@ def get_species_recommendations_gemini(species_name=None, zip_code=None, fishing
         
         if species_name:
             template_path = "template_species_specific.txt"
-            logger.info(f"Using specific species template for: {species_name}")
+            logger.info("Using specific species template for: %s", species_name)
             prompt_prefix = f"""You are a fishing expert specializing in {species_name}.
 
 IMPORTANT: Keep total response under 1800 characters. All "Why" fields must be ONE SENTENCE ONLY. Be concise and actionable.
@@ -222,19 +463,21 @@ Provide a list of local fish species following the template.
 {template}
 ---
 
+The "as_of" field gives the UTC time each data source was fetched.
+
 DATA:
 ```json
-{json.dumps(data, indent=2)}
+{json.dumps(data, indent=2, default=to_plain)}
 ```
 """
         
-        client = get_client()
         logger.info("Sending species request to Gemini API...")
-        response = client.models.generate_content(model=model, contents=prompt)
+        response = generate_content(prompt, model, report_type="species", template=template_path,
+                                    fishing_type=fishing_type, user_id=user_id, priority=priority)
         response_length = len(response.text)
-        logger.info(f"✓ Species recommendations generated - Response length: {response_length} characters")
+        logger.info("✓ Species recommendations generated - Response length: %s characters", response_length)
         return response.text
     except Exception as e:
-        logger.error(f"Failed to generate species recommendations: {str(e)}")
+        logger.error("Failed to generate species recommendations: %s", e)
         return f"❌ Error: {str(e)}"
 
@@ -1,9 +1,17 @@
 import logging
 import asyncio
+import contextvars
 import json
 import re
+from contextlib import nullcontext
+from functools import partial
 
-from call_gemini import get_fishing_report, get_fishing_report_time_window, get_species_recommendations_gemini, get_fishing_report_weekly
+from call_gemini import get_fishing_report, get_fishing_report_time_window, get_species_recommendations_gemini, get_fishing_report_weekly, get_quick_report, combine_api_data
+import admission
+import app_config
+import logs
+import precompute
+import report_workers
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
@@ -22,6 +30,8 @@ def load_config():
 def save_config(config):
     with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
         json.dump(config, f, indent=2)
+    # Keep the settings other modules cache in step with the file
+    app_config.reload()
 
 def get_user_pref(user_id, key, default=None):
     config = load_config()
@@ -50,83 +60,169 @@ def get_location(user_id=None, zip_code=None):
         return f"{config['lat']},{config['lon']}"
     return None
 
-async def get_today_report(zip_code=None, fishing_type=None):
-    logger.info(f"Requesting today's report - location: {zip_code}, type: {fishing_type}")
-    loop = asyncio.get_event_loop()
+async def run_report(func, *args, user_id=None, priority="interactive", admitted=None):
+    """Run a blocking report function in a worker process if enabled, otherwise in a thread
+
+    priority orders its Gemini request in the dispatcher queue (see call_gemini.PRIORITIES);
+    interactive reports also count towards admission control, through admitted (the
+    admission.Admission from shed_load) when there is one
+    """
+    if admitted is None:
+        admitted = admission.track() if priority == "interactive" else nullcontext()
+    with admitted:
+        if report_workers.enabled():
+            return await report_workers.get_pool().submit(func, *args, user_id=user_id, priority=priority)
+        loop = asyncio.get_event_loop()
+        # Executor threads don't inherit context variables; carry the request id over
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(None, partial(context.run, func, *args, user_id=user_id, priority=priority))
+
+async def admit_command(interaction, precomputed=None):
+    """Admit an interactive command before deferring it, or reply at once that the bot is busy
+
+    Returns the admission.Admission to pass on to the report, or None once the
+    busy reply has been sent. A command whose report is already precomputed
+    (precomputed is the precompute.lookup arguments) is never turned away.
+    """
+    admitted = admission.admit()
+    if admitted.level == admission.BUSY and not (precomputed and precompute.lookup(*precomputed)):
+        await interaction.response.send_message(admission.BUSY_MESSAGE, ephemeral=True)
+        return None
+    return admitted
+
+async def shed_load(zip_code, fishing_type, first=None, last=None, days=1, admitted=None):
+    """(reply, None) to send instead of a full report when overloaded, or (None, admission) to go ahead
+
+    admitted is the command's admission from admit_command; without one the report
+    is admitted here. The admission already counts the report as in flight; pass
+    it to run_report. A degraded report is only served if it can be built from the
+    cache; otherwise the reply is busy.
+    """
+    if admitted is None:
+        admitted = admission.admit()
+    if admitted.level == admission.BUSY:
+        return admission.BUSY_MESSAGE, None
+    if admitted.level == admission.DEGRADED:
+        loop = asyncio.get_event_loop()
+        quick = await loop.run_in_executor(None, partial(get_quick_report, zip_code, fishing_type, first=first, last=last, days=days))
+        return quick or admission.BUSY_MESSAGE, None
+    return None, admitted
+
+async def get_today_report(zip_code=None, fishing_type=None, user_id=None, priority="interactive", admitted=None):
+    logger.info("Requesting today's report - location: %s, type: %s", zip_code, fishing_type)
+    precomputed = precompute.lookup("today", zip_code, fishing_type)
+    if precomputed:
+        logger.info("Serving precomputed today's report")
+        if admitted is not None:
+            admitted.release()
+        return precomputed
+    if priority == "interactive":
+        shed, admitted = await shed_load(zip_code, fishing_type, admitted=admitted)
+        if shed:
+            return shed
     try:
-        result = await loop.run_in_executor(None, get_fishing_report, zip_code, fishing_type)
+        result = await run_report(get_fishing_report, zip_code, fishing_type, user_id=user_id, priority=priority, admitted=admitted)
         logger.info("Today's report completed")
         return result
     except Exception as e:
-        logger.error(f"Today's report failed: {str(e)}")
+        logger.error("Today's report failed: %s", e)
         return f"❌ Error: {str(e)}"
 
-async def get_weekly_report(zip_code=None, fishing_type=None):
-    logger.info(f"Requesting weekly report - location: {zip_code}, type: {fishing_type}")
-    loop = asyncio.get_event_loop()
+async def get_weekly_report(zip_code=None, fishing_type=None, user_id=None, admitted=None):
+    logger.info("Requesting weekly report - location: %s, type: %s", zip_code, fishing_type)
+    shed, admitted = await shed_load(zip_code, fishing_type, days=7, admitted=admitted)
+    if shed:
+        return shed
     try:
-        result = await loop.run_in_executor(None, get_fishing_report_weekly, zip_code, fishing_type)
+        result = await run_report(get_fishing_report_weekly, zip_code, fishing_type, user_id=user_id, admitted=admitted)
         logger.info("Weekly report completed")
         return result
     except Exception as e:
-        logger.error(f"Weekly report failed: {str(e)}")
+        logger.error("Weekly report failed: %s", e)
         return f"❌ Error: {str(e)}"
 
-async def get_time_window_report(start_time, end_time, zip_code=None, fishing_type=None):
-    logger.info(f"Requesting time window report - {start_time} to {end_time}, location: {zip_code}")
-    loop = asyncio.get_event_loop()
+async def get_time_window_report(start_time, end_time, zip_code=None, fishing_type=None, user_id=None, admitted=None):
+    logger.info("Requesting time window report - %s to %s, location: %s", start_time, end_time, zip_code)
+    shed, admitted = await shed_load(zip_code, fishing_type, first=start_time[:10], last=end_time[:10], admitted=admitted)
+    if shed:
+        return shed
     try:
-        result = await loop.run_in_executor(None, get_fishing_report_time_window, start_time, end_time, zip_code, fishing_type)
+        result = await run_report(get_fishing_report_time_window, start_time, end_time, zip_code, fishing_type, user_id=user_id, admitted=admitted)
         logger.info("Time window report completed")
         return result
     except Exception as e:
-        logger.error(f"Time window report failed: {str(e)}")
+        logger.error("Time window report failed: %s", e)
         return f"❌ Error: {str(e)}"
 
-async def get_tomorrow_report(zip_code=None, fishing_type=None):
+def tomorrow_window():
     tomorrow = datetime.now() + timedelta(days=1)
     tomorrow_str = tomorrow.strftime("%Y-%m-%d")
-    start = f"{tomorrow_str} 00:00"
-    end = f"{tomorrow_str} 23:59"
-    logger.info(f"Requesting tomorrow's report - location: {zip_code}, type: {fishing_type}")
-    return await get_time_window_report(start, end, zip_code, fishing_type)
-
-async def get_species_recommendations(species_name, zip_code=None, fishing_type=None):
-    logger.info(f"Requesting species recommendations - species: {species_name or 'all'}, location: {zip_code}")
-    loop = asyncio.get_event_loop()
+    return f"{tomorrow_str} 00:00", f"{tomorrow_str} 23:59"
+
+async def get_tomorrow_report(zip_code=None, fishing_type=None, user_id=None, admitted=None):
+    start, end = tomorrow_window()
+    logger.info("Requesting tomorrow's report - location: %s, type: %s", zip_code, fishing_type)
+    precomputed = precompute.lookup("tomorrow", zip_code, fishing_type)
+    if precomputed:
+        logger.info("Serving precomputed tomorrow's report")
+        if admitted is not None:
+            admitted.release()
+        return precomputed
+    return await get_time_window_report(start, end, zip_code, fishing_type, user_id=user_id, admitted=admitted)
+
+async def precompute_popular_reports():
+    """Pre-generate today's and tomorrow's reports for the most requested locations"""
+    async def generate(kind, zip_code, fishing_type):
+        if kind == "today":
+            return await run_report(get_fishing_report, zip_code, fishing_type, priority="prewarm")
+        start, end = tomorrow_window()
+        return await run_report(get_fishing_report_time_window, start, end, zip_code, fishing_type, priority="prewarm")
+
+    async def prefetch(zip_code):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, combine_api_data, zip_code)
+
+    return await precompute.run(generate, prefetch)
+
+async def get_species_recommendations(species_name, zip_code=None, fishing_type=None, user_id=None, admitted=None):
+    logger.info("Requesting species recommendations - species: %s, location: %s", species_name or 'all', zip_code)
+    shed, admitted = await shed_load(zip_code, fishing_type, admitted=admitted)
+    if shed:
+        return shed
     try:
-        result = await loop.run_in_executor(None, get_species_recommendations_gemini, species_name, zip_code, fishing_type)
+        result = await run_report(get_species_recommendations_gemini, species_name, zip_code, fishing_type, user_id=user_id, admitted=admitted)
         logger.info("Species recommendations completed")
         return result
     except Exception as e:
-        logger.error(f"Species recommendations failed: {str(e)}")
+        logger.error("Species recommendations failed: %s", e)
         return f"❌ Error: {str(e)}"
 
 async def send_daily_report(bot, user_id, channel_id):
-    logger.info(f"Sending daily report to user {user_id} in channel {channel_id}")
+    logger.info("Sending daily report to user %s in channel %s", user_id, channel_id)
     zip_code = get_location(user_id)
     fishing_type = get_user_pref(user_id, "fishing_type")
     report_time = get_user_pref(user_id, "daily_report_time")
     
     if not zip_code:
-        logger.warning(f"Cannot send daily report to user {user_id} - no location set")
+        logger.warning("Cannot send daily report to user %s - no location set", user_id)
         return
     
-    report = await get_today_report(zip_code, fishing_type)
+    report = await get_today_report(zip_code, fishing_type, user_id=user_id, priority="daily")
     channel = bot.get_channel(channel_id)
     if channel:
         await channel.send(f"<@{user_id}> Daily Fishing Report:\n{report}")
-        logger.info(f"Daily report sent successfully to user {user_id}")
+        logger.info("Daily report sent successfully to user %s", user_id)
     else:
-        logger.error(f"Channel {channel_id} not found for daily report to user {user_id}")
+        logger.error("Channel %s not found for daily report to user %s", channel_id, user_id)
 
+@logs.traced("today")
 async def today_logic(interaction, zip_code, fishing_type):
     user_id = interaction.user.id
     username = interaction.user.name
 
     zip_code = get_location(user_id, zip_code)
     if not zip_code:
-        logger.warning(f"User {username} attempted /fish today without location")
+        logger.warning("User %s attempted /fish today without location", username)
         await interaction.response.send_message("❌ Please set your ZIP code first.", ephemeral=True)
         return
 
@@ -135,28 +231,36 @@ async def today_logic(interaction, zip_code, fishing_type):
     else:
         fishing_type = fishing_type.value
 
-    logger.info(f"Command /fish today - User: {username} (ID: {user_id}), zip_code: {zip_code}, type: {fishing_type}") 
+    precompute.note_request(zip_code)
+    logger.info("Command /fish today - User: %s (ID: %s), zip_code: %s, type: %s", username, user_id, zip_code, fishing_type) 
     
-    await interaction.response.defer(thinking=True)
+    admitted = await admit_command(interaction, ("today", zip_code, fishing_type))
+    if admitted is None:
+        return
     try:
-        report = await get_today_report(zip_code, fishing_type)
+        await interaction.response.defer(thinking=True)
+        report = await get_today_report(zip_code, fishing_type, user_id=user_id, admitted=admitted)
         if len(report) > 2000:
-            logger.warning(f"Report truncated for user {username} (length: {len(report)})")
+            logger.warning("Report truncated for user %s (length: %s)", username, len(report))
             report = report[:1950] + "\n\n... (truncated)"
         await interaction.followup.send(report)
-        logger.info(f"Successfully sent today's report to {username}")
+        logger.info("Successfully sent today's report to %s", username)
     except Exception as e:
-        logger.error(f"Failed to send report to {username}: {str(e)}")
+        logger.error("Failed to send report to %s: %s", username, e)
         await interaction.followup.send(f"❌ Error: {str(e)}", ephemeral=True)
+    finally:
+        # Hands the place in flight back if the report never ran
+        admitted.release()
 
+@logs.traced("tomorrow")
 async def tomorrow_logic(interaction, zip_code, fishing_type):
     user_id = interaction.user.id
     username = interaction.user.name
-    logger.info(f"Command /fish tomorrow - User: {username} (ID: {user_id}), zip_code: {zip_code}, type: {fishing_type}")
+    logger.info("Command /fish tomorrow - User: %s (ID: %s), zip_code: %s, type: %s", username, user_id, zip_code, fishing_type)
      
     zip_code = get_location(user_id, zip_code)
     if not zip_code:
-        logger.warning(f"User {username} attempted /fish tomorrow without location")
+        logger.warning("User %s attempted /fish tomorrow without location", username)
         await interaction.response.send_message("❌ Please set your ZIP code first.", ephemeral=True)
         return
     
@@ -164,23 +268,30 @@ async def tomorrow_logic(interaction, zip_code, fishing_type):
         fishing_type = get_user_pref(user_id, "fishing_type")
     else:
         fishing_type = fishing_type.value
-    
-    await interaction.response.defer(thinking=True)
+
+    precompute.note_request(zip_code)
+    admitted = await admit_command(interaction, ("tomorrow", zip_code, fishing_type))
+    if admitted is None:
+        return
     try:
-        report = await get_tomorrow_report(zip_code, fishing_type)
+        await interaction.response.defer(thinking=True)
+        report = await get_tomorrow_report(zip_code, fishing_type, user_id=user_id, admitted=admitted)
         if len(report) > 2000:
-            logger.warning(f"Report truncated for user {username} (length: {len(report)})")
+            logger.warning("Report truncated for user %s (length: %s)", username, len(report))
             report = report[:1950] + "\n\n... (truncated)"
         await interaction.followup.send(report)
-        logger.info(f"Successfully sent tomorrow's report to {username}")
+        logger.info("Successfully sent tomorrow's report to %s", username)
     except Exception as e:
-        logger.error(f"Failed to send report to {username}: {str(e)}")
+        logger.error("Failed to send report to %s: %s", username, e)
         await interaction.followup.send(f"❌ Error: {str(e)}", ephemeral=True)
+    finally:
+        admitted.release()
 
+@logs.traced("daily")
 async def daily_logic(interaction, zip_code, fishing_type, time_range):
     user_id = interaction.user.id
     username = interaction.user.name
-    logger.info(f"Command /fish daily - User: {username} (ID: {user_id}), time_range: {time_range}, zip_code: {zip_code}")
+    logger.info("Command /fish daily - User: %s (ID: %s), time_range: %s, zip_code: %s", username, user_id, time_range, zip_code)
      
 
     zip_code = get_location(user_id, zip_code)
@@ -239,8 +350,9 @@ async def daily_logic(interaction, zip_code, fishing_type, time_range):
     set_user_pref(user_id, "daily_report_time_range", time_range)
     set_user_pref(user_id, "daily_report_enabled", True)
     set_user_pref(user_id, "daily_report_channel", interaction.channel_id)
+    set_user_pref(user_id, "daily_report_guild", interaction.guild_id)
     
-    logger.info(f"Daily report configured for user {username} - time: {time_range}, location: {zip_code}")
+    logger.info("Daily report configured for user %s - time: %s, location: %s", username, time_range, zip_code)
     await interaction.response.send_message(
         f"✅ Daily fishing report configured!\n"
         f"**ZIP Code:** {zip_code}\n"
@@ -249,11 +361,12 @@ async def daily_logic(interaction, zip_code, fishing_type, time_range):
         f"**Channel:** <#{interaction.channel_id}>"
     )
 
+@logs.traced("time")
 async def time_logic(interaction, start, end, start_date, end_date, zip_code, fishing_type):
     user_id = interaction.user.id
     username = interaction.user.name
     date_info = f", dates: {start_date or 'today'} to {end_date or 'today'}" if start_date or end_date else ""
-    logger.info(f"Command /fish time - User: {username} (ID: {user_id}), window: {start} to {end}{date_info}, zip_code: {zip_code}")
+    logger.info("Command /fish time - User: %s (ID: %s), window: %s to %s%s, zip_code: %s", username, user_id, start, end, date_info, zip_code)
     
     zip_code = get_location(user_id, zip_code)
     if not fishing_type:
@@ -262,7 +375,7 @@ async def time_logic(interaction, start, end, start_date, end_date, zip_code, fi
         fishing_type = fishing_type.value
     
     if not zip_code:
-        logger.warning(f"User {username} attempted /fish time without location")
+        logger.warning("User %s attempted /fish time without location", username)
         await interaction.response.send_message("❌ please set your zip code first.", ephemeral=True)
         return
     
@@ -329,28 +442,34 @@ async def time_logic(interaction, start, end, start_date, end_date, zip_code, fi
         start_formatted = start_dt.strftime("%Y-%m-%d %H:%M")
         end_formatted = end_dt.strftime("%Y-%m-%d %H:%M")
         
-        await interaction.response.defer(thinking=True)
+        admitted = await admit_command(interaction)
+        if admitted is None:
+            return
         try:
-            report = await get_time_window_report(start_formatted, end_formatted, zip_code, fishing_type)
+            await interaction.response.defer(thinking=True)
+            report = await get_time_window_report(start_formatted, end_formatted, zip_code, fishing_type, user_id=user_id, admitted=admitted)
             if len(report) > 2000:
-                logger.warning(f"Report truncated for user {username} (length: {len(report)})")
+                logger.warning("Report truncated for user %s (length: %s)", username, len(report))
                 report = report[:1950] + "\n\n... (truncated)"
             await interaction.followup.send(report)
-            logger.info(f"Successfully sent time window report to {username}")
+            logger.info("Successfully sent time window report to %s", username)
         except Exception as e:
-            logger.error(f"Failed to send time window report to {username}: {str(e)}")
+            logger.error("Failed to send time window report to %s: %s", username, e)
             await interaction.followup.send(f"❌ Error: {str(e)}", ephemeral=True)
+        finally:
+                admitted.release()
     except (ValueError, AttributeError) as e:
-        logger.warning(f"User {username} provided invalid time format: {str(e)}")
+        logger.warning("User %s provided invalid time format: %s", username, e)
         await interaction.response.send_message(
             "❌ Invalid time format. Please use formats like: '3pm', '3 PM', '15:00', or '3:00 PM'",
             ephemeral=True
         )
 
+@logs.traced("week")
 async def week_logic(interaction, zip_code, fishing_type):
     user_id = interaction.user.id
     username = interaction.user.name
-    logger.info(f"Command /fish week - User: {username} (ID: {user_id}), zip_code: {zip_code}, type: {fishing_type}")
+    logger.info("Command /fish week - User: %s (ID: %s), zip_code: %s, type: %s", username, user_id, zip_code, fishing_type)
     
     zip_code = get_location(user_id, zip_code)
     if not fishing_type:
@@ -359,42 +478,49 @@ async def week_logic(interaction, zip_code, fishing_type):
         fishing_type = fishing_type.value
     
     if not zip_code:
-        logger.warning(f"User {username} attempted /fish week without location")
+        logger.warning("User %s attempted /fish week without location", username)
         await interaction.response.send_message("❌ Please set your ZIP code first.", ephemeral=True)
         return
     
-    await interaction.response.defer(thinking=True)
+    admitted = await admit_command(interaction)
+    if admitted is None:
+        return
     try:
-        report = await get_weekly_report(zip_code, fishing_type)
+        await interaction.response.defer(thinking=True)
+        report = await get_weekly_report(zip_code, fishing_type, user_id=user_id, admitted=admitted)
         if len(report) > 2000:
-            logger.warning(f"Report truncated for user {username} (length: {len(report)})")
+            logger.warning("Report truncated for user %s (length: %s)", username, len(report))
             report = report[:1950] + "\n\n... (truncated)"
         await interaction.followup.send(report)
-        logger.info(f"Successfully sent weekly report to {username}")
+        logger.info("Successfully sent weekly report to %s", username)
     except Exception as e:
-        logger.error(f"Failed to send weekly report to {username}: {str(e)}")
+        logger.error("Failed to send weekly report to %s: %s", username, e)
         await interaction.followup.send(f"❌ Error: {str(e)}", ephemeral=True)
+    finally:
+        admitted.release()
 
+@logs.traced("set")
 async def set_logic(interaction, zip_code, fishing_type):
     user_id = interaction.user.id
     username = interaction.user.name
-    logger.info(f"Command /fish set - User: {username} (ID: {user_id}), zip_code: {zip_code}, type: {fishing_type}")
+    logger.info("Command /fish set - User: %s (ID: %s), zip_code: %s, type: %s", username, user_id, zip_code, fishing_type)
     
     set_user_pref(user_id, "zip_code", zip_code)
     if fishing_type:
         set_user_pref(user_id, "fishing_type", fishing_type.value)
     
-    logger.info(f"Preferences saved for user {username}")
+    logger.info("Preferences saved for user %s", username)
     await interaction.response.send_message(
         f"✅ Preferences saved!\n"
         f"**ZIP Code:** {zip_code}\n"
         f"**Fishing Type:** {fishing_type.value if fishing_type else 'Not set'}"
     )
 
+@logs.traced("species")
 async def species_logic(interaction, species, zip_code, fishing_type):
     user_id = interaction.user.id
     username = interaction.user.name
-    logger.info(f"Command /fish species - User: {username} (ID: {user_id}), species: {species or 'all'}, zip_code: {zip_code}")
+    logger.info("Command /fish species - User: %s (ID: %s), species: %s, zip_code: %s", username, user_id, species or 'all', zip_code)
     
     zip_code = get_location(user_id, zip_code)
     if not fishing_type:
@@ -403,18 +529,23 @@ async def species_logic(interaction, species, zip_code, fishing_type):
         fishing_type = fishing_type.value
     
     if not zip_code:
-        logger.warning(f"User {username} attempted /fish species without location")
+        logger.warning("User %s attempted /fish species without location", username)
         await interaction.response.send_message("❌ Please set your ZIP code first.", ephemeral=True)
         return
     
-    await interaction.response.defer(thinking=True)
+    admitted = await admit_command(interaction)
+    if admitted is None:
+        return
     try:
-        report = await get_species_recommendations(species, zip_code, fishing_type)
+        await interaction.response.defer(thinking=True)
+        report = await get_species_recommendations(species, zip_code, fishing_type, user_id=user_id, admitted=admitted)
         if len(report) > 2000:
-            logger.warning(f"Report truncated for user {username} (length: {len(report)})")
+            logger.warning("Report truncated for user %s (length: %s)", username, len(report))
             report = report[:1950] + "\n\n... (truncated)"
         await interaction.followup.send(report)
-        logger.info(f"Successfully sent species recommendations to {username}")
+        logger.info("Successfully sent species recommendations to %s", username)
     except Exception as e:
-        logger.error(f"Failed to send species recommendations to {username}: {str(e)}")
+        logger.error("Failed to send species recommendations to %s: %s", username, e)
         await interaction.followup.send(f"❌ Error: {str(e)}", ephemeral=True)
+    finally:
+        admitted.release()
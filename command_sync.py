@@ -0,0 +1,68 @@
+"""
+Slash command sync that only talks to Discord when the commands changed.
+
+The command tree (names, descriptions, options and choices) is serialized
+the way it is sent to Discord and fingerprinted. The fingerprint of the
+last successful sync is kept per application in a small local JSON file,
+so restarts and gateway reconnects skip tree.sync(), which Discord rate
+limits heavily, unless a command actually changed.
+
+COMMAND_SYNC_STATE overrides the state file and FORCE_COMMAND_SYNC=1
+syncs regardless of the stored fingerprint.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "command_sync.json"
+
+
+def state_path():
+    return os.getenv("COMMAND_SYNC_STATE", STATE_FILE)
+
+
+def fingerprint(tree):
+    """sha256 of the tree's global commands as Discord receives them"""
+    commands = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda c: c["name"])
+    payload = json.dumps(commands, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _load_state(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        return {}
+
+
+def last_synced(application_id, path=None):
+    return _load_state(path or state_path()).get(str(application_id))
+
+
+def record_sync(application_id, value, path=None):
+    path = path or state_path()
+    state = _load_state(path)
+    state[str(application_id)] = value
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+
+
+async def sync_if_changed(tree, application_id, path=None, force=None):
+    """Sync the tree only if its fingerprint differs from the last sync; returns whether it synced"""
+    if force is None:
+        force = os.getenv("FORCE_COMMAND_SYNC", "") not in ("", "0")
+    current = fingerprint(tree)
+    if not force and last_synced(application_id, path) == current:
+        logger.info("Slash commands unchanged since last sync, skipping")
+        return False
+    await tree.sync()
+    record_sync(application_id, current, path)
+    logger.info("Slash commands synced (%s)", current[:12])
+    return True
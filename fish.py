@@ -1,6 +1,12 @@
 # Get fish species by latitude and longitude using iNaturalist API
 import json
+import os
 import requests
+import upstream
+from models import decode_species_counts
+
+# Base URL for iNaturalist (override to point at a local stub server)
+INATURALIST_BASE_URL = os.getenv("INATURALIST_BASE_URL", "https://api.inaturalist.org/v1")
 
 def load_config(config_file: str = "config.json"): # pragma: no cover
     """Load configuration from JSON file"""
@@ -9,7 +15,10 @@ def load_config(config_file: str = "config.json"): # pragma: no cover
     return config
 
 def get_fish(lat=None, lon=None): # pragma: no cover
-    """Get fish species data by latitude/longitude using iNaturalist API (free, no API key required)"""
+    """Get fish species data by latitude/longitude using iNaturalist API (free, no API key required)
+
+    Returns a models.SpeciesReport, or a dict with an "error" key on failure.
+    """
     # Use provided lat/lon or fall back to config
     if lat is None or lon is None:
         config = load_config()
@@ -21,7 +30,7 @@ def get_fish(lat=None, lon=None): # pragma: no cover
     
     # iNaturalist API - free, no API key required
     # Search for fish species observations near the given coordinates
-    base_url = "https://api.inaturalist.org/v1"
+    base_url = INATURALIST_BASE_URL
     
     # Calculate bounding box (approximately 100km radius)
     # 1 degree latitude ≈ 111 km
@@ -45,57 +54,23 @@ def get_fish(lat=None, lon=None): # pragma: no cover
     }
     
     try:
-        response = requests.get(f"{base_url}/observations/species_counts", params=params, timeout=15)
+        response = upstream.get("inaturalist", f"{base_url}/observations/species_counts", params=params, timeout=15)
         
         if response.status_code == 200:
-            data = response.json()
-            
-            if "results" in data and data["results"]:
-                # Extract species information
-                fish_species = []
-                for result in data["results"]:
-                    taxon = result.get("taxon", {})
-                    species_info = {
-                        "species": taxon.get("name", "Unknown"),
-                        "common_name": taxon.get("preferred_common_name") or taxon.get("name"),
-                        "count": result.get("count", 0),
-                        "id": taxon.get("id")
-                    }
-                    fish_species.append(species_info)
-                
-                # Return JSON data
-                result = {
-                    "location": {"lat": lat, "lon": lon},
-                    "total_observations": sum(r.get("count", 0) for r in data["results"]),
-                    "species_found": len(fish_species),
-                    "fish_species": fish_species[:10],  # Top 10 species (reduced to fit Discord limit)
-                    "source": "iNaturalist"
-                }
-                return json.dumps(result, indent=2)
-            else:
-                result = {
-                    "location": {"lat": lat, "lon": lon},
-                    "message": "No fish species found in this area",
-                    "total_observations": 0,
-                    "species_found": 0,
-                    "source": "iNaturalist"
-                }
-                return json.dumps(result, indent=2)
+            # Decoded straight from the body; only the top species reach the report
+            return decode_species_counts(response.content, lat, lon)
         else:
-            result = {
+            return {
                 "error": f"Request failed with status code: {response.status_code}",
                 "details": response.text[:500],
                 "url": response.url
             }
-            return json.dumps(result, indent=2)
     except requests.exceptions.RequestException as e:
-        result = {
+        return {
             "error": f"Network error: {str(e)}",
             "message": "Failed to connect to iNaturalist API"
         }
-        return json.dumps(result, indent=2)
     except Exception as e:
-        result = {
+        return {
             "error": f"Error processing data: {str(e)}"
         }
-        return json.dumps(result, indent=2)
@@ -0,0 +1,216 @@
+"""
+Token and cost accounting for Gemini requests.
+
+Every Gemini response is recorded with its usage metadata and the report
+context that produced it (report type, model, template, fishing_type and
+user). Totals are exported as metrics and kept in a rolling window that
+backs the usage summary and the token budgets in config.json:
+
+    "gemini_budget": {
+        "per_user_daily_tokens": 200000,
+        "global_daily_tokens": 2000000,
+        "fallback_model": "gemini-2.5-flash-lite"
+    }
+
+When a budget is exhausted, choose_model() switches requests to the
+cheaper fallback model until the window rolls over.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+import app_config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Length of the rolling window used for summaries and budgets
+ROLLING_WINDOW_SECONDS = 24 * 60 * 60
+
+DEFAULT_FALLBACK_MODEL = "gemini-2.5-flash-lite"
+
+# USD per 1M tokens; override with "gemini_pricing" in config.json
+DEFAULT_PRICING = {
+    "gemini-2.5-flash": {"input": 0.30, "output": 2.50, "cached": 0.075},
+    "gemini-2.5-flash-lite": {"input": 0.10, "output": 0.40, "cached": 0.025},
+    "gemini-2.5-pro": {"input": 1.25, "output": 10.00, "cached": 0.31},
+}
+
+GROUP_FIELDS = ("report_type", "model", "template", "fishing_type", "user_id")
+
+
+def extract_usage(response):
+    """Pull token counts out of a Gemini response's usage_metadata"""
+    usage = getattr(response, "usage_metadata", None)
+
+    def count(field):
+        value = getattr(usage, field, None) if usage is not None else None
+        return int(value or 0)
+
+    return {
+        "prompt_tokens": count("prompt_token_count"),
+        "output_tokens": count("candidates_token_count"),
+        "cached_tokens": count("cached_content_token_count"),
+        "thoughts_tokens": count("thoughts_token_count"),
+        "total_tokens": count("total_token_count"),
+    }
+
+
+def estimate_cost(usage, model, pricing=None):
+    """Estimate the USD cost of one request from its token counts"""
+    pricing = pricing or DEFAULT_PRICING
+    rates = pricing.get(model)
+    if not rates:
+        return 0.0
+    cached = usage.get("cached_tokens", 0)
+    uncached_prompt = max(usage.get("prompt_tokens", 0) - cached, 0)
+    # Thinking tokens are billed at the output rate
+    output = usage.get("output_tokens", 0) + usage.get("thoughts_tokens", 0)
+    cost = (
+        uncached_prompt * rates.get("input", 0)
+        + cached * rates.get("cached", rates.get("input", 0))
+        + output * rates.get("output", 0)
+    )
+    return cost / 1_000_000
+
+
+class UsageTracker:
+    """Thread-safe rolling record of Gemini usage events"""
+
+    def __init__(self, window_seconds=ROLLING_WINDOW_SECONDS, pricing=None):
+        self.window_seconds = window_seconds
+        self.pricing = pricing
+        self._events = deque()
+        self._lock = threading.Lock()
+
+    def record(self, response, model, report_type=None, template=None,
+               fishing_type=None, user_id=None, now=None):
+        """Record the usage of a single Gemini response and return the event"""
+        usage = extract_usage(response)
+        if not usage["total_tokens"]:
+            usage["total_tokens"] = (usage["prompt_tokens"] + usage["output_tokens"]
+                                     + usage["thoughts_tokens"])
+        event = {
+            "timestamp": now if now is not None else time.time(),
+            "report_type": report_type or "unknown",
+            "model": model,
+            "template": template or "none",
+            "fishing_type": fishing_type or "none",
+            "user_id": str(user_id) if user_id is not None else "system",
+            "cost_usd": estimate_cost(usage, model, self.pricing or _configured_pricing()),
+            **usage,
+        }
+        self.ingest(event)
+        logger.info(
+            "Gemini usage - report: %s, model: %s, prompt: %s, output: %s, cached: %s, user: %s",
+            event['report_type'], model, usage['prompt_tokens'], usage['output_tokens'],
+            usage['cached_tokens'], event['user_id'],
+        )
+        return event
+
+    def ingest(self, event):
+        """Add an already-built usage event (e.g. one recorded in a worker process)"""
+        with self._lock:
+            self._events.append(event)
+            self._prune(event["timestamp"])
+
+        labels = {
+            "report_type": event["report_type"],
+            "model": event["model"],
+            "template": event["template"],
+            "fishing_type": event["fishing_type"],
+        }
+        metrics.increment("gemini_requests_total", **labels)
+        for kind in ("prompt", "output", "cached", "thoughts"):
+            metrics.increment("gemini_tokens_total", event[f"{kind}_tokens"], kind=kind, **labels)
+        metrics.increment("gemini_cost_usd_total", event["cost_usd"], **labels)
+
+    def _prune(self, now):
+        cutoff = now - self.window_seconds
+        while self._events and self._events[0]["timestamp"] < cutoff:
+            self._events.popleft()
+
+    def events(self, now=None):
+        with self._lock:
+            self._prune(now if now is not None else time.time())
+            return list(self._events)
+
+    def tokens_used(self, user_id=None, now=None):
+        """Total tokens in the rolling window, optionally for a single user"""
+        events = self.events(now)
+        if user_id is not None:
+            events = [e for e in events if e["user_id"] == str(user_id)]
+        return sum(e["total_tokens"] for e in events)
+
+    def summary(self, group_by="report_type", now=None):
+        """Aggregate the rolling window by one of GROUP_FIELDS"""
+        if group_by not in GROUP_FIELDS:
+            raise ValueError(f"Cannot group usage by {group_by}. Expected one of {GROUP_FIELDS}")
+        totals = defaultdict(lambda: {"requests": 0, "prompt_tokens": 0, "output_tokens": 0,
+                                      "cached_tokens": 0, "total_tokens": 0, "cost_usd": 0.0})
+        for event in self.events(now):
+            bucket = totals[event[group_by]]
+            bucket["requests"] += 1
+            for field in ("prompt_tokens", "output_tokens", "cached_tokens", "total_tokens", "cost_usd"):
+                bucket[field] += event[field]
+        return dict(totals)
+
+    def format_summary(self, now=None):
+        """Human-readable rolling summary for logs"""
+        hours = self.window_seconds / 3600
+        lines = [f"Gemini usage over the last {hours:g}h:"]
+        for group_by in ("report_type", "model", "user_id"):
+            for name, bucket in sorted(self.summary(group_by, now).items()):
+                lines.append(
+                    f"  {group_by}={name}: {bucket['requests']} requests, "
+                    f"{bucket['total_tokens']} tokens, ${bucket['cost_usd']:.4f}"
+                )
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._events.clear()
+
+
+def _configured_pricing():
+    pricing = dict(DEFAULT_PRICING)
+    pricing.update(app_config.section("gemini_pricing"))
+    return pricing
+
+
+def load_budget():
+    return app_config.section("gemini_budget")
+
+
+def choose_model(model, user_id=None, tracker=None, budget=None):
+    """Return the model to use, falling back to the cheaper one if a budget is spent"""
+    if forced_model:
+        return forced_model
+    tracker = tracker or usage_tracker
+    budget = budget if budget is not None else load_budget()
+    fallback = budget.get("fallback_model", DEFAULT_FALLBACK_MODEL)
+    if not budget or model == fallback:
+        return model
+
+    global_limit = budget.get("global_daily_tokens")
+    if global_limit and tracker.tokens_used() >= global_limit:
+        logger.warning("Global Gemini token budget (%s) exceeded, using %s", global_limit, fallback)
+        metrics.increment("gemini_budget_fallbacks_total", scope="global")
+        return fallback
+
+    user_limit = budget.get("per_user_daily_tokens")
+    if user_limit and user_id is not None and tracker.tokens_used(user_id) >= user_limit:
+        logger.warning("Gemini token budget (%s) exceeded for user %s, using %s", user_limit, user_id, fallback)
+        metrics.increment("gemini_budget_fallbacks_total", scope="user")
+        return fallback
+
+    return model
+
+
+usage_tracker = UsageTracker()
+
+# Set inside report worker processes, which cannot see the bot's usage
+# totals, when the bot has already decided a budget is exhausted
+forced_model = None
@@ -0,0 +1,459 @@
+"""
+Offline tide prediction from a station's harmonic constituents.
+
+Water levels at a tide station are the sum of cosine terms, one per
+harmonic constituent, whose amplitudes and phases NOAA publishes. Those
+constants (plus the station's datums and time zone) are downloaded once
+per station and kept in the shared cache for a month. After that,
+predicted water levels and high/low tide times for any date range, weeks
+or years ahead, are computed locally with NumPy and need no network calls.
+
+Astronomical arguments follow Meeus, and nodal corrections use the usual
+Doodson/Schureman approximations. They are applied per calendar year
+like NOAA's own predictions. Compare against NOAA for a station with:
+
+    python -m harmonics 8665530 --begin 20250101 --end 20250131 --validate
+
+--record PATH saves the constants and NOAA's predictions instead. The
+tests compare against tests/fixtures/harmonics_8665530.json once it has
+been recorded and committed; until then the bot keeps the engine off
+("harmonic_predictions" defaults to false) and uses NOAA's predictions.
+
+Needs numpy, which is optional; without it callers fall back to NOAA.
+"""
+
+import argparse
+import array
+import calendar
+import json
+import logging
+import math
+import time
+from datetime import datetime, timedelta
+
+import cache
+from lazy import lazy_import
+from models import TideSeries, format_noaa_time, parse_noaa_time
+
+numpy = lazy_import("numpy")
+
+logger = logging.getLogger(__name__)
+
+# Harmonic constants only change when NOAA re-analyses a station
+CONSTANTS_TTL_SECONDS = 30 * 24 * 60 * 60
+
+# Doodson numbers (tau, s, h, p, N', p1) and phase offset in degrees for the
+# 37 constituents NOAA publishes. Offsets follow Schureman's Table 2 (e.g.
+# K1 = T+h-90, O1 = T-2s+h+90), the convention NOAA's Greenwich phases use.
+CONSTITUENTS = {
+    "M2": ((2, 0, 0, 0, 0, 0), 0), "S2": ((2, 2, -2, 0, 0, 0), 0), "N2": ((2, -1, 0, 1, 0, 0), 0),
+    "K1": ((1, 1, 0, 0, 0, 0), -90), "M4": ((4, 0, 0, 0, 0, 0), 0), "O1": ((1, -1, 0, 0, 0, 0), 90),
+    "M6": ((6, 0, 0, 0, 0, 0), 0), "MK3": ((3, 1, 0, 0, 0, 0), -90), "S4": ((4, 4, -4, 0, 0, 0), 0),
+    "MN4": ((4, -1, 0, 1, 0, 0), 0), "NU2": ((2, -1, 2, -1, 0, 0), 0), "S6": ((6, 6, -6, 0, 0, 0), 0),
+    "MU2": ((2, -2, 2, 0, 0, 0), 0), "2N2": ((2, -2, 0, 2, 0, 0), 0), "OO1": ((1, 3, 0, 0, 0, 0), -90),
+    "LAM2": ((2, 1, -2, 1, 0, 0), 180), "S1": ((1, 1, -1, 0, 0, 0), 0), "M1": ((1, 0, 0, 0, 0, 0), -90),
+    "J1": ((1, 2, 0, -1, 0, 0), -90), "MM": ((0, 1, 0, -1, 0, 0), 0), "SSA": ((0, 0, 2, 0, 0, 0), 0),
+    "SA": ((0, 0, 1, 0, 0, 0), 0), "MSF": ((0, 2, -2, 0, 0, 0), 0), "MF": ((0, 2, 0, 0, 0, 0), 0),
+    "RHO": ((1, -2, 2, -1, 0, 0), 90), "Q1": ((1, -2, 0, 1, 0, 0), 90), "T2": ((2, 2, -3, 0, 0, 1), 0),
+    "R2": ((2, 2, -1, 0, 0, -1), 180), "2Q1": ((1, -3, 0, 2, 0, 0), 90), "P1": ((1, 1, -2, 0, 0, 0), 90),
+    "2SM2": ((2, 4, -4, 0, 0, 0), 0), "M3": ((3, 0, 0, 0, 0, 0), 0), "L2": ((2, 1, 0, -1, 0, 0), 180),
+    "2MK3": ((3, -1, 0, 0, 0, 0), 90), "K2": ((2, 2, 0, 0, 0, 0), 0), "M8": ((8, 0, 0, 0, 0, 0), 0),
+    "MS4": ((4, 2, -2, 0, 0, 0), 0),
+}
+
+# Nodal factor of each constituent as powers of the basic lunar factors below
+# (f is multiplied, u added); constituents not listed are solar (f=1, u=0)
+NODAL = {
+    "M2": {"M2": 1}, "N2": {"M2": 1}, "2N2": {"M2": 1}, "NU2": {"M2": 1}, "MU2": {"M2": 1},
+    "LAM2": {"M2": 1}, "L2": {"M2": 1}, "MS4": {"M2": 1}, "MSF": {"M2": -1}, "2SM2": {"M2": -1},
+    "M4": {"M2": 2}, "MN4": {"M2": 2}, "M6": {"M2": 3}, "M8": {"M2": 4}, "M3": {"M2": 1.5},
+    "K1": {"K1": 1}, "O1": {"O1": 1}, "Q1": {"O1": 1}, "2Q1": {"O1": 1}, "RHO": {"O1": 1}, "M1": {"O1": 1},
+    "K2": {"K2": 1}, "J1": {"J1": 1}, "OO1": {"OO1": 1}, "MF": {"MF": 1}, "MM": {"MM": 1},
+    "MK3": {"M2": 1, "K1": 1}, "2MK3": {"M2": 2, "K1": -1},
+}
+
+# Rates (degrees per hour) of the Doodson arguments, for constants without a speed
+DOODSON_SPEEDS = (14.4920521, 0.5490165, 0.0410686, 0.0046418, 0.0022064, 0.0000020)
+
+J2000 = calendar.timegm((2000, 1, 1, 12, 0, 0))
+
+# Samples per block when summing, to bound the (constituents x samples) matrix
+BLOCK = 8192
+
+
+def astronomical_arguments(seconds):
+    """Mean longitudes (degrees) of moon s, sun h, lunar perigee p, lunar node N and solar perigee p1"""
+    T = (seconds - J2000) / (86400 * 36525.0)
+    return {
+        "s": (218.3164477 + 481267.88123421 * T) % 360,
+        "h": (280.46646 + 36000.76983 * T) % 360,
+        "p": (83.3532465 + 4069.0137287 * T) % 360,
+        "N": (125.04452 - 1934.136261 * T) % 360,
+        "p1": (282.93768 + 1.71946 * T) % 360,
+    }
+
+
+def equilibrium_argument(name, seconds):
+    """V0 (degrees) of a constituent at a UTC time"""
+    args = astronomical_arguments(seconds)
+    hours = (seconds % 86400) / 3600.0
+    tau = 180 + 15 * hours + args["h"] - args["s"]
+    doodson, offset = CONSTITUENTS[name]
+    terms = (tau, args["s"], args["h"], args["p"], -args["N"], args["p1"])
+    return (sum(d * x for d, x in zip(doodson, terms)) + offset) % 360
+
+
+def _basic_factors(N):
+    n = math.radians(N)
+    c1, c2, c3 = math.cos(n), math.cos(2 * n), math.cos(3 * n)
+    s1, s2, s3 = math.sin(n), math.sin(2 * n), math.sin(3 * n)
+    return {
+        "M2": (1.0004 - 0.0373 * c1 + 0.0002 * c2, -2.14 * s1),
+        "K1": (1.0060 + 0.1150 * c1 - 0.0088 * c2 + 0.0006 * c3, -8.86 * s1 + 0.68 * s2 - 0.07 * s3),
+        "O1": (1.0089 + 0.1871 * c1 - 0.0147 * c2 + 0.0014 * c3, 10.80 * s1 - 1.34 * s2 + 0.19 * s3),
+        "K2": (1.0241 + 0.2863 * c1 + 0.0083 * c2 - 0.0015 * c3, -17.74 * s1 + 0.68 * s2 - 0.04 * s3),
+        "J1": (1.0129 + 0.1676 * c1 - 0.0170 * c2 + 0.0016 * c3, -12.94 * s1 + 1.34 * s2 - 0.19 * s3),
+        "OO1": (1.1027 + 0.6504 * c1 + 0.0317 * c2 - 0.0014 * c3, -36.68 * s1 + 4.02 * s2 - 0.57 * s3),
+        "MF": (1.0429 + 0.4135 * c1 - 0.0040 * c2, -23.74 * s1 + 2.68 * s2 - 0.38 * s3),
+        "MM": (1.0000 - 0.1300 * c1 + 0.0013 * c2, 0.0),
+    }
+
+
+def nodal_factors(name, seconds):
+    """(f, u) for a constituent at a UTC time: amplitude factor and phase correction in degrees"""
+    basic = _basic_factors(astronomical_arguments(seconds)["N"])
+    f, u = 1.0, 0.0
+    for base, power in NODAL.get(name, {}).items():
+        base_f, base_u = basic[base]
+        f *= base_f ** abs(power)
+        u += power * base_u
+    return f, u
+
+
+@cache.register_type
+class HarmonicConstants:
+    """A station's harmonic constituents, datums and time zone"""
+
+    __slots__ = ("station_id", "units", "names", "amplitudes", "phases", "speeds",
+                 "datums", "timezone_offset", "observes_dst", "metadata")
+
+    def __init__(self, station_id, units, names, amplitudes, phases, speeds, datums=None,
+                 timezone_offset=0, observes_dst=False, metadata=None):
+        self.station_id = station_id
+        self.units = units
+        self.names = list(names)
+        self.amplitudes = list(amplitudes)
+        # Greenwich phase lags (degrees)
+        self.phases = list(phases)
+        self.speeds = list(speeds)
+        self.datums = datums or {}
+        # Hours from UTC to local standard time
+        self.timezone_offset = timezone_offset
+        self.observes_dst = observes_dst
+        self.metadata = metadata or {}
+
+    @classmethod
+    def decode(cls, station_id, units, constituents, datums=None, details=None):
+        """From the metadata API harcon, datums and station records"""
+        details = details or {}
+        names, amplitudes, phases, speeds = [], [], [], []
+        for row in constituents:
+            name = str(row.get("name", "")).upper()
+            if name not in CONSTITUENTS or not row.get("amplitude"):
+                continue
+            speed = row.get("speed")
+            if speed is None:
+                speed = sum(d * rate for d, rate in zip(CONSTITUENTS[name][0], DOODSON_SPEEDS))
+            names.append(name)
+            amplitudes.append(float(row["amplitude"]))
+            phases.append(float(row.get("phase_GMT", 0)))
+            speeds.append(float(speed))
+        metadata = {"id": station_id, "name": details.get("name"), "lat": details.get("lat"),
+                    "lon": details.get("lng", details.get("lon")), "source": "harmonic"}
+        return cls(station_id, units, names, amplitudes, phases, speeds, datums,
+                   float(details.get("timezonecorr") or 0), bool(details.get("observedst")), metadata)
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+def load_constants(station_id, units="metric", api=None):
+    """Harmonic constants for a station, downloaded once and then served from the cache
+
+    Returns None when NOAA has no constituents for the station (e.g. current
+    or meteorological stations).
+    """
+    key = f"harmonics:{station_id}:{units}"
+    constants = cache.get(key)
+    if constants is not None:
+        return constants
+    if api is None:
+        # Imported here: noaa_tides_currents uses this module for predictions
+        from noaa_tides_currents import NOAACoOpsAPI
+        api = NOAACoOpsAPI()
+    constituents = api.get_harmonic_constituents(station_id, units)
+    if not constituents:
+        return None
+    constants = HarmonicConstants.decode(station_id, units, constituents, api.get_datums(station_id, units),
+                                         api.get_station_details(station_id))
+    cache.set(key, constants, ttl=CONSTANTS_TTL_SECONDS)
+    logger.info("Cached %d harmonic constituents for station %s", len(constants.names), station_id)
+    return constants
+
+
+def _require_numpy():
+    if numpy is None:
+        raise RuntimeError("Harmonic tide prediction needs numpy (pip install numpy)")
+
+
+def heights(constants, utc_seconds):
+    """Predicted heights relative to mean sea level at UTC epoch seconds"""
+    _require_numpy()
+    utc_seconds = numpy.asarray(utc_seconds, dtype=numpy.int64)
+    out = numpy.zeros(len(utc_seconds))
+    if not len(utc_seconds) or not constants.names:
+        return out
+    amplitudes = numpy.array(constants.amplitudes)
+    speeds = numpy.array(constants.speeds)
+    lags = numpy.array(constants.phases)
+
+    first = time.gmtime(int(utc_seconds.min())).tm_year
+    last = time.gmtime(int(utc_seconds.max())).tm_year
+    for year in range(first, last + 1):
+        # Like NOAA: V0 at the start of the year, nodal factors at mid-year
+        epoch = calendar.timegm((year, 1, 1, 0, 0, 0))
+        middle = calendar.timegm((year, 7, 2, 12, 0, 0))
+        in_year = (utc_seconds >= epoch) & (utc_seconds < calendar.timegm((year + 1, 1, 1, 0, 0, 0)))
+        if not in_year.any():
+            continue
+        factors = [nodal_factors(name, middle) for name in constants.names]
+        f = numpy.array([factor for factor, _ in factors])
+        phase = numpy.array([equilibrium_argument(name, epoch) + u
+                             for name, (_, u) in zip(constants.names, factors)]) - lags
+        hours = (utc_seconds[in_year] - epoch) / 3600.0
+        weights = f * amplitudes
+        sums = numpy.empty(len(hours))
+        for start in range(0, len(hours), BLOCK):
+            block = hours[start:start + BLOCK]
+            sums[start:start + BLOCK] = weights @ numpy.cos(
+                numpy.radians(numpy.outer(speeds, block) + phase[:, None]))
+        out[in_year] = sums
+    return out
+
+
+def _dst_bounds(year):
+    """Local clock seconds when US daylight saving time starts and ends (second Sunday of March to first Sunday of November)"""
+    march = datetime(year, 3, 1)
+    start = march + timedelta(days=(6 - march.weekday()) % 7 + 7, hours=2)
+    november = datetime(year, 11, 1)
+    end = november + timedelta(days=(6 - november.weekday()) % 7, hours=2)
+    return calendar.timegm(start.timetuple()), calendar.timegm(end.timetuple())
+
+
+def _us_dst(local_seconds):
+    """Whether local clock times fall in US daylight saving time"""
+    dst = numpy.zeros(len(local_seconds), dtype=bool)
+    if not len(local_seconds):
+        return dst
+    first = time.gmtime(int(local_seconds.min())).tm_year
+    last = time.gmtime(int(local_seconds.max())).tm_year
+    for year in range(first, last + 1):
+        start, end = _dst_bounds(year)
+        dst |= (local_seconds >= start) & (local_seconds < end)
+    return dst
+
+
+def local_clock(utc_seconds, timezone_offset, observes_dst, time_zone):
+    """Clock time in a NOAA time zone (gmt, lst or lst_ldt) for a UTC epoch, read as UTC like NOAA's stamps"""
+    if time_zone == "gmt":
+        return int(utc_seconds)
+    local = int(utc_seconds + timezone_offset * 3600)
+    if time_zone == "lst_ldt" and observes_dst:
+        start, end = _dst_bounds(time.gmtime(local).tm_year)
+        if start <= local < end:
+            local += 3600
+    return local
+
+
+def _to_utc(constants, local_seconds, time_zone):
+    """UTC seconds for clock times in a NOAA time zone (gmt, lst or lst_ldt)"""
+    if time_zone == "gmt":
+        return local_seconds
+    utc = local_seconds - int(constants.timezone_offset * 3600)
+    if time_zone == "lst_ldt" and constants.observes_dst:
+        utc = utc - _us_dst(local_seconds) * 3600
+    return utc
+
+
+def high_low(times, values):
+    """(time, height, "H" or "L") for each turning point, refined between samples
+
+    times must be evenly spaced.
+    """
+    _require_numpy()
+    times = numpy.asarray(times)
+    values = numpy.asarray(values, dtype=float)
+    if len(values) < 3:
+        return []
+    step = float(times[1] - times[0])
+    slope = numpy.sign(numpy.diff(values))
+    turns = numpy.nonzero(slope[:-1] != slope[1:])[0] + 1
+    results = []
+    for i in turns:
+        if slope[i - 1] == 0:
+            continue
+        y0, y1, y2 = values[i - 1], values[i], values[i + 1]
+        curvature = y0 - 2 * y1 + y2
+        delta = 0.5 * (y0 - y2) / curvature if curvature else 0.0
+        results.append((float(times[i]) + delta * step, y1 - 0.25 * (y0 - y2) * delta,
+                        "H" if slope[i - 1] > 0 else "L"))
+    return results
+
+
+INTERVAL_SECONDS = {"6": 360, "h": 3600, "1": 60}
+
+
+def predict_series(constants, begin_date, end_date, datum="MLLW", time_zone="gmt", interval="h"):
+    """Predicted water levels as a TideSeries, shaped like NOAA's predictions product
+
+    begin_date and end_date are inclusive YYYYMMDD dates in time_zone.
+    interval is "6", "h" or "hilo" (high and low tides only).
+    """
+    _require_numpy()
+    if datum != "MSL" and datum not in constants.datums:
+        raise ValueError(f"Station {constants.station_id} has no {datum} datum")
+    offset = constants.datums.get("MSL", 0.0) - constants.datums.get(datum, 0.0) if datum != "MSL" else 0.0
+    start = parse_noaa_time(f"{begin_date[:4]}-{begin_date[4:6]}-{begin_date[6:8]} 00:00")
+    stop = parse_noaa_time(f"{end_date[:4]}-{end_date[4:6]}-{end_date[6:8]} 00:00") + 86400
+
+    if interval == "hilo":
+        # Sample a little past the range so turning points at its edges are found
+        local = numpy.arange(start - 6 * 3600, stop + 6 * 3600, INTERVAL_SECONDS["6"], dtype=numpy.int64)
+        values = heights(constants, _to_utc(constants, local, time_zone)) + offset
+        turns = [(int(round(t / 60.0)) * 60, h, label) for t, h, label in high_low(local, values)
+                 if start <= t < stop]
+        return TideSeries(dict(constants.metadata), array.array("q", [t for t, _, _ in turns]),
+                          {"v": array.array("d", [round(h, 3) for _, h, _ in turns])},
+                          [label for _, _, label in turns])
+
+    local = numpy.arange(start, stop, INTERVAL_SECONDS[interval], dtype=numpy.int64)
+    values = numpy.round(heights(constants, _to_utc(constants, local, time_zone)) + offset, 3)
+    return TideSeries(dict(constants.metadata), array.array("q", local.tolist()),
+                      {"v": array.array("d", values.tolist())})
+
+
+def _noaa_predictions(station_id, begin_date, end_date, datum, units, api):
+    if api is None:
+        from noaa_tides_currents import NOAACoOpsAPI
+        api = NOAACoOpsAPI()
+    constants = load_constants(station_id, units, api)
+    if constants is None:
+        raise ValueError(f"NOAA has no harmonic constituents for station {station_id}")
+    noaa = api.get_predictions(station_id, begin_date, end_date, datum=datum, units=units, quiet=True)
+    noaa_hilo = api.get_predictions(station_id, begin_date, end_date, datum=datum, units=units,
+                                    interval="hilo", quiet=True)
+    if not isinstance(noaa, TideSeries) or not isinstance(noaa_hilo, TideSeries):
+        raise RuntimeError(f"NOAA predictions unavailable for station {station_id}")
+    return constants, noaa, noaa_hilo
+
+
+def compare(constants, noaa, noaa_hilo, begin_date, end_date, datum="MLLW"):
+    """Compare local predictions with NOAA's hourly and high/low predictions (GMT)
+
+    Returns RMSE and worst error of hourly heights, and the mean and worst
+    timing (minutes) and height errors of high and low tides.
+    """
+    ours = predict_series(constants, begin_date, end_date, datum=datum)
+    ours_hilo = predict_series(constants, begin_date, end_date, datum=datum, interval="hilo")
+
+    local = dict(zip(ours.times, ours.values()))
+    errors = numpy.array([local[t] - v for t, v in zip(noaa.times, noaa.values()) if t in local])
+    timing, height = [], []
+    for t, v, label in zip(noaa_hilo.times, noaa_hilo.values(), noaa_hilo.labels or []):
+        candidates = [(abs(ot - t), ov) for ot, ov, ol in zip(ours_hilo.times, ours_hilo.values(), ours_hilo.labels)
+                      if ol[0] == label[0]]
+        if candidates:
+            gap, ov = min(candidates)
+            timing.append(gap / 60.0)
+            height.append(abs(ov - v))
+    return {
+        "station": constants.station_id,
+        "samples": len(errors),
+        "rmse": float(numpy.sqrt(numpy.mean(errors ** 2))) if len(errors) else None,
+        "max_error": float(numpy.abs(errors).max()) if len(errors) else None,
+        "tides": len(timing),
+        "mean_timing_minutes": float(numpy.mean(timing)) if timing else None,
+        "max_timing_minutes": float(numpy.max(timing)) if timing else None,
+        "mean_height_error": float(numpy.mean(height)) if height else None,
+    }
+
+
+def validate(station_id, begin_date, end_date, datum="MLLW", units="metric", api=None):
+    """compare() against predictions downloaded from NOAA now"""
+    constants, noaa, noaa_hilo = _noaa_predictions(station_id, begin_date, end_date, datum, units, api)
+    return compare(constants, noaa, noaa_hilo, begin_date, end_date, datum)
+
+
+def record(path, station_id, begin_date, end_date, datum="MLLW", units="metric", api=None):
+    """Save a station's harmonic constants and NOAA's predictions as a JSON fixture
+
+    Tests replay the fixture with compare(), so the predictor is checked
+    against NOAA without network access.
+    """
+    constants, noaa, noaa_hilo = _noaa_predictions(station_id, begin_date, end_date, datum, units, api)
+    fixture = {"station": station_id, "begin_date": begin_date, "end_date": end_date, "datum": datum,
+               "units": units, "constants": constants.to_dict(),
+               "predictions": noaa.to_dict(), "hilo": noaa_hilo.to_dict()}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(fixture, f, indent=1)
+    return fixture
+
+
+def load_fixture(path):
+    """(constants, predictions, hilo, fixture) from a file written by record()"""
+    with open(path, 'r', encoding='utf-8') as f:
+        fixture = json.load(f)
+    return (HarmonicConstants.from_dict(fixture["constants"]), TideSeries.from_dict(fixture["predictions"]),
+            TideSeries.from_dict(fixture["hilo"]), fixture)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline harmonic tide predictions")
+    parser.add_argument("station", help="Station ID, e.g. 8665530")
+    parser.add_argument("--begin", required=True, help="Start date (YYYYMMDD)")
+    parser.add_argument("--end", required=True, help="End date (YYYYMMDD)")
+    parser.add_argument("--datum", default="MLLW")
+    parser.add_argument("--units", default="metric", choices=("metric", "english"))
+    parser.add_argument("--time-zone", default="lst_ldt", choices=("gmt", "lst", "lst_ldt"))
+    parser.add_argument("--validate", action="store_true", help="Compare with NOAA's predictions")
+    parser.add_argument("--record", metavar="PATH",
+                        help="Save the constants and NOAA's predictions as a test fixture")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record(args.record, args.station, args.begin, args.end, datum=args.datum, units=args.units)
+        print(f"Recorded station {args.station} {args.begin}-{args.end} to {args.record}")
+        return args.record
+
+    if args.validate:
+        result = validate(args.station, args.begin, args.end, datum=args.datum, units=args.units)
+        for key, value in result.items():
+            print(f"{key:<22} {value}")
+        return result
+
+    constants = load_constants(args.station, args.units)
+    if constants is None:
+        parser.error(f"NOAA has no harmonic constituents for station {args.station}")
+    series = predict_series(constants, args.begin, args.end, datum=args.datum,
+                            time_zone=args.time_zone, interval="hilo")
+    for t, v, label in zip(series.times, series.values(), series.labels):
+        print(f"{format_noaa_time(t)}  {label:<2} {v:7.3f}")
+    return series
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Request hedging for long-tail upstreams.
+
+If a request has not finished by the upstream's observed latency
+percentile, a duplicate is fired and whichever finishes first wins.
+Configured in the "hedging" part of the "upstream" section of config.json:
+
+    "hedging": {
+        "enabled": true,
+        "providers": ["noaa", "inaturalist"],
+        "percentile": 90,
+        "max_hedge_rate": 0.1,
+        "min_samples": 20
+    }
+
+max_hedge_rate caps the share of recent requests that may be hedged so a
+slow upstream is never hit with double the load. Requests never queue in
+the hedging pool: a request is only hedged when max_workers has room for
+it and its duplicate, otherwise it runs unhedged in the calling thread, so
+time spent waiting for a worker can't be mistaken for a slow upstream.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+import resilience
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    "providers": ["noaa", "inaturalist"],
+    "percentile": 90,
+    "max_hedge_rate": 0.1,
+    "min_samples": 20,
+    "min_delay": 0.05,
+    "max_workers": 16,
+}
+
+# Number of recent requests used to enforce max_hedge_rate
+RATE_WINDOW = 1000
+
+LATENCY_SERIES = "upstream_request_seconds"
+
+_executor = None
+_executor_lock = threading.Lock()
+# Pool tasks submitted and not finished yet
+_busy = 0
+_busy_lock = threading.Lock()
+_recent = deque(maxlen=RATE_WINDOW)
+_recent_lock = threading.Lock()
+
+
+def get_settings():
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(resilience.get_settings().get("hedging", {}))
+    return settings
+
+
+def _get_executor(max_workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        return _executor
+
+
+def _claim(max_workers, room):
+    """Take a pool worker if room workers are free, so nothing waits in the pool's queue"""
+    global _busy
+    with _busy_lock:
+        if _busy + room > max_workers:
+            return False
+        _busy += 1
+        return True
+
+
+def _pooled(provider, fn):
+    global _busy
+    try:
+        return _timed(provider, fn)
+    finally:
+        with _busy_lock:
+            _busy -= 1
+
+
+def hedge_delay(provider, settings=None):
+    """Seconds to wait before hedging, or None if there is not enough history"""
+    settings = settings or get_settings()
+    if metrics.observation_count(LATENCY_SERIES, provider=provider) < settings["min_samples"]:
+        return None
+    delay = metrics.percentile(LATENCY_SERIES, settings["percentile"], provider=provider)
+    return max(delay, settings["min_delay"])
+
+
+def _hedge_allowed(max_rate):
+    with _recent_lock:
+        if not _recent:
+            return max_rate > 0
+        return (sum(_recent) + 1) / (len(_recent) + 1) <= max_rate
+
+
+def _note_request(hedged):
+    with _recent_lock:
+        _recent.append(1 if hedged else 0)
+
+
+def reset():
+    """Forget request history (used by tests)"""
+    with _recent_lock:
+        _recent.clear()
+
+
+def _timed(provider, fn):
+    started = time.perf_counter()
+    try:
+        return fn()
+    finally:
+        metrics.observe(LATENCY_SERIES, time.perf_counter() - started, provider=provider)
+
+
+def run(provider, fn):
+    """Call fn(), hedging it with a duplicate call if it is slower than usual"""
+    settings = get_settings()
+    if not settings["enabled"] or provider not in settings["providers"]:
+        return _timed(provider, fn)
+
+    delay = hedge_delay(provider, settings)
+    if delay is None:
+        _note_request(False)
+        return _timed(provider, fn)
+
+    # The primary only goes to the pool if a worker is also free for its hedge
+    if not _claim(settings["max_workers"], 2):
+        metrics.increment("upstream_hedges_skipped_total", provider=provider)
+        _note_request(False)
+        return _timed(provider, fn)
+
+    executor = _get_executor(settings["max_workers"])
+    primary = executor.submit(_pooled, provider, fn)
+    done, _ = wait([primary], timeout=delay)
+    if done or not _hedge_allowed(settings["max_hedge_rate"]):
+        _note_request(False)
+        return primary.result()
+    if not _claim(settings["max_workers"], 1):
+        metrics.increment("upstream_hedges_skipped_total", provider=provider)
+        _note_request(False)
+        return primary.result()
+
+    _note_request(True)
+    metrics.increment("upstream_hedges_total", provider=provider)
+    logger.info("Hedging %s request after %.2fs", provider, delay)
+    hedge = executor.submit(_pooled, provider, fn)
+
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    metrics.increment("upstream_hedge_wins_total", provider=provider)
+                return future.result()
+            error = future.exception()
+    raise error
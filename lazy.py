@@ -0,0 +1,45 @@
+"""
+Deferred imports for heavy dependencies.
+
+lazy_import returns a stand-in for a module that imports it on first
+attribute access, so the bot can start (and tests can import the report
+modules) without paying for google.genai or numpy until they are used.
+Report threads may race to that first access; the import runs once,
+under a lock.
+"""
+
+import importlib
+import importlib.util
+import threading
+
+
+class LazyModule:
+    """Proxy that imports the named module when an attribute is first read"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._module or self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name):
+    """name as a LazyModule, or None if it isn't installed"""
+    try:
+        if importlib.util.find_spec(name) is None:
+            return None
+    except ModuleNotFoundError:
+        return None
+    return LazyModule(name)
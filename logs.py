@@ -0,0 +1,201 @@
+"""
+Non-blocking, structured logging for the bot.
+
+configure() routes every log record through a QueueHandler: the caller
+(often the event loop thread) only puts the record on an in-memory queue,
+and a QueueListener thread formats and writes it. Records carry the
+request id of the slash command being handled and any structured fields
+passed in extra=, such as the stage and duration_ms logged by stage().
+Configured in the "logging" section of config.json:
+
+    "logging": {
+        "level": "INFO",
+        "format": "json",
+        "sample": {"call_gemini": 0.25}
+    }
+
+format is "text" (the classic one-line format) or "json" (one JSON object
+per line). sample keeps that fraction of INFO and DEBUG lines from a
+logger and its children. Warnings and errors are never sampled, and
+neither are stage events. LOG_LEVEL and LOG_FORMAT override the config.
+"""
+
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import app_config
+
+DEFAULT_SETTINGS = {"level": "INFO", "format": "text", "sample": {}}
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed in extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def get_settings():
+    settings = app_config.section("logging", DEFAULT_SETTINGS)
+    if os.getenv("LOG_LEVEL"):
+        settings["level"] = os.getenv("LOG_LEVEL")
+    if os.getenv("LOG_FORMAT"):
+        settings["format"] = os.getenv("LOG_FORMAT")
+    return settings
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request id"""
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps one in 1/rate INFO and DEBUG records per logger and message"""
+
+    def __init__(self, rates):
+        super().__init__()
+        # Longest prefix first so "call_gemini.x" beats "call_gemini"
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def _rate(self, name):
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return rate
+        return None
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or hasattr(record, "stage"):
+            return True
+        rate = self._rate(record.name)
+        if rate is None or rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        every = round(1 / rate)
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with extra= fields at the top level"""
+
+    def format(self, record):
+        event = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and value is not None:
+                event[key] = value
+        if record.exc_info:
+            event["exception"] = self.formatException(record.exc_info)
+        return json.dumps(event, default=str, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # The stock prepare() runs the full formatter here, on the logging thread.
+        # Merging the arguments is enough to freeze the message; the listener formats it.
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_listener = None
+_lock = threading.Lock()
+
+
+def configure(settings=None, stream=None):
+    """Send all logging through a queue to a background writer; returns the listener"""
+    global _listener
+    settings = {**get_settings(), **(settings or {})}
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+        writer = logging.StreamHandler(stream)
+        if settings["format"] == "json":
+            writer.setFormatter(JsonFormatter())
+        else:
+            writer.setFormatter(logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+        records = queue.SimpleQueue()
+        handler = _QueueHandler(records)
+        handler.addFilter(RequestIdFilter())
+        if settings["sample"]:
+            handler.addFilter(SamplingFilter(settings["sample"]))
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(str(settings["level"]).upper())
+        _listener = logging.handlers.QueueListener(records, writer, respect_handler_level=True)
+        _listener.start()
+        return _listener
+
+
+def shutdown():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(shutdown)
+
+
+@contextmanager
+def stage(logger, name, **fields):
+    """Log a structured event with name's duration_ms and outcome when the block ends"""
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info("%s finished in %.1f ms (%s)", name, duration_ms, outcome,
+                    extra={"stage": name, "duration_ms": duration_ms, "outcome": outcome, **fields})
+
+
+def traced(command):
+    """Decorate a slash-command handler: give it a request id and time it as a stage"""
+    def decorate(handler):
+        logger = logging.getLogger(handler.__module__)
+
+        @functools.wraps(handler)
+        async def run(interaction, *args, **kwargs):
+            token = request_id.set(str(getattr(interaction, "id", None) or uuid.uuid4().hex[:16]))
+            try:
+                with stage(logger, "command", command=command):
+                    return await handler(interaction, *args, **kwargs)
+            finally:
+                request_id.reset(token)
+        return run
+    return decorate
@@ -7,17 +7,21 @@ import json
 import logging
 from datetime import datetime
 from dotenv import load_dotenv
-from command_logic import get_today_report, get_tomorrow_report, today_logic, tomorrow_logic, daily_logic, week_logic, set_logic, species_logic, time_logic, get_location, get_user_pref, set_user_pref, send_daily_report
+import metrics
+import command_sync
+import logs
+import precompute
+import report_workers
+import sharding
+from gemini_usage import usage_tracker
+from command_logic import get_today_report, get_tomorrow_report, today_logic, tomorrow_logic, daily_logic, week_logic, set_logic, species_logic, time_logic, get_location, get_user_pref, set_user_pref, send_daily_report, precompute_popular_reports
 
 load_dotenv()
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 CHANNEL_ID = int(os.getenv("CHANNEL_ID"))
+METRICS_PORT = os.getenv("METRICS_PORT")
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+logs.configure()
 logger = logging.getLogger(__name__)
 
 CONFIG_FILE = "config.json"
@@ -32,10 +36,10 @@ def load_config(): # pragma: no cover
         return {}
 
 # Discord Bot Setup
-intents = discord.Intents.default()
-intents.messages = True
-intents.message_content = True
-bot = discord.Client(intents=intents)
+# Slash commands arrive as interactions regardless of intents; guilds keeps the channel cache for daily reports
+intents = discord.Intents.none()
+intents.guilds = True
+bot = discord.AutoShardedClient(intents=intents, **sharding.client_options())
 tree = app_commands.CommandTree(bot)
 
 # Slash Commands Group
@@ -84,7 +88,7 @@ async def fish_daily(interaction: discord.Interaction, time: str, zip_code: str
     """Set up automatic daily report"""
     user_id = interaction.user.id
     username = interaction.user.name
-    logger.info(f"Command /fish daily - User: {username} (ID: {user_id}), time: {time}, zip_code: {zip_code}")
+    logger.info("Command /fish daily - User: %s (ID: %s), time: %s, zip_code: %s", username, user_id, time, zip_code)
     
     zip_code = get_location(user_id, zip_code)
     if not fishing_type:
@@ -139,7 +143,7 @@ async def fish_daily(interaction: discord.Interaction, time: str, zip_code: str
         report_time = parse_single_time(time)
         
     except (ValueError, AttributeError) as e:
-        logger.warning(f"User {username} provided invalid time format: {str(e)}")
+        logger.warning("User %s provided invalid time format: %s", username, e)
         await interaction.response.send_message(
             "❌ Invalid time format. Please use formats like: '8 AM', '3 PM', '08:00', or '15:00'",
             ephemeral=True
@@ -152,8 +156,9 @@ async def fish_daily(interaction: discord.Interaction, time: str, zip_code: str
     set_user_pref(user_id, "daily_report_time", report_time)
     set_user_pref(user_id, "daily_report_enabled", True)
     set_user_pref(user_id, "daily_report_channel", interaction.channel_id)
+    set_user_pref(user_id, "daily_report_guild", interaction.guild_id)
     
-    logger.info(f"Daily report configured for user {username} - time: {report_time}, location: {zip_code}")
+    logger.info("Daily report configured for user %s - time: %s, location: %s", username, report_time, zip_code)
     await interaction.response.send_message(
         f"✅ Daily fishing report configured!\n"
         f"**ZIP Code:** {zip_code}\n"
@@ -228,11 +233,15 @@ tree.add_command(fish_group)
 
 @bot.event
 async def on_ready():
-    logger.info(f"Bot logged in as {bot.user}")
-    await tree.sync()
-    logger.info("Slash commands synced successfully")
-    check_daily_reports.start()
-    logger.info("Daily report task started")
+    logger.info("Bot logged in as %s on shards %s of %s", bot.user, sorted(sharding.local_shards(bot)), bot.shard_count)
+    # on_ready fires again after every reconnect; the loops must only start once
+    for loop in (check_daily_reports, log_usage_summary, precompute_reports):
+        if not loop.is_running():
+            loop.start()
+    logger.info("Background tasks running")
+    # Commands are global, so one process syncing them is enough
+    if sharding.is_primary(bot):
+        await command_sync.sync_if_changed(tree, bot.application_id)
 
 @tasks.loop(minutes=1)
 async def check_daily_reports():
@@ -243,23 +252,55 @@ async def check_daily_reports():
     config = load_config()
     user_prefs = config.get("user_preferences", {})
     enabled_count = sum(1 for u in user_prefs.values() if u.get("daily_report_enabled", False))
-    logger.debug(f"Checking daily reports at {current_time} - {enabled_count} users have reports enabled")
+    logger.debug("Checking daily reports at %s - %s users have reports enabled", current_time, enabled_count)
     
     for user_id_str, user_data in user_prefs.items():
-        if user_data.get("daily_report_enabled", False):
+        if user_data.get("daily_report_enabled", False) and sharding.owns_subscriber(bot, user_data):
             report_time = user_data.get("daily_report_time")
             if report_time == current_time:
                 user_id = int(user_id_str)
                 channel_id = user_data.get("daily_report_channel")
-                logger.info(f"Triggering daily report for user {user_id} at {report_time}")
+                logger.info("Triggering daily report for user %s at %s", user_id, report_time)
                 if channel_id:
                     await send_daily_report(bot, user_id, channel_id)
                 else:
-                    logger.warning(f"No channel ID set for user {user_id} daily report")
+                    logger.warning("No channel ID set for user %s daily report", user_id)
 
 @check_daily_reports.before_loop
 async def before_check_daily_reports():
     await bot.wait_until_ready()
 
+_last_precompute_date = None
+
+@tasks.loop(minutes=1)
+async def precompute_reports():
+    """Pre-generate reports for popular locations once a day at the configured time"""
+    global _last_precompute_date
+    settings = precompute.get_settings()
+    now = datetime.now()
+    if not settings["enabled"] or not sharding.is_primary(bot) or now.strftime("%H:%M") != settings["run_at"]:
+        return
+    if _last_precompute_date == now.date():
+        return
+    _last_precompute_date = now.date()
+    await precompute_popular_reports()
+
+@precompute_reports.before_loop
+async def before_precompute_reports():
+    await bot.wait_until_ready()
+
+@tasks.loop(hours=1)
+async def log_usage_summary():
+    """Log the rolling Gemini token and cost summary"""
+    logger.info(usage_tracker.format_summary())
+
 if __name__ == "__main__":
-    bot.run(DISCORD_TOKEN)
+    if METRICS_PORT:
+        metrics.start_http_server(int(METRICS_PORT))
+    if report_workers.enabled():
+        report_workers.get_pool().start()
+    try:
+        # Keep discord.py's records on the queue instead of its own stream handler
+        bot.run(DISCORD_TOKEN, log_handler=None)
+    finally:
+        report_workers.shutdown()
@@ -0,0 +1,151 @@
+"""
+Lightweight in-process metrics for the bot.
+
+Counters, gauges and latency observations are kept in memory and can be
+read back with snapshot() or rendered in the Prometheus text format by
+render(). Set METRICS_PORT to serve them over HTTP from main.py.
+"""
+
+import logging
+import threading
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Number of recent observations kept per series for percentile estimates
+OBSERVATION_WINDOW = 1024
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_observations = defaultdict(lambda: deque(maxlen=OBSERVATION_WINDOW))
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def increment(name, value=1, **labels):
+    """Add value to a counter"""
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to an absolute value"""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    """Record a single observation (usually a duration in seconds)"""
+    with _lock:
+        _observations[_key(name, labels)].append(value)
+
+
+def get_counter(name, **labels):
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def get_gauge(name, default=None, **labels):
+    with _lock:
+        return _gauges.get(_key(name, labels), default)
+
+
+def percentile(name, q, **labels):
+    """Return the q-th percentile (0-100) of recent observations, or None"""
+    with _lock:
+        values = sorted(_observations.get(_key(name, labels), ()))
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def observation_count(name, **labels):
+    with _lock:
+        return len(_observations.get(_key(name, labels), ()))
+
+
+def snapshot():
+    """Return a plain dict copy of every metric"""
+    with _lock:
+        counters = {_format_series(k): v for k, v in _counters.items()}
+        gauges = {_format_series(k): v for k, v in _gauges.items()}
+        observations = {k: list(v) for k, v in _observations.items()}
+
+    summaries = {}
+    for key, values in observations.items():
+        values.sort()
+        if not values:
+            continue
+        summaries[_format_series(key)] = {
+            "count": len(values),
+            "p50": values[int(0.50 * (len(values) - 1))],
+            "p95": values[int(0.95 * (len(values) - 1))],
+            "p99": values[int(0.99 * (len(values) - 1))],
+        }
+    return {"counters": counters, "gauges": gauges, "summaries": summaries}
+
+
+def render():
+    """Render every metric in the Prometheus text exposition format"""
+    snap = snapshot()
+    lines = []
+    for series, value in sorted(snap["counters"].items()):
+        lines.append(f"{series} {value:g}")
+    for series, value in sorted(snap["gauges"].items()):
+        lines.append(f"{series} {value:g}")
+    for series, summary in sorted(snap["summaries"].items()):
+        name, _, labels = series.partition("{")
+        labels = labels.rstrip("}")
+        for quantile in ("p50", "p95", "p99"):
+            q_label = f'quantile="0.{quantile[1:]}"'
+            all_labels = f"{labels},{q_label}" if labels else q_label
+            lines.append(f"{name}{{{all_labels}}} {summary[quantile]:g}")
+        count_labels = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_count{count_labels} {summary['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Clear all metrics (used by tests and benchmarks)"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _observations.clear()
+
+
+def _format_series(key):
+    name, labels = key
+    if not labels:
+        return name
+    label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+    return f"{name}{{{label_str}}}"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler): # pragma: no cover
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="127.0.0.1"): # pragma: no cover
+    """Serve /metrics from a daemon thread and return the server"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info("Metrics server listening on http://%s:%s/metrics", host, server.server_port)
+    return server
@@ -0,0 +1,620 @@
+"""
+Compact models for upstream payloads.
+
+Responses are decoded straight from the response bytes into small
+__slots__ objects that keep only the fields the reports use; NOAA series
+are stored column-wise in arrays of floats instead of lists of string
+dicts. Models travel between modules as objects. They are turned into
+plain dicts only when written to the cache (see cache.register_type) or
+dumped into a Gemini prompt (to_plain).
+
+orjson is used for parsing when it is installed. NOAA series can also be
+decoded into NumPy arrays (ColumnarSeries) for analysis of long 6-minute
+ranges; that needs numpy, which is optional.
+"""
+
+import array
+import calendar
+import csv
+import json
+import math
+import time
+
+import cache
+from lazy import lazy_import
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError: # pragma: no cover
+    _loads = json.loads
+
+# Loaded on first use; None when numpy isn't installed
+numpy = lazy_import("numpy")
+
+NOAA_TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+# NOAA columns kept as floats; "s" is only a value when there is no "v" (on
+# water level rows it is the standard deviation)
+NOAA_COLUMNS = ("v", "s", "d", "g")
+
+# NOAA CSV headers mapped to the keys used in JSON responses
+NOAA_CSV_COLUMNS = {
+    "Date Time": "t", "Water Level": "v", "Prediction": "v", "Water Temperature": "v",
+    "Air Temperature": "v", "Air Pressure": "v", "Sigma": "s", "Speed": "s",
+    "Direction": "d", "Gust": "g", "Bin": "b", "Quality": "q", "Type": "type",
+}
+
+# CSV flag columns, joined into the comma-separated "f" field the JSON responses use
+NOAA_CSV_FLAGS = ("O or I (for verified)", "F", "R", "L", "X", "N")
+
+
+def loads(body):
+    """Parse JSON from bytes or str using the fastest available parser"""
+    return _loads(body)
+
+
+def to_plain(value):
+    """json.dumps default= hook that turns models into dicts"""
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _float(value):
+    if value is None or value == "":
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _float_column(values):
+    if "" in values or None in values:
+        return array.array("d", map(_float, values))
+    try:
+        return array.array("d", map(float, values))
+    except ValueError:
+        return array.array("d", map(_float, values))
+
+
+def _noaa_times(stamps):
+    """Epoch seconds for NOAA stamps
+
+    Rows share a handful of dates and times of day, so each distinct date
+    and "HH:MM" is parsed once.
+    """
+    days, clock = {}, {}
+    times = []
+    for stamp in stamps:
+        day = days.get(stamp[:10])
+        if day is None:
+            day = days[stamp[:10]] = parse_noaa_time(stamp[:10] + " 00:00")
+        offset = clock.get(stamp[11:16])
+        if offset is None:
+            offset = clock[stamp[11:16]] = int(stamp[11:13]) * 3600 + int(stamp[14:16]) * 60
+        times.append(day + offset)
+    return times
+
+
+def _without_none(mapping):
+    return {k: v for k, v in mapping.items() if v is not None}
+
+
+def parse_noaa_time(stamp):
+    """Seconds since the epoch for a NOAA "YYYY-MM-DD HH:MM" stamp, read as UTC"""
+    return calendar.timegm((int(stamp[0:4]), int(stamp[5:7]), int(stamp[8:10]),
+                            int(stamp[11:13]), int(stamp[14:16]), 0))
+
+
+def format_noaa_time(seconds):
+    return time.strftime(NOAA_TIME_FORMAT, time.gmtime(seconds))
+
+
+@cache.register_type
+class SpeciesCount:
+    __slots__ = ("taxon_id", "name", "common_name", "count")
+
+    def __init__(self, taxon_id, name, common_name, count):
+        self.taxon_id = taxon_id
+        self.name = name
+        self.common_name = common_name
+        self.count = count
+
+    def to_dict(self):
+        return {"species": self.name, "common_name": self.common_name, "count": self.count, "id": self.taxon_id}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("id"), data.get("species"), data.get("common_name"), data.get("count", 0))
+
+
+@cache.register_type
+class SpeciesReport:
+    """iNaturalist species counts near a location"""
+
+    __slots__ = ("lat", "lon", "total_observations", "species_found", "species")
+
+    # Species included in reports (keeps the prompt within Discord-sized answers)
+    TOP = 10
+
+    def __init__(self, lat, lon, total_observations=0, species_found=0, species=()):
+        self.lat = lat
+        self.lon = lon
+        self.total_observations = total_observations
+        self.species_found = species_found
+        self.species = list(species)
+
+    def to_dict(self):
+        result = {
+            "location": {"lat": self.lat, "lon": self.lon},
+            "total_observations": self.total_observations,
+            "species_found": self.species_found,
+        }
+        if self.species:
+            result["fish_species"] = [s.to_dict() for s in self.species[:self.TOP]]
+        else:
+            result["message"] = "No fish species found in this area"
+        result["source"] = "iNaturalist"
+        return result
+
+    @classmethod
+    def from_dict(cls, data):
+        location = data.get("location", {})
+        return cls(location.get("lat"), location.get("lon"), data.get("total_observations", 0),
+                   data.get("species_found", 0),
+                   [SpeciesCount.from_dict(s) for s in data.get("fish_species", [])])
+
+
+@cache.register_type
+class HourlyPoint:
+    """One current, hourly or timemachine weather reading"""
+
+    __slots__ = ("dt", "temp", "feels_like", "pressure", "humidity", "clouds",
+                 "wind_speed", "wind_deg", "wind_gust", "pop", "rain", "conditions")
+
+    def __init__(self, dt, temp=None, feels_like=None, pressure=None, humidity=None, clouds=None,
+                 wind_speed=None, wind_deg=None, wind_gust=None, pop=None, rain=None, conditions=None):
+        self.dt = dt
+        self.temp = temp
+        self.feels_like = feels_like
+        self.pressure = pressure
+        self.humidity = humidity
+        self.clouds = clouds
+        self.wind_speed = wind_speed
+        self.wind_deg = wind_deg
+        self.wind_gust = wind_gust
+        self.pop = pop
+        self.rain = rain
+        self.conditions = conditions
+
+    @classmethod
+    def decode(cls, row):
+        rain = row.get("rain")
+        return cls(row["dt"], row.get("temp"), row.get("feels_like"), row.get("pressure"),
+                   row.get("humidity"), row.get("clouds"), row.get("wind_speed"), row.get("wind_deg"),
+                   row.get("wind_gust"), row.get("pop"),
+                   rain.get("1h") if isinstance(rain, dict) else rain,
+                   (row.get("weather") or [{}])[0].get("main"))
+
+    def to_dict(self):
+        return _without_none({slot: getattr(self, slot) for slot in self.__slots__})
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{slot: data.get(slot) for slot in cls.__slots__})
+
+
+@cache.register_type
+class DailyPoint:
+    """One day of the One Call daily forecast"""
+
+    __slots__ = ("dt", "sunrise", "sunset", "moon_phase", "temp_min", "temp_max", "temp_day",
+                 "pressure", "humidity", "clouds", "wind_speed", "wind_deg", "wind_gust",
+                 "pop", "rain", "conditions", "summary")
+
+    def __init__(self, dt, sunrise=None, sunset=None, moon_phase=None, temp_min=None, temp_max=None,
+                 temp_day=None, pressure=None, humidity=None, clouds=None, wind_speed=None,
+                 wind_deg=None, wind_gust=None, pop=None, rain=None, conditions=None, summary=None):
+        self.dt = dt
+        self.sunrise = sunrise
+        self.sunset = sunset
+        self.moon_phase = moon_phase
+        self.temp_min = temp_min
+        self.temp_max = temp_max
+        self.temp_day = temp_day
+        self.pressure = pressure
+        self.humidity = humidity
+        self.clouds = clouds
+        self.wind_speed = wind_speed
+        self.wind_deg = wind_deg
+        self.wind_gust = wind_gust
+        self.pop = pop
+        self.rain = rain
+        self.conditions = conditions
+        self.summary = summary
+
+    @classmethod
+    def decode(cls, row):
+        temp = row.get("temp") or {}
+        return cls(row["dt"], row.get("sunrise"), row.get("sunset"), row.get("moon_phase"),
+                   temp.get("min"), temp.get("max"), temp.get("day"), row.get("pressure"),
+                   row.get("humidity"), row.get("clouds"), row.get("wind_speed"), row.get("wind_deg"),
+                   row.get("wind_gust"), row.get("pop"), row.get("rain"),
+                   (row.get("weather") or [{}])[0].get("main"), row.get("summary"))
+
+    def to_dict(self):
+        return _without_none({slot: getattr(self, slot) for slot in self.__slots__})
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{slot: data.get(slot) for slot in cls.__slots__})
+
+
+@cache.register_type
+class WeatherSnapshot:
+    """The parts of a One Call response used by reports"""
+
+    __slots__ = ("lat", "lon", "timezone", "timezone_offset", "current", "minutely",
+                 "hourly", "daily", "alerts", "history")
+
+    def __init__(self, lat=None, lon=None, timezone=None, timezone_offset=0, current=None,
+                 minutely=None, hourly=(), daily=(), alerts=(), history=()):
+        self.lat = lat
+        self.lon = lon
+        self.timezone = timezone
+        self.timezone_offset = timezone_offset
+        self.current = current
+        # Minute precipitation as (dt, mm) pairs
+        self.minutely = minutely
+        self.hourly = list(hourly)
+        self.daily = list(daily)
+        self.alerts = list(alerts)
+        self.history = list(history)
+
+    def copy(self, **changes):
+        fields = {slot: getattr(self, slot) for slot in self.__slots__}
+        fields.update(changes)
+        return WeatherSnapshot(**fields)
+
+    def to_dict(self):
+        result = {"lat": self.lat, "lon": self.lon, "timezone": self.timezone,
+                  "timezone_offset": self.timezone_offset}
+        if self.current is not None:
+            result["current"] = self.current.to_dict()
+        if self.minutely:
+            result["minutely"] = [{"dt": dt, "precipitation": mm} for dt, mm in self.minutely]
+        for name in ("hourly", "daily", "history"):
+            rows = getattr(self, name)
+            if rows:
+                result[name] = [row.to_dict() for row in rows]
+        if self.alerts:
+            result["alerts"] = self.alerts
+        return result
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data.get("lat"), data.get("lon"), data.get("timezone"), data.get("timezone_offset", 0),
+            HourlyPoint.from_dict(data["current"]) if data.get("current") else None,
+            [(row["dt"], row["precipitation"]) for row in data.get("minutely", [])] or None,
+            [HourlyPoint.from_dict(row) for row in data.get("hourly", [])],
+            [DailyPoint.from_dict(row) for row in data.get("daily", [])],
+            data.get("alerts", []),
+            [HourlyPoint.from_dict(row) for row in data.get("history", [])],
+        )
+
+
+@cache.register_type
+class TideSeries:
+    """A NOAA CO-OPS series stored column-wise
+
+    times holds seconds since the epoch (NOAA local stamps read as UTC, so
+    they format back unchanged) and each numeric column is an array of
+    floats, with NaN for missing readings. labels holds the per-row "type"
+    of high/low predictions ("H", "L", "HH", "LL"), or None.
+    """
+
+    __slots__ = ("metadata", "times", "columns", "labels")
+
+    def __init__(self, metadata=None, times=None, columns=None, labels=None):
+        self.metadata = metadata or {}
+        self.times = times if times is not None else array.array("q")
+        self.columns = columns or {}
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.times)
+
+    @classmethod
+    def decode_rows(cls, rows, metadata=None):
+        names = rows[0].keys() if rows else ()
+        return cls.from_columns({name: [row.get(name) for row in rows] for name in names}, metadata)
+
+    @classmethod
+    def from_columns(cls, columns, metadata=None):
+        """Build from NOAA field name -> list of strings"""
+        names = [c for c in NOAA_COLUMNS if c in columns and not (c == "s" and "v" in columns)]
+        times = array.array("q", _noaa_times(columns.get("t", ())))
+        labels = [label.strip() for label in columns["type"]] if "type" in columns else None
+        return cls(metadata, times, {name: _float_column(columns[name]) for name in names}, labels)
+
+    @classmethod
+    def concat(cls, parts):
+        """One series from parts of a range, ordered by time with repeated times dropped
+
+        The first part's metadata is kept. Where parts overlap, the reading
+        from the earlier part in the list wins.
+        """
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls()
+        names = list(parts[0].columns)
+        ordered = sorted(parts, key=lambda part: part.times[0])
+        if all(a.times[-1] < b.times[0] for a, b in zip(ordered, ordered[1:])):
+            # Chunks of one range don't overlap, so they only need joining in order
+            times = array.array("q")
+            columns = {name: array.array("d") for name in names}
+            labels = [] if parts[0].labels is not None else None
+            for part in ordered:
+                times.extend(part.times)
+                for name in names:
+                    columns[name].extend(part.columns.get(name) or array.array("d", [math.nan]) * len(part))
+                if labels is not None:
+                    labels.extend(part.labels or [""] * len(part))
+            return cls(parts[0].metadata, times, columns, labels)
+
+        rows = {}
+        for part in parts:
+            for i, seconds in enumerate(part.times):
+                rows.setdefault(seconds, (part, i))
+        order = sorted(rows)
+        columns = {}
+        for name in names:
+            columns[name] = array.array("d", (rows[t][0].columns[name][rows[t][1]] if name in rows[t][0].columns
+                                              else math.nan for t in order))
+        labels = None
+        if parts[0].labels is not None:
+            labels = [rows[t][0].labels[rows[t][1]] if rows[t][0].labels else "" for t in order]
+        return cls(parts[0].metadata, array.array("q", order), columns, labels)
+
+    def values(self, name=None):
+        """The primary (or named) column as floats"""
+        if name is None:
+            name = next(iter(self.columns), None)
+        return self.columns.get(name, array.array("d"))
+
+    def between(self, low, high):
+        """New series with the rows whose time is within [low, high] (epoch seconds)"""
+        indexes = [i for i, t in enumerate(self.times) if low <= t <= high]
+        if not indexes:
+            return TideSeries(self.metadata)
+        start, stop = indexes[0], indexes[-1] + 1
+        return TideSeries(self.metadata, self.times[start:stop],
+                          {name: column[start:stop] for name, column in self.columns.items()},
+                          self.labels[start:stop] if self.labels is not None else None)
+
+    def around(self, low, high):
+        """Like between, plus the last row before low and the first after high
+
+        For event series (high/low tides, slack and max currents) this keeps
+        the tide or current turning just outside the window.
+        """
+        indexes = [i for i, t in enumerate(self.times) if low <= t <= high]
+        before = [i for i, t in enumerate(self.times) if t < low]
+        start = indexes[0] if indexes else (before[-1] + 1 if before else 0)
+        stop = indexes[-1] + 1 if indexes else start
+        start, stop = max(0, start - 1), min(len(self.times), stop + 1)
+        return TideSeries(self.metadata, self.times[start:stop],
+                          {name: column[start:stop] for name, column in self.columns.items()},
+                          self.labels[start:stop] if self.labels is not None else None)
+
+    def on_date(self, date):
+        """Rows for a "YYYY-MM-DD" date"""
+        day = parse_noaa_time(f"{date} 00:00")
+        return self.between(day, day + 86399)
+
+    def to_dict(self):
+        rows = []
+        for i, seconds in enumerate(self.times):
+            row = {"t": format_noaa_time(seconds)}
+            for name, column in self.columns.items():
+                value = column[i]
+                row[name] = None if math.isnan(value) else value
+            if self.labels is not None:
+                row["type"] = self.labels[i]
+            rows.append(row)
+        return {"metadata": self.metadata, "data": rows}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls.decode_rows(data.get("data", []), data.get("metadata"))
+
+
+class ColumnarSeries:
+    """A NOAA series as NumPy arrays
+
+    time is datetime64[m] (NOAA stamps as given, no time zone), values maps
+    each numeric column to float64 with NaN for missing readings, flags is
+    a uint8 array with one column per NOAA flag and quality holds the
+    one-letter quality codes ("p" preliminary, "v" verified).
+    """
+
+    __slots__ = ("metadata", "time", "values", "flags", "quality")
+
+    def __init__(self, metadata, time, values, flags=None, quality=None):
+        self.metadata = metadata or {}
+        self.time = time
+        self.values = values
+        self.flags = flags
+        self.quality = quality
+
+    def __len__(self):
+        return len(self.time)
+
+    @classmethod
+    def from_columns(cls, columns, metadata=None):
+        """Build from NOAA field name -> list of strings, converting each column in one pass"""
+        if numpy is None:
+            raise RuntimeError("Columnar NOAA series need numpy (pip install numpy)")
+        times = numpy.array(columns.get("t", ()), dtype="datetime64[m]")
+        values = {name: _float_array(columns[name]) for name in NOAA_COLUMNS if name in columns}
+        flags = _flag_array(columns["f"]) if "f" in columns else None
+        quality = numpy.array(columns["q"], dtype="U1") if "q" in columns else None
+        return cls(metadata, times, values, flags, quality)
+
+    @classmethod
+    def concat(cls, parts):
+        """One series from parts of a range, ordered by time with repeated times dropped"""
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls(None, numpy.array([], dtype="datetime64[m]"), {})
+        times = numpy.concatenate([part.time for part in parts])
+        # unique keeps the first occurrence of each time, in time order
+        _, keep = numpy.unique(times, return_index=True)
+
+        def joined(arrays):
+            return None if any(a is None for a in arrays) else numpy.concatenate(arrays)[keep]
+
+        values = {name: numpy.concatenate([part.values.get(name, numpy.full(len(part), numpy.nan))
+                                           for part in parts])[keep]
+                  for name in parts[0].values}
+        return cls(parts[0].metadata, times[keep], values,
+                   joined([part.flags for part in parts]), joined([part.quality for part in parts]))
+
+    def column(self, name=None):
+        """The primary (or named) value column"""
+        if name is None:
+            name = next(iter(self.values), None)
+        return self.values.get(name, numpy.empty(0))
+
+    def to_series(self):
+        """The same readings as a TideSeries"""
+        names = [name for name in self.values if not (name == "s" and "v" in self.values)]
+        seconds = self.time.astype("int64") * 60
+        return TideSeries(self.metadata, array.array("q", seconds.tolist()),
+                          {name: array.array("d", self.values[name].tolist()) for name in names})
+
+    def to_dict(self):
+        return self.to_series().to_dict()
+
+
+def _float_array(strings):
+    if "" not in strings:
+        # The common case: float() per value is faster than NumPy's string casts
+        return numpy.fromiter(map(float, strings), dtype=numpy.float64, count=len(strings))
+    raw = numpy.array(strings, dtype=str)
+    out = numpy.full(raw.shape, numpy.nan)
+    present = raw != ""
+    out[present] = raw[present].astype(float)
+    return out
+
+
+def _flag_array(strings):
+    """ "0,1,0,0" strings as a (rows, flags) uint8 array"""
+    width = max(map(len, strings), default=0)
+    if not width:
+        return numpy.zeros((len(strings), 0), dtype=numpy.uint8)
+    # Fixed-width bytes, one row per reading; the digits sit at the even offsets
+    raw = numpy.frombuffer(numpy.array(strings, dtype=f"S{width}").tobytes(),
+                           dtype=numpy.uint8).reshape(-1, width)[:, ::2]
+    return numpy.where(raw == 0, 0, raw - ord("0")).astype(numpy.uint8)
+
+
+def noaa_csv_columns(body):
+    """NOAA field name -> list of strings from a CSV response body"""
+    text = body.decode("utf-8") if isinstance(body, bytes) else body
+    reader = csv.reader(text.splitlines())
+    header = [label.strip() for label in next(reader, [])]
+    records = [record for record in reader if record]
+    transposed = list(zip(*records)) if records else [()] * len(header)
+    columns, flags = {}, []
+    for label, values in zip(header, transposed):
+        name = NOAA_CSV_COLUMNS.get(label)
+        # float() ignores padding, so only text columns need stripping
+        values = list(values) if name in NOAA_COLUMNS else [value.strip() for value in values]
+        if label in NOAA_CSV_FLAGS:
+            flags.append(values)
+        elif name and name not in columns:
+            # Wind repeats "Direction" as a compass point; the first is degrees
+            columns[name] = values
+    if flags:
+        columns["f"] = [",".join(row) for row in zip(*flags)]
+    return columns
+
+
+def decode_species_counts(body, lat, lon):
+    """SpeciesReport from an iNaturalist species_counts response body"""
+    results = loads(body).get("results") or []
+    species = []
+    total = 0
+    for result in results:
+        taxon = result.get("taxon") or {}
+        count = result.get("count", 0)
+        total += count
+        species.append(SpeciesCount(taxon.get("id"), taxon.get("name", "Unknown"),
+                                    taxon.get("preferred_common_name") or taxon.get("name"), count))
+    return SpeciesReport(lat, lon, total, len(species), species)
+
+
+def decode_onecall(body):
+    """WeatherSnapshot from a One Call response body; error payloads are returned as dicts"""
+    data = loads(body)
+    if not isinstance(data, dict) or "cod" in data:
+        return data
+    current = data.get("current")
+    minutely = data.get("minutely")
+    return WeatherSnapshot(
+        data.get("lat"), data.get("lon"), data.get("timezone"), data.get("timezone_offset", 0),
+        HourlyPoint.decode(current) if current else None,
+        [(row["dt"], row.get("precipitation", 0)) for row in minutely] if minutely else None,
+        [HourlyPoint.decode(row) for row in data.get("hourly", ())],
+        [DailyPoint.decode(row) for row in data.get("daily", ())],
+        data.get("alerts", ()),
+    )
+
+
+def decode_timemachine(body):
+    """HourlyPoints from a One Call timemachine response body"""
+    return [HourlyPoint.decode(row) for row in loads(body).get("data", ())]
+
+
+def _current_prediction_row(row):
+    """A currents_predictions row shaped like the currents product: speed signed
+    positive on the flood, the direction it sets towards and the event type"""
+    velocity = _float(row.get("Velocity_Major"))
+    direction = row.get("meanEbbDir") if velocity < 0 else row.get("meanFloodDir")
+    decoded = {"t": row.get("Time", ""), "s": velocity, "d": _float(direction)}
+    if "Type" in row:
+        decoded["type"] = row["Type"]
+    return decoded
+
+
+def decode_noaa(body, format="json", columnar=False):
+    """TideSeries (or ColumnarSeries) from a NOAA datagetter response
+
+    format is the datagetter format the body was requested in ("json" or
+    "csv"). Error payloads are returned as dicts.
+    """
+    if format == "csv":
+        text = body.decode("utf-8") if isinstance(body, bytes) else body
+        if text.lstrip().lower().startswith("error"):
+            return {"error": {"message": text.strip()}}
+        columns = noaa_csv_columns(text)
+        if columnar:
+            return ColumnarSeries.from_columns(columns)
+        return TideSeries.from_columns(columns)
+
+    data = loads(body)
+    if "error" in data:
+        return data
+    if "current_predictions" in data:
+        rows = [_current_prediction_row(row) for row in data["current_predictions"].get("cp") or []]
+    else:
+        rows = data.get("data") or data.get("predictions") or []
+    if columnar:
+        names = rows[0].keys() if rows else ()
+        return ColumnarSeries.from_columns({name: [row.get(name, "") for row in rows] for name in names},
+                                           data.get("metadata"))
+    return TideSeries.decode_rows(rows, data.get("metadata"))
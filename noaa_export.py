@@ -0,0 +1,265 @@
+"""
+Bulk NOAA Co-OPS export.
+
+Fetches one or more products for many stations over a date range and
+streams the readings to an NDJSON, CSV or Parquet file. Stations are given
+by ID or picked from a bounding box. Work is split into (station, product,
+chunk) jobs that run on a bounded thread pool. Each chunk is written as
+soon as it arrives and then dropped, so memory stays flat however long the
+range is.
+
+Usage (from the repository root):
+
+    python noaa_tides_currents.py export --stations 8665530,8661070 \
+        --products water_level,water_temperature --begin 20240101 --end 20241231 \
+        --output tides.ndjson
+
+    python -m noaa_export --bbox 32,-81,34,-78 --products water_level \
+        --begin 20250101 --end 20250107 --interval 6 --output carolinas.parquet
+
+Parquet output needs pyarrow, which is optional.
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from models import TideSeries, format_noaa_time
+from noaa_tides_currents import MAX_RANGE_DAYS, NOAACoOpsAPI, format_date, split_range
+
+PRODUCTS = {
+    "water_level": "get_water_level",
+    "currents": "get_currents",
+    "water_temperature": "get_water_temperature",
+    "wind": "get_wind",
+    "air_temperature": "get_air_temperature",
+    "barometric_pressure": "get_barometric_pressure",
+}
+
+# Columns written for every reading; values a product doesn't have are left empty
+FIELDS = ("station", "product", "t", "v", "s", "d", "g")
+VALUE_FIELDS = FIELDS[3:]
+
+FORMATS = {".ndjson": "ndjson", ".jsonl": "ndjson", ".csv": "csv", ".parquet": "parquet"}
+
+DEFAULT_WORKERS = 8
+
+
+def stations_in_box(stations, south, west, north, east):
+    """IDs of the stations inside a lat/lon bounding box"""
+    found = []
+    for station in stations:
+        try:
+            lat, lon = float(station["lat"]), float(station.get("lng", station.get("lon")))
+        except (KeyError, TypeError, ValueError):
+            continue
+        if south <= lat <= north and west <= lon <= east:
+            found.append(str(station["id"]))
+    return found
+
+
+def _rows(station, product, series):
+    for i, seconds in enumerate(series.times):
+        row = {"station": station, "product": product, "t": format_noaa_time(seconds)}
+        for name in VALUE_FIELDS:
+            column = series.columns.get(name)
+            if column is not None and not math.isnan(column[i]):
+                row[name] = column[i]
+        yield row
+
+
+class NDJSONWriter:
+    def __init__(self, path):
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, station, product, series):
+        lines = [json.dumps(row, separators=(",", ":")) for row in _rows(station, product, series)]
+        if lines:
+            self._file.write("\n".join(lines) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class CSVWriter:
+    def __init__(self, path):
+        self._file = open(path, "w", encoding="utf-8", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=FIELDS)
+        self._writer.writeheader()
+
+    def write(self, station, product, series):
+        self._writer.writerows(_rows(station, product, series))
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """One row group per chunk, so only the chunk being written is held as Arrow arrays"""
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow)")
+        self._pa = pyarrow
+        self._schema = pyarrow.schema(
+            [("station", pyarrow.string()), ("product", pyarrow.string()), ("t", pyarrow.timestamp("s"))]
+            + [(name, pyarrow.float64()) for name in VALUE_FIELDS])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write(self, station, product, series):
+        pa = self._pa
+        count = len(series)
+        if not count:
+            return
+        columns = [pa.array([station] * count), pa.array([product] * count),
+                   pa.array(series.times, type=pa.int64()).cast(pa.timestamp("s"))]
+        for name in VALUE_FIELDS:
+            column = series.columns.get(name)
+            if column is None:
+                columns.append(pa.nulls(count, pa.float64()))
+            else:
+                columns.append(pa.array(column, type=pa.float64(), from_pandas=True))
+        self._writer.write_table(pa.Table.from_arrays(columns, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+WRITERS = {"ndjson": NDJSONWriter, "csv": CSVWriter, "parquet": ParquetWriter}
+
+
+def output_format(path, fmt=None):
+    if fmt:
+        return fmt
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Can't tell the output format from {path}; pass --format")
+    return FORMATS[extension]
+
+
+def export(stations, products, begin_date, end_date, output, fmt=None, workers=DEFAULT_WORKERS,
+           interval="h", units="metric", time_zone="gmt", api=None):
+    """Fetch every (station, product) over the range and stream the readings to output
+
+    Returns a summary: total rows, elapsed seconds and, per station, rows
+    written and error messages.
+    """
+    unknown = [product for product in products if product not in PRODUCTS]
+    if unknown:
+        raise ValueError(f"Unknown products: {', '.join(unknown)}")
+    api = api or NOAACoOpsAPI()
+    # Currents have no interval and always come as 6-minute data
+    jobs = [(station, product, chunk)
+            for station in stations
+            for product in products
+            for chunk in split_range(begin_date, end_date,
+                                     MAX_RANGE_DAYS["6" if product == "currents" else interval])]
+
+    def fetch(station, product, chunk):
+        kwargs = {"units": units, "time_zone": time_zone, "quiet": True}
+        if product != "currents":
+            kwargs["interval"] = interval
+        return getattr(api, PRODUCTS[product])(station, chunk[0], chunk[1], **kwargs)
+
+    summary = {"stations": {station: {"rows": 0, "errors": []} for station in stations}}
+    writer = WRITERS[output_format(output, fmt)](output)
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="noaa-export") as pool:
+            pending = {}
+            queue = iter(jobs)
+            while True:
+                # Keep a bounded number of chunks in flight so finished ones don't pile up in memory
+                for job in queue:
+                    pending[pool.submit(fetch, *job)] = job
+                    if len(pending) >= workers * 2:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    station, product, chunk = pending.pop(future)
+                    stats = summary["stations"][station]
+                    try:
+                        series = future.result()
+                    except Exception as e:
+                        series = {"error": {"message": str(e)}}
+                    if isinstance(series, TideSeries):
+                        writer.write(station, product, series)
+                        stats["rows"] += len(series)
+                        continue
+                    message = series.get("error", {}).get("message") if isinstance(series, dict) else None
+                    stats["errors"].append(f"{product} {chunk[0]}-{chunk[1]}: {message or 'request failed'}")
+    finally:
+        writer.close()
+
+    summary["seconds"] = time.perf_counter() - started
+    summary["rows"] = sum(stats["rows"] for stats in summary["stations"].values())
+    summary["requests"] = len(jobs)
+    return summary
+
+
+def format_summary(summary):
+    seconds = summary["seconds"] or 1e-9
+    lines = [
+        f"Exported {summary['rows']} rows from {len(summary['stations'])} stations "
+        f"({summary['requests']} requests) in {summary['seconds']:.1f}s: "
+        f"{summary['rows'] / seconds:.0f} rows/s, {summary['requests'] / seconds:.1f} requests/s",
+    ]
+    for station, stats in summary["stations"].items():
+        errors = stats["errors"]
+        lines.append(f"{station:<10} {stats['rows']:>9} rows  {len(errors)} errors")
+        lines.extend(f"    {error}" for error in errors)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export NOAA Co-OPS data for many stations")
+    parser.add_argument("--stations", help="Comma-separated station IDs")
+    parser.add_argument("--bbox", help="south,west,north,east; exports every station inside the box")
+    parser.add_argument("--station-type", default="waterlevels", help="Station type used with --bbox")
+    parser.add_argument("--products", default="water_level",
+                        help="Comma-separated subset of: " + ", ".join(PRODUCTS))
+    parser.add_argument("--begin", required=True, help="Start date (YYYYMMDD or MMDDYYYY)")
+    parser.add_argument("--end", required=True, help="End date (YYYYMMDD or MMDDYYYY)")
+    parser.add_argument("--output", required=True, help="Output file (.ndjson, .csv or .parquet)")
+    parser.add_argument("--format", choices=sorted(WRITERS), help="Output format (default: from the extension)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent requests")
+    parser.add_argument("--interval", default="h", choices=("h", "6"), help="h (hourly) or 6 (6-minute)")
+    parser.add_argument("--units", default="metric", choices=("metric", "english"))
+    parser.add_argument("--time-zone", default="gmt", choices=("gmt", "lst", "lst_ldt"))
+    args = parser.parse_args(argv)
+
+    api = NOAACoOpsAPI()
+    stations = [s.strip() for s in (args.stations or "").split(",") if s.strip()]
+    if args.bbox:
+        try:
+            south, west, north, east = (float(value) for value in args.bbox.split(","))
+        except ValueError:
+            parser.error("--bbox must be south,west,north,east")
+        found = stations_in_box(api.get_stations(args.station_type), south, west, north, east)
+        stations += [station for station in found if station not in stations]
+    if not stations:
+        parser.error("No stations: pass --stations and/or a --bbox containing stations")
+
+    begin_date, end_date = format_date(args.begin), format_date(args.end)
+    if not begin_date or not end_date:
+        parser.error("Invalid --begin/--end date")
+
+    summary = export(stations, [p.strip() for p in args.products.split(",") if p.strip()],
+                     begin_date, end_date, args.output, fmt=args.format, workers=args.workers,
+                     interval=args.interval, units=args.units, time_zone=args.time_zone, api=api)
+    print(format_summary(summary))
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -8,16 +8,76 @@ location and time period.
 """
 
 import requests
+import cache
+import harmonics
+import upstream
+import warehouse
+from models import ColumnarSeries, TideSeries, decode_noaa
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import json
-from typing import Optional, Dict, List, Any
+import os
+import time
+from typing import Optional, Dict, List, Any, Tuple, Union
 import sys
 
 
+# Longest range one datagetter request may cover, by interval. NOAA rejects
+# longer ranges, so they are fetched as chunks of at most this many days.
+MAX_RANGE_DAYS = {
+    '6': 31,       # 6-minute data (and currents, which have no interval)
+    'h': 365,      # hourly
+    'hilo': 3650,  # high/low predictions
+    'MAX_SLACK': 365,  # max flood/ebb and slack current predictions
+}
+
+# Station names, positions and time zones rarely change
+STATION_DETAILS_TTL_SECONDS = 30 * 24 * 60 * 60
+
+# Observed products; each has a NOAACoOpsAPI.get_<product> method
+OBSERVATION_PRODUCTS = ('water_level', 'currents', 'water_temperature', 'wind',
+                        'air_temperature', 'barometric_pressure')
+
+# Chunks of one long range fetched at the same time
+CHUNK_WORKERS = 4
+
+
+def split_range(begin_date: str, end_date: str, max_days: int) -> List[Tuple[str, str]]:
+    """
+    Split an inclusive YYYYMMDD range into consecutive chunks of at most max_days days.
+    
+    Ranges that aren't plain YYYYMMDD dates are returned as a single chunk.
+    """
+    try:
+        begin = datetime.strptime(begin_date, '%Y%m%d')
+        end = datetime.strptime(end_date, '%Y%m%d')
+    except (TypeError, ValueError):
+        return [(begin_date, end_date)]
+    chunks = []
+    while begin <= end:
+        chunk_end = min(end, begin + timedelta(days=max_days - 1))
+        chunks.append((begin.strftime('%Y%m%d'), chunk_end.strftime('%Y%m%d')))
+        begin = chunk_end + timedelta(days=1)
+    return chunks or [(begin_date, end_date)]
+
+
+def merge_series(parts: List[Any]) -> Optional[Union[TideSeries, ColumnarSeries, Dict]]:
+    """
+    Merge the chunks of one range into a single ordered series without repeated readings.
+    
+    Chunks that failed (error dicts) are skipped; if every chunk failed, the first error is returned.
+    """
+    series = [part for part in parts if isinstance(part, (TideSeries, ColumnarSeries))]
+    if not series:
+        return parts[0] if parts else None
+    return type(series[0]).concat(series)
+
+
 class NOAACoOpsAPI: # pragma: no cover
     """Client for interacting with NOAA Co-OPS API"""
     
-    BASE_URL = "https://api.tidesandcurrents.noaa.gov/api/prod"
+    BASE_URL = os.getenv("NOAA_BASE_URL", "https://api.tidesandcurrents.noaa.gov/api/prod")
+    METADATA_URL = os.getenv("NOAA_METADATA_URL", "https://api.tidesandcurrents.noaa.gov/mdapi/prod/webapi")
     
     def __init__(self):
         self.session = requests.Session()
@@ -25,21 +85,60 @@ class NOAACoOpsAPI: # pragma: no cover
             'User-Agent': 'NOAA-CoOps-Client/1.0'
         })
     
-    def search_stations(self, name: str = None, state: str = None) -> List[Dict]:
+    def get_stations(self, station_type: str = "waterlevels", quiet: bool = False) -> List[Dict]:
         """
-        Search for stations by name or state.
-        Note: This uses a station list endpoint. If not available,
-        users need to provide station ID directly.
+        List stations from the Co-OPS metadata API.
+        
+        Args:
+            station_type: Station type (waterlevels, currents, met, ...)
+            quiet: If True, suppress error messages
         """
         try:
-            # Try to get station list from metadata
-            url = f"{self.BASE_URL}/datagetter"
-            # This is a simplified approach - in practice, you'd use the station metadata
-            return []
+            url = f"{self.METADATA_URL}/stations.json"
+            response = upstream.get("noaa", url, params={'type': station_type}, timeout=30, session=self.session)
+            response.raise_for_status()
+            return response.json().get('stations', [])
         except Exception as e:
-            print(f"Error searching stations: {e}")
+            if not quiet:
+                print(f"Error listing stations: {e}")
             return []
     
+    def _get_metadata(self, path: str, params: Dict = None) -> Dict:
+        url = f"{self.METADATA_URL}/{path}"
+        response = upstream.get("noaa", url, params=params or {}, timeout=30, session=self.session)
+        response.raise_for_status()
+        return response.json()
+    
+    def get_station_details(self, station_id: str) -> Dict:
+        """Metadata API record for one station (name, lat/lng, timezonecorr, observedst), cached for a month"""
+        key = f"station_details:{station_id}"
+        details = cache.get(key)
+        if details is None:
+            details = (self._get_metadata(f"stations/{station_id}.json").get('stations') or [{}])[0]
+            cache.set(key, details, ttl=STATION_DETAILS_TTL_SECONDS)
+        return details
+    
+    def get_harmonic_constituents(self, station_id: str, units: str = "metric") -> List[Dict]:
+        """Harmonic constituents (name, amplitude, phase_GMT, speed) for a water level station"""
+        return self._get_metadata(f"stations/{station_id}/harcon.json",
+                                  {'units': units}).get('HarmonicConstituents', [])
+    
+    def get_datums(self, station_id: str, units: str = "metric") -> Dict[str, float]:
+        """Tidal datums for a station as name -> value"""
+        datums = self._get_metadata(f"stations/{station_id}/datums.json", {'units': units}).get('datums', [])
+        return {d['name']: float(d['value']) for d in datums if d.get('value') is not None}
+    
+    def search_stations(self, name: str = None, state: str = None) -> List[Dict]:
+        """
+        Search for stations by name or state.
+        """
+        stations = self.get_stations()
+        if name:
+            stations = [s for s in stations if name.lower() in s.get('name', '').lower()]
+        if state:
+            stations = [s for s in stations if s.get('state', '').upper() == state.upper()]
+        return stations
+    
     def get_station_info(self, station_id: str, quiet: bool = False) -> Optional[Dict]:
         """Get information about a specific station"""
         try:
@@ -50,7 +149,7 @@ class NOAACoOpsAPI: # pragma: no cover
                 'product': 'metadata',
                 'format': 'json'
             }
-            response = self.session.get(url, params=params, timeout=10)
+            response = upstream.get("noaa", url, params=params, timeout=10, session=self.session)
             response.raise_for_status()
             return response.json()
         except Exception as e:
@@ -58,9 +157,75 @@ class NOAACoOpsAPI: # pragma: no cover
                 print(f"Error getting station info: {e}")
             return None
     
+    def _get_series(self, url: str, params: Dict, format: str, columnar: bool,
+                    quiet: bool) -> Optional[Union[TideSeries, ColumnarSeries, Dict]]:
+        """Fetch one product, in concurrent chunks if the range is longer than NOAA allows"""
+        max_days = MAX_RANGE_DAYS.get(str(params.get('interval', '6')), MAX_RANGE_DAYS['6'])
+        chunks = split_range(params['begin_date'], params['end_date'], max_days)
+        
+        def fetch(chunk):
+            chunk_params = dict(params, begin_date=chunk[0], end_date=chunk[1])
+            response = upstream.get("noaa", url, params=chunk_params, timeout=30, session=self.session)
+            response.raise_for_status()
+            return decode_noaa(response.content, format=format, columnar=columnar)
+        
+        if len(chunks) == 1:
+            return fetch(chunks[0])
+        
+        def fetch_chunk(chunk):
+            try:
+                return fetch(chunk)
+            except Exception as e:
+                return {'error': {'message': f"{chunk[0]}-{chunk[1]}: {e}"}}
+        
+        with ThreadPoolExecutor(max_workers=min(CHUNK_WORKERS, len(chunks)),
+                                thread_name_prefix="noaa-chunk") as pool:
+            parts = list(pool.map(fetch_chunk, chunks))
+        failed = [part for part in parts if isinstance(part, dict)]
+        if failed and not quiet:
+            print(f"Warning: {len(failed)} of {len(chunks)} chunks failed for {params['product']}")
+        return merge_series(parts)
+    
+    def get_predictions(self, station_id: str, begin_date: str, end_date: str,
+                        datum: str = "MLLW", units: str = "metric",
+                        time_zone: str = "gmt", interval: str = "h", quiet: bool = False,
+                        format: str = "json", columnar: bool = False) -> Optional[Union[TideSeries, ColumnarSeries, Dict]]:
+        """
+        Retrieve NOAA's tide predictions
+        
+        Args:
+            station_id: Station ID
+            begin_date: Start date (YYYYMMDD)
+            end_date: End date (YYYYMMDD)
+            datum: Vertical datum (MLLW, MSL, NAVD88, etc.)
+            units: Units (metric or english)
+            time_zone: Time zone (gmt, lst, lst_ldt)
+            interval: h (hourly), 6 (6-minute) or hilo (high and low tides)
+        """
+        try:
+            url = f"{self.BASE_URL}/datagetter"
+            params = {
+                'product': 'predictions',
+                'application': 'NOS.COOPS.TAC.WL',
+                'station': station_id,
+                'begin_date': begin_date,
+                'end_date': end_date,
+                'datum': datum,
+                'units': units,
+                'time_zone': time_zone,
+                'format': format,
+                'interval': interval
+            }
+            return self._get_series(url, params, format, columnar, quiet)
+        except Exception as e:
+            if not quiet:
+                print(f"Error retrieving predictions: {e}")
+            return None
+    
     def get_water_level(self, station_id: str, begin_date: str, end_date: str,
                        datum: str = "MLLW", units: str = "metric",
-                       time_zone: str = "gmt", interval: str = "h", quiet: bool = False) -> Optional[Dict]:
+                       time_zone: str = "gmt", interval: str = "h", quiet: bool = False,
+                       format: str = "json", columnar: bool = False) -> Optional[Union[TideSeries, ColumnarSeries, Dict]]:
         """
         Retrieve water level (tide) data
         
@@ -72,6 +237,8 @@ class NOAACoOpsAPI: # pragma: no cover
             units: Units (metric or english)
             time_zone: Time zone (gmt, lst, lst_ldt)
             interval: Data interval (h for hourly, 6 for 6-minute)
+            format: Response format requested from NOAA (json or csv)
+            columnar: If True, return a ColumnarSeries of NumPy arrays (needs numpy)
         """
         try:
             url = f"{self.BASE_URL}/datagetter"
@@ -84,12 +251,10 @@ class NOAACoOpsAPI: # pragma: no cover
                 'datum': datum,
                 'units': units,
                 'time_zone': time_zone,
-                'format': 'json',
+                'format': format,
                 'interval': interval
             }
-            response = self.session.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
+            return self._get_series(url, params, format, columnar, quiet)
         except Exception as e:
             if not quiet:
                 print(f"Error retrieving water level data: {e}")
@@ -97,7 +262,8 @@ class NOAACoOpsAPI: # pragma: no cover
     
     def get_currents(self, station_id: str, begin_date: str, end_date: str,
                     units: str = "metric", time_zone: str = "gmt",
-                    bin: int = 1, quiet: bool = False) -> Optional[Dict]:
+                    bin: int = 1, quiet: bool = False,
+                    format: str = "json", columnar: bool = False) -> Optional[Union[TideSeries, ColumnarSeries, Dict]]:
         """
         Retrieve current data
         
@@ -109,6 +275,8 @@ class NOAACoOpsAPI: # pragma: no cover
             time_zone: Time zone (gmt, lst, lst_ldt)
             bin: Bin number (usually 1 for surface currents)
             quiet: If True, suppress error messages
+            format: Response format requested from NOAA (json or csv)
+            columnar: If True, return a ColumnarSeries of NumPy arrays (needs numpy)
         """
         try:
             url = f"{self.BASE_URL}/datagetter"
@@ -120,20 +288,61 @@ class NOAACoOpsAPI: # pragma: no cover
                 'end_date': end_date,
                 'units': units,
                 'time_zone': time_zone,
-                'format': 'json',
+                'format': format,
                 'bin': bin
             }
-            response = self.session.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
+            return self._get_series(url, params, format, columnar, quiet)
         except Exception as e:
             if not quiet:
                 print(f"Error retrieving current data: {e}")
             return None
     
+    def get_currents_predictions(self, station_id: str, begin_date: str, end_date: str,
+                                 units: str = "metric", time_zone: str = "gmt",
+                                 interval: str = "MAX_SLACK", bin: Optional[int] = None,
+                                 quiet: bool = False, columnar: bool = False) -> Optional[Union[TideSeries, ColumnarSeries, Dict]]:
+        """
+        Retrieve NOAA's current predictions for a current station
+        
+        Args:
+            station_id: Current station ID (e.g. cs0201)
+            begin_date: Start date (YYYYMMDD)
+            end_date: End date (YYYYMMDD)
+            units: Units (metric or english)
+            time_zone: Time zone (gmt, lst, lst_ldt)
+            interval: MAX_SLACK (max flood, max ebb and slack events), h or 6
+            bin: Bin number; the station's reference bin if not given
+            quiet: If True, suppress error messages
+            columnar: If True, return a ColumnarSeries of NumPy arrays (needs numpy)
+        
+        Speeds are signed, positive on the flood, and rows are labelled
+        flood, ebb or slack. NOAA only serves this product as JSON.
+        """
+        try:
+            url = f"{self.BASE_URL}/datagetter"
+            params = {
+                'product': 'currents_predictions',
+                'application': 'NOS.COOPS.TAC.WL',
+                'station': station_id,
+                'begin_date': begin_date,
+                'end_date': end_date,
+                'units': units,
+                'time_zone': time_zone,
+                'format': 'json',
+                'interval': interval
+            }
+            if bin is not None:
+                params['bin'] = bin
+            return self._get_series(url, params, 'json', columnar, quiet)
+        except Exception as e:
+            if not quiet:
+                print(f"Error retrieving current predictions: {e}")
+            return None
+    
     def get_water_temperature(self, station_id: str, begin_date: str, end_date: str,
                              units: str = "metric", time_zone: str = "gmt",
-                             interval: str = "h", quiet: bool = False) -> Optional[Dict]:
+                             interval: str = "h", quiet: bool = False,
+                             format: str = "json", columnar: bool = False) -> Optional[Union[TideSeries, ColumnarSeries, Dict]]:
         """
         Retrieve water temperature data
         
@@ -144,6 +353,8 @@ class NOAACoOpsAPI: # pragma: no cover
             units: Units (metric or english)
             time_zone: Time zone (gmt, lst, lst_ldt)
             interval: Data interval (h for hourly, 6 for 6-minute)
+            format: Response format requested from NOAA (json or csv)
+            columnar: If True, return a ColumnarSeries of NumPy arrays (needs numpy)
         """
         try:
             url = f"{self.BASE_URL}/datagetter"
@@ -155,12 +366,10 @@ class NOAACoOpsAPI: # pragma: no cover
                 'end_date': end_date,
                 'units': units,
                 'time_zone': time_zone,
-                'format': 'json',
+                'format': format,
                 'interval': interval
             }
-            response = self.session.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
+            return self._get_series(url, params, format, columnar, quiet)
         except Exception as e:
             if not quiet:
                 print(f"Error retrieving water temperature data: {e}")
@@ -168,7 +377,8 @@ class NOAACoOpsAPI: # pragma: no cover
     
     def get_wind(self, station_id: str, begin_date: str, end_date: str,
                 units: str = "metric", time_zone: str = "gmt",
-                interval: str = "h", quiet: bool = False) -> Optional[Dict]:
+                interval: str = "h", quiet: bool = False,
+                format: str = "json", columnar: bool = False) -> Optional[Union[TideSeries, ColumnarSeries, Dict]]:
         """Retrieve wind data"""
         try:
             url = f"{self.BASE_URL}/datagetter"
@@ -180,12 +390,10 @@ class NOAACoOpsAPI: # pragma: no cover
                 'end_date': end_date,
                 'units': units,
                 'time_zone': time_zone,
-                'format': 'json',
+                'format': format,
                 'interval': interval
             }
-            response = self.session.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
+            return self._get_series(url, params, format, columnar, quiet)
         except Exception as e:
             if not quiet:
                 print(f"Error retrieving wind data: {e}")
@@ -193,7 +401,8 @@ class NOAACoOpsAPI: # pragma: no cover
     
     def get_air_temperature(self, station_id: str, begin_date: str, end_date: str,
                            units: str = "metric", time_zone: str = "gmt",
-                           interval: str = "h", quiet: bool = False) -> Optional[Dict]:
+                           interval: str = "h", quiet: bool = False,
+                           format: str = "json", columnar: bool = False) -> Optional[Union[TideSeries, ColumnarSeries, Dict]]:
         """Retrieve air temperature data"""
         try:
             url = f"{self.BASE_URL}/datagetter"
@@ -205,12 +414,10 @@ class NOAACoOpsAPI: # pragma: no cover
                 'end_date': end_date,
                 'units': units,
                 'time_zone': time_zone,
-                'format': 'json',
+                'format': format,
                 'interval': interval
             }
-            response = self.session.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
+            return self._get_series(url, params, format, columnar, quiet)
         except Exception as e:
             if not quiet:
                 print(f"Error retrieving air temperature data: {e}")
@@ -218,7 +425,8 @@ class NOAACoOpsAPI: # pragma: no cover
     
     def get_barometric_pressure(self, station_id: str, begin_date: str, end_date: str,
                                units: str = "metric", time_zone: str = "gmt",
-                               interval: str = "h", quiet: bool = False) -> Optional[Dict]:
+                               interval: str = "h", quiet: bool = False,
+                               format: str = "json", columnar: bool = False) -> Optional[Union[TideSeries, ColumnarSeries, Dict]]:
         """Retrieve barometric pressure data"""
         try:
             url = f"{self.BASE_URL}/datagetter"
@@ -230,12 +438,10 @@ class NOAACoOpsAPI: # pragma: no cover
                 'end_date': end_date,
                 'units': units,
                 'time_zone': time_zone,
-                'format': 'json',
+                'format': format,
                 'interval': interval
             }
-            response = self.session.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
+            return self._get_series(url, params, format, columnar, quiet)
         except Exception as e:
             if not quiet:
                 print(f"Error retrieving barometric pressure data: {e}")
@@ -290,6 +496,8 @@ def format_date(date_str: str) -> str: # pragma: no cover
 
 def display_data(data: Dict, data_type: str): # pragma: no cover
     """Display retrieved data in a readable format"""
+    if isinstance(data, TideSeries):
+        data = data.to_dict()
     if not data:
         print(f"No {data_type} data available.")
         return
@@ -389,13 +597,26 @@ def load_config(config_file: str = "config.json") -> Optional[Dict]: # pragma: n
         # Get time zone (default to 'gmt' which is the API default)
         time_zone = config.get('time_zone', 'gmt')
         
+        # csv responses are smaller and faster to parse for long 6-minute ranges
+        response_format = config.get('format', 'json')
+        
+        # Serve forward-looking water levels from the station's harmonic constants.
+        # Off until the engine has been checked against a recorded NOAA fixture.
+        harmonic_predictions = config.get('harmonic_predictions', False)
+        
+        # Current predictions come from a current station (e.g. cs0201), not the tide station
+        current_station = config.get('current_station')
+        
         return {
             'station_id': station_id,
             'begin_date': begin_date,
             'end_date': end_date,
             'data_types': data_types,
             'units': units,
-            'time_zone': time_zone
+            'time_zone': time_zone,
+            'format': response_format,
+            'harmonic_predictions': harmonic_predictions,
+            'current_station': current_station
         }
     except FileNotFoundError:
         print(f"Error: Config file '{config_file}' not found.")
@@ -443,10 +664,10 @@ def get_user_input(): # pragma: no cover
             print("Error: End date must be after start date.")
             return None
         
-        # Check date range limits (API has limits)
+        # Long ranges are fetched in chunks that fit the API limits
         days_diff = (end_dt - begin_dt).days
         if days_diff > 365:
-            print(f"Warning: Date range is {days_diff} days. API limits may apply.")
+            print(f"Date range is {days_diff} days; it will be fetched in chunks.")
     except ValueError:
         print("Error: Invalid date format.")
         return None
@@ -506,13 +727,93 @@ def get_user_input(): # pragma: no cover
     }
 
 
-def fetch_and_save_data(config_file: str = "config.json", quiet: bool = False) -> Optional[Dict]:
+def predict_water_level(api: NOAACoOpsAPI, params: Dict, quiet: bool = True) -> Optional[TideSeries]:
+    """
+    High and low tide predictions for the configured range, computed locally
+    from the station's cached harmonic constants (see harmonics.py).
+    
+    Returns None when predictions are disabled, numpy is missing or the station
+    has no constants, so the caller fetches from NOAA as before.
+    """
+    if not params.get('harmonic_predictions', False) or harmonics.numpy is None:
+        return None
+    try:
+        constants = harmonics.load_constants(params['station_id'], params['units'], api)
+        if constants is None:
+            return None
+        return harmonics.predict_series(constants, params['begin_date'], params['end_date'],
+                                        time_zone=params['time_zone'], interval='hilo')
+    except Exception as e:
+        if not quiet:
+            print(f"Harmonic prediction unavailable, fetching from NOAA: {e}")
+        return None
+
+
+def station_now(api: NOAACoOpsAPI, station_id: str, time_zone: str, now: float = None) -> int:
+    """
+    The current time on a station's clock in a NOAA time zone, as epoch
+    seconds read like NOAA's stamps. lst and lst_ldt use the station's own
+    time zone from the metadata API; if that is unavailable, the server's
+    local time is used.
+    """
+    now = time.time() if now is None else now
+    if time_zone == 'gmt':
+        return int(now)
+    try:
+        details = api.get_station_details(station_id)
+        return harmonics.local_clock(now, float(details['timezonecorr']), bool(details.get('observedst')),
+                                     time_zone)
+    except Exception:
+        local = datetime.fromtimestamp(now)
+        return int((local - datetime(1970, 1, 1)).total_seconds())
+
+
+def _predict(api: NOAACoOpsAPI, params: Dict, data_type: str, predicted: Any, quiet: bool) -> Any:
+    """High/low tide or max flood/ebb and slack current predictions for the range, or None"""
+    if data_type == 'water_level':
+        if predicted is None:
+            predicted = api.get_predictions(
+                params['station_id'],
+                params['begin_date'],
+                params['end_date'],
+                units=params['units'],
+                time_zone=params['time_zone'],
+                interval='hilo',
+                quiet=quiet
+            )
+        return _as_predictions(predicted, 'predictions')
+    if data_type == 'currents' and params.get('current_station'):
+        # Water level stations have no current predictions, so only a configured current station is asked
+        return _as_predictions(api.get_currents_predictions(
+            params['current_station'],
+            params['begin_date'],
+            params['end_date'],
+            units=params['units'],
+            time_zone=params['time_zone'],
+            quiet=quiet
+        ), 'currents_predictions')
+    return None
+
+
+def _as_predictions(series: Any, product: str) -> Any:
+    """Mark a series as predicted events so reports don't read them as observations"""
+    if isinstance(series, TideSeries):
+        series.metadata = dict(series.metadata or {}, product=product)
+    return series
+
+
+def fetch_and_save_data(config_file: str = "config.json", quiet: bool = False,
+                        begin_date: str = None, end_date: str = None,
+                        time_zone: str = None) -> Optional[Dict]:
     """
     Fetch data from NOAA API and return it.
     
     Args:
         config_file: Path to configuration JSON file
         quiet: If True, suppress verbose output
+        begin_date: Start date (YYYYMMDD), overriding the configured range
+        end_date: End date (YYYYMMDD), overriding the configured range
+        time_zone: Time zone (gmt, lst, lst_ldt), overriding the configured one
         
     Returns:
         Dictionary containing the retrieved data, or None if error
@@ -531,16 +832,37 @@ def fetch_and_save_data(config_file: str = "config.json", quiet: bool = False) -
             print("Error: Failed to load configuration.")
         return None
     
+    if begin_date and end_date:
+        params['begin_date'] = begin_date
+        params['end_date'] = end_date
+    if time_zone:
+        params['time_zone'] = time_zone
+    
     if not quiet: # pragma: no cover
         print(f"Station ID: {params['station_id']}")
         print(f"Date range: {params['begin_date']} to {params['end_date']}")
         print(f"Data types: {', '.join(params['data_types'])}")
         print(f"Units: {params['units']}, Time zone: {params['time_zone']}")
     
+    # Observations stop at the present, so the part of the range after now gets high/low
+    # tide predictions (computed locally when the harmonic constants are cached) and
+    # max flood/ebb and slack current predictions: a few rows a day instead of 24+.
+    # "Now" and "today" are on the station's clock in the requested time zone.
+    now = station_now(api, params['station_id'], params['time_zone'])
+    today = time.strftime('%Y%m%d', time.gmtime(now))
+    forecast = params['end_date'][:8] >= today
+    future_only = params['begin_date'][:8] > today
+    predicted = None
+    if forecast and 'water_level' in params['data_types']:
+        predicted = predict_water_level(api, params, quiet)
+    
     # Get station info first (silently fail if it doesn't work)
     if not quiet: # pragma: no cover
         print(f"\nFetching station information for {params['station_id']}...")
-    station_info = api.get_station_info(params['station_id'], quiet=quiet)
+    if future_only and predicted is not None:
+        station_info = {'metadata': predicted.metadata}
+    else:
+        station_info = api.get_station_info(params['station_id'], quiet=quiet)
     if station_info and not quiet: # pragma: no cover
         print(f"Station found: {station_info.get('name', 'Unknown')}")
     
@@ -565,59 +887,33 @@ def fetch_and_save_data(config_file: str = "config.json", quiet: bool = False) -
             print(f"\nFetching {data_type.replace('_', ' ')}...")
         
         try:
-            if data_type == 'water_level':
-                data = api.get_water_level(
-                    params['station_id'],
-                    params['begin_date'],
-                    params['end_date'],
-                    units=params['units'],
-                    time_zone=params['time_zone'],
-                    quiet=quiet
-                )
-            elif data_type == 'currents':
-                data = api.get_currents(
+            predictions = _predict(api, params, data_type, predicted, quiet) if forecast else None
+            if future_only:
+                data = predictions
+                if data is None:
+                    reason = ("no current_station is configured" if data_type == 'currents'
+                              else f"no {data_type.replace('_', ' ')} observations exist for future dates")
+                    data = {'error': {'message': f"No {data_type.replace('_', ' ')} data: {reason}"}}
+            elif data_type in OBSERVATION_PRODUCTS:
+                # Observations go through the local warehouse, which only fetches the days it hasn't stored
+                fetch = getattr(api, f"get_{data_type}")
+                data = warehouse.fetch_noaa(
                     params['station_id'],
+                    data_type,
                     params['begin_date'],
-                    params['end_date'],
+                    today if forecast else params['end_date'],
+                    lambda begin, end: fetch(
+                        params['station_id'],
+                        begin,
+                        end,
+                        units=params['units'],
+                        time_zone=params['time_zone'],
+                        quiet=quiet,
+                        format=params.get('format', 'json')
+                    ),
                     units=params['units'],
                     time_zone=params['time_zone'],
-                    quiet=quiet
-                )
-            elif data_type == 'water_temperature': # pragma: no cover
-                data = api.get_water_temperature(
-                    params['station_id'],
-                    params['begin_date'],
-                    params['end_date'],
-                    units=params['units'],
-                    time_zone=params['time_zone'],
-                    quiet=quiet
-                )
-            elif data_type == 'wind': # pragma: no cover
-                data = api.get_wind(
-                    params['station_id'],
-                    params['begin_date'],
-                    params['end_date'],
-                    units=params['units'],
-                    time_zone=params['time_zone'],
-                    quiet=quiet
-                )
-            elif data_type == 'air_temperature': # pragma: no cover
-                data = api.get_air_temperature(
-                    params['station_id'],
-                    params['begin_date'],
-                    params['end_date'],
-                    units=params['units'],
-                    time_zone=params['time_zone'],
-                    quiet=quiet
-                )
-            elif data_type == 'barometric_pressure': # pragma: no cover
-                data = api.get_barometric_pressure(
-                    params['station_id'],
-                    params['begin_date'],
-                    params['end_date'],
-                    units=params['units'],
-                    time_zone=params['time_zone'],
-                    quiet=quiet
+                    now=now
                 )
             else: # pragma: no cover
                 if not quiet:
@@ -626,6 +922,11 @@ def fetch_and_save_data(config_file: str = "config.json", quiet: bool = False) -
             
             # Store the data
             all_data['data_types'][data_type] = data
+            if predictions is not None and not future_only:
+                # Observations cover the range up to now; predictions the rest of it
+                if isinstance(predictions, TideSeries):
+                    predictions = predictions.between(now + 1, predictions.times[-1] if len(predictions) else now)
+                all_data['data_types'][f"{data_type}_predictions"] = predictions
             
             if not quiet: # pragma: no cover
                 display_data(data, data_type)
@@ -646,7 +947,9 @@ def fetch_and_save_data(config_file: str = "config.json", quiet: bool = False) -
     }
 
 
-def get_tide(config_file: str = "config.json", quiet: bool = True) -> Optional[Dict]: # pragma: no cover
+def get_tide(config_file: str = "config.json", quiet: bool = True,
+             begin_date: str = None, end_date: str = None,
+             time_zone: str = None) -> Optional[Dict]: # pragma: no cover
     """
     Retrieve tides and currents data from NOAA API.
     
@@ -655,16 +958,25 @@ def get_tide(config_file: str = "config.json", quiet: bool = True) -> Optional[D
     Args:
         config_file: Path to configuration JSON file (default: "config.json")
         quiet: If True, suppress verbose output (default: True)
+        begin_date: Start date (YYYYMMDD); defaults to the configured range
+        end_date: End date (YYYYMMDD); defaults to the configured range
+        time_zone: Time zone for returned timestamps; defaults to config
         
     Returns:
         Dictionary containing the retrieved data, or None if error
     """
-    result = fetch_and_save_data(config_file, quiet=quiet)
+    result = fetch_and_save_data(config_file, quiet=quiet, begin_date=begin_date,
+                                 end_date=end_date, time_zone=time_zone)
     if result is None:
         return None
     return result
 
 
 if __name__ == "__main__": # pragma: no cover
-    get_tide()
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        # Bulk multi-station mode, see noaa_export.py
+        import noaa_export
+        noaa_export.main(sys.argv[2:])
+    else:
+        get_tide()
 
@@ -0,0 +1,210 @@
+"""
+Precomputed reports for popular locations.
+
+A nightly job ranks locations by the number of users who saved them in
+user_preferences and by recent /fish requests, prefetches their data and
+generates the "today" and "tomorrow" reports for each fishing type ahead of
+the morning rush. "any" is the report for users who have not saved a
+fishing type. Reports are kept in the shared cache (see cache.py) and
+served directly by get_today_report / get_tomorrow_report, headed with the
+time they were prepared. A "today" report is only served for
+today_max_age_minutes after it was generated; after that conditions have
+moved on and requests get a fresh report. Configured in the "precompute"
+section of config.json:
+
+    "precompute": {
+        "enabled": true,
+        "run_at": "04:30",
+        "max_locations": 30,
+        "fishing_types": ["any", "shore", "boat", "kayak"],
+        "concurrency": 2,
+        "requests_per_minute": 20,
+        "today_max_age_minutes": 240
+    }
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+
+import app_config
+import cache
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    "run_at": "04:30",
+    "max_locations": 30,
+    "fishing_types": ["any", "shore", "boat", "kayak"],
+    "concurrency": 2,
+    "requests_per_minute": 20,
+    "today_max_age_minutes": 240,
+}
+
+# The fishing type of users who have not saved one
+ANY_TYPE = "any"
+
+REPORT_KINDS = ("today", "tomorrow")
+
+# A saved location counts as this many requests when ranking
+SUBSCRIBER_WEIGHT = 5
+
+# How long request history is kept for ranking
+REQUEST_WINDOW_SECONDS = 7 * 24 * 60 * 60
+
+# Precomputed reports outlive the day they cover so late "today" requests still hit
+REPORT_TTL_SECONDS = 36 * 60 * 60
+
+_requests = deque()
+_requests_lock = threading.Lock()
+
+
+def get_settings(config=None):
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update((config if config is not None else app_config.load()).get("precompute", {}))
+    return settings
+
+
+def normalize_location(zip_code):
+    return str(zip_code).strip() if zip_code is not None else None
+
+
+def note_request(zip_code, now=None):
+    """Count a report request towards a location's popularity"""
+    location = normalize_location(zip_code)
+    if not location:
+        return
+    now = now if now is not None else time.time()
+    with _requests_lock:
+        _requests.append((now, location))
+        cutoff = now - REQUEST_WINDOW_SECONDS
+        while _requests and _requests[0][0] < cutoff:
+            _requests.popleft()
+
+
+def request_counts():
+    with _requests_lock:
+        return Counter(location for _, location in _requests)
+
+
+def reset():
+    """Forget request history (used by tests)"""
+    with _requests_lock:
+        _requests.clear()
+
+
+def rank_locations(config, counts=None, limit=30):
+    """Locations ordered by saved subscribers and recent requests, most popular first"""
+    counts = counts if counts is not None else request_counts()
+    scores = Counter()
+    for prefs in config.get("user_preferences", {}).values():
+        location = normalize_location(prefs.get("zip_code"))
+        if location:
+            scores[location] += SUBSCRIBER_WEIGHT
+    for location, count in counts.items():
+        scores[location] += count
+    return [location for location, _ in scores.most_common(limit)]
+
+
+def report_date(kind, now=None):
+    now = now or datetime.now()
+    if kind == "tomorrow":
+        now += timedelta(days=1)
+    return now.strftime("%Y-%m-%d")
+
+
+def _key(kind, zip_code, fishing_type, date):
+    return f"precomputed:{kind}:{normalize_location(zip_code)}:{fishing_type or ANY_TYPE}:{date}"
+
+
+def store(kind, zip_code, fishing_type, date, report):
+    cache.set(_key(kind, zip_code, fishing_type, date),
+              {"report": report, "generated_at": time.time()}, ttl=REPORT_TTL_SECONDS)
+
+
+def lookup(kind, zip_code, fishing_type, now=None):
+    """Precomputed report text for this location and day, headed with when it was prepared, or None"""
+    if not zip_code:
+        return None
+    entry = cache.get(_key(kind, zip_code, fishing_type, report_date(kind, now)))
+    if entry is None:
+        return None
+    generated_at = datetime.fromtimestamp(entry["generated_at"])
+    max_age = timedelta(minutes=get_settings()["today_max_age_minutes"])
+    if kind == "today" and (now or datetime.now()) - generated_at > max_age:
+        metrics.increment("precompute_expired_total", kind=kind)
+        return None
+    metrics.increment("precompute_hits_total", kind=kind)
+    return f"_Prepared at {generated_at.strftime('%H:%M')}_\n{entry['report']}"
+
+
+async def run(generate, prefetch=None, config=None, now=None):
+    """Precompute reports for the most popular locations
+
+    generate(kind, zip_code, fishing_type) must be a coroutine returning the
+    report text; prefetch(zip_code), if given, warms the data cache first.
+    Returns the number of reports stored.
+    """
+    # User preferences change while the bot runs, so they are read afresh
+    config = config if config is not None else app_config.read()
+    settings = get_settings(config)
+    locations = rank_locations(config, limit=settings["max_locations"])
+    logger.info("Precomputing reports for %d locations", len(locations))
+
+    semaphore = asyncio.Semaphore(settings["concurrency"])
+    interval = 60.0 / settings["requests_per_minute"] if settings["requests_per_minute"] else 0
+    pacing_lock = asyncio.Lock()
+    next_start = [0.0]
+    loop = asyncio.get_running_loop()
+
+    async def paced():
+        # Space out job starts so a long location list stays under the rate limit
+        async with pacing_lock:
+            delay = next_start[0] - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_start[0] = max(loop.time(), next_start[0]) + interval
+
+    async def job(kind, zip_code, fishing_type):
+        fishing_type = None if fishing_type == ANY_TYPE else fishing_type
+        async with semaphore:
+            await paced()
+            date = report_date(kind, now)
+            try:
+                report = await generate(kind, zip_code, fishing_type)
+            except Exception as e:
+                logger.error("Precompute %s report for %s (%s) failed: %s", kind, zip_code, fishing_type, e)
+                metrics.increment("precompute_reports_total", kind=kind, outcome="error")
+                return 0
+            if not report or report.startswith("❌"):
+                metrics.increment("precompute_reports_total", kind=kind, outcome="error")
+                return 0
+            store(kind, zip_code, fishing_type, date, report)
+            metrics.increment("precompute_reports_total", kind=kind, outcome="ok")
+            return 1
+
+    async def warm(zip_code):
+        async with semaphore:
+            try:
+                await prefetch(zip_code)
+            except Exception as e:
+                logger.warning("Prefetch for %s failed: %s", zip_code, e)
+
+    started = time.perf_counter()
+    if prefetch is not None:
+        await asyncio.gather(*(warm(zip_code) for zip_code in locations))
+
+    results = await asyncio.gather(*(
+        job(kind, zip_code, fishing_type)
+        for zip_code in locations
+        for fishing_type in settings["fishing_types"]
+        for kind in REPORT_KINDS
+    ))
+    stored = sum(results)
+    logger.info("Precomputed %d/%d reports in %.1fs", stored, len(results), time.perf_counter() - started)
+    return stored
@@ -0,0 +1,511 @@
+"""
+Upstream quotas: rate limits, daily budgets and degradation as budgets run low.
+
+Every upstream request (upstream.get and upstream.generate) takes a token
+from its provider's bucket, waiting up to max_wait seconds for one, and
+counts against the provider's daily budget. Daily counts, the rate-limit
+buckets and concurrency_slot() leases are kept in a small SQLite file, so
+restarts, report worker processes and shards share one set of limits.
+Configured in the "quotas" part of the "upstream" section of config.json,
+keyed by provider or by "provider:endpoint" for a single endpoint:
+
+    "quotas": {
+        "state": "quota.sqlite3",
+        "max_wait": 2.0,
+        "low_fraction": 0.2,
+        "critical_fraction": 0.05,
+        "ttl_multiplier": {"low": 4, "critical": 12},
+        "geocell_degrees": {"low": 0.1, "critical": 0.25},
+        "limits": {
+            "openweather": {"rate_per_minute": 60, "burst": 10, "daily": 1000},
+            "gemini": {"rate_per_minute": 10, "burst": 3, "tokens_per_minute": 250000, "daily": 1000}
+        }
+    }
+
+As a provider's remaining daily budget drops below low_fraction (and then
+critical_fraction) of its limit, its cached responses are kept fresh for
+ttl_multiplier times longer, locations are snapped to coarser geocells so
+nearby users share one response, and optional calls (e.g. One Call
+timemachine history) are skipped from critical on. A request over budget
+or rate raises QuotaExceededError, which upstream.get answers from the
+cache when it can. Remaining budgets are exported as the
+upstream_quota_remaining gauge.
+
+QUOTA_STATE overrides the state file and UPSTREAM_QUOTAS=off lifts every
+limit (e.g. against the benchmark stubs).
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import requests
+
+import metrics
+import resilience
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "state": "quota.sqlite3",
+    "max_wait": 2.0,
+    "low_fraction": 0.2,
+    "critical_fraction": 0.05,
+    "ttl_multiplier": {"low": 4, "critical": 12, "exhausted": 12},
+    "geocell_degrees": {"low": 0.1, "critical": 0.25, "exhausted": 0.25},
+    "limits": {},
+}
+
+class QuotaExceededError(requests.exceptions.ConnectionError):
+    """Raised when an upstream's rate limit or daily budget leaves no room for a request"""
+
+
+def get_settings():
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(resilience.get_settings().get("quotas", {}))
+    if os.getenv("QUOTA_STATE"):
+        settings["state"] = os.getenv("QUOTA_STATE")
+    if os.getenv("UPSTREAM_QUOTAS", "").lower() == "off":
+        settings["limits"] = {}
+    return settings
+
+
+class TokenBucket:
+    """rate tokens per second up to capacity; reservations may borrow ahead and wait"""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount=1, max_wait=0.0):
+        """Seconds to wait before using amount tokens, or None if that is longer than max_wait"""
+        with self._lock:
+            self._refill()
+            wait = max(0.0, (amount - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= amount
+            return wait
+
+    def drain(self, amount):
+        """Use tokens after the fact (e.g. tokens counted in a response); may go negative"""
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+
+
+class _SQLiteState:
+    """A state file shared by every process using it, with a connection per thread"""
+
+    SCHEMA = ()
+
+    def __init__(self, path="quota.sqlite3", clock=time.time):
+        self.path = path
+        self._clock = clock
+        self._local = threading.local()
+        with self._connect() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _immediate(self):
+        """A write transaction taken up front, so a read and the write it decides are atomic"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+class DailyCounters(_SQLiteState):
+    """Per-UTC-day counts in SQLite, shared by every process using the file"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS quota_counts ("
+        "day TEXT NOT NULL, key TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (day, key))",
+    )
+
+    def _day(self):
+        return time.strftime("%Y-%m-%d", time.gmtime(self._clock()))
+
+    def add(self, key, amount=1):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO quota_counts VALUES (?, ?, ?) "
+                "ON CONFLICT(day, key) DO UPDATE SET count = count + excluded.count",
+                (self._day(), key, amount))
+
+    def take(self, key, limit, amount=1):
+        """Add amount to key's count if that keeps it within limit; whether it did
+
+        The check and the increment are one write transaction, so processes
+        sharing the file can't both pass the check for the last request.
+        """
+        day = self._day()
+        with self._immediate() as conn:
+            conn.execute("INSERT OR IGNORE INTO quota_counts VALUES (?, ?, 0)", (day, key))
+            return conn.execute(
+                "UPDATE quota_counts SET count = count + ? WHERE day = ? AND key = ? AND count + ? <= ?",
+                (amount, day, key, amount, limit)).rowcount == 1
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT count FROM quota_counts WHERE day = ? AND key = ?", (self._day(), key)).fetchone()
+        return row[0] if row else 0
+
+    def purge(self):
+        """Drop counts from previous days"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM quota_counts WHERE day < ?", (self._day(),))
+
+
+class SharedLimits(_SQLiteState):
+    """Token buckets and concurrency leases in SQLite, shared by every process using the file
+
+    Report worker processes (and bot shards) each have their own QuotaManager;
+    keeping the buckets here makes a rate limit hold across all of them
+    instead of multiplying by the number of processes.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS quota_buckets ("
+        "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS quota_leases ("
+        "name TEXT NOT NULL, holder TEXT NOT NULL, expires REAL NOT NULL, PRIMARY KEY (name, holder))",
+    )
+
+    def _tokens(self, conn, name, rate, capacity, now):
+        row = conn.execute("SELECT tokens, updated FROM quota_buckets WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return float(capacity)
+        return min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+
+    def reserve(self, name, rate, capacity, amount=1, max_wait=0.0):
+        """TokenBucket.reserve for the bucket called name"""
+        with self._immediate() as conn:
+            now = self._clock()
+            tokens = self._tokens(conn, name, rate, capacity, now)
+            wait = max(0.0, (amount - tokens) / rate)
+            if wait > max_wait:
+                return None
+            conn.execute("INSERT OR REPLACE INTO quota_buckets VALUES (?, ?, ?)", (name, tokens - amount, now))
+            return wait
+
+    def drain(self, name, rate, capacity, amount):
+        with self._immediate() as conn:
+            now = self._clock()
+            tokens = self._tokens(conn, name, rate, capacity, now)
+            conn.execute("INSERT OR REPLACE INTO quota_buckets VALUES (?, ?, ?)", (name, tokens - amount, now))
+
+    def claim(self, name, holder, limit, lease):
+        """Take one of limit leases on name for lease seconds; whether there was one free"""
+        with self._immediate() as conn:
+            now = self._clock()
+            # Leases of processes that died holding them run out on their own
+            conn.execute("DELETE FROM quota_leases WHERE name = ? AND expires < ?", (name, now))
+            held = conn.execute("SELECT COUNT(*) FROM quota_leases WHERE name = ?", (name,)).fetchone()[0]
+            if held >= limit:
+                return False
+            conn.execute("INSERT OR REPLACE INTO quota_leases VALUES (?, ?, ?)", (name, holder, now + lease))
+            return True
+
+    def release(self, name, holder):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM quota_leases WHERE name = ? AND holder = ?", (name, holder))
+
+
+class SharedBucket:
+    """A TokenBucket whose state lives in SharedLimits"""
+
+    def __init__(self, state, name, rate, capacity):
+        self._state = state
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+
+    def reserve(self, amount=1, max_wait=0.0):
+        return self._state.reserve(self.name, self.rate, self.capacity, amount, max_wait)
+
+    def drain(self, amount):
+        self._state.drain(self.name, self.rate, self.capacity, amount)
+
+
+class MemoryCounters:
+    """DailyCounters for one process, used when the state file can't be opened"""
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def _day(self):
+        return time.strftime("%Y-%m-%d", time.gmtime(self._clock()))
+
+    def add(self, key, amount=1):
+        with self._lock:
+            day = self._day()
+            self._counts = {k: v for k, v in self._counts.items() if k[0] == day}
+            self._counts[(day, key)] = self._counts.get((day, key), 0) + amount
+
+    def take(self, key, limit, amount=1):
+        with self._lock:
+            day = self._day()
+            count = self._counts.get((day, key), 0)
+            if count + amount > limit:
+                return False
+            self._counts = {k: v for k, v in self._counts.items() if k[0] == day}
+            self._counts[(day, key)] = count + amount
+            return True
+
+    def get(self, key):
+        with self._lock:
+            return self._counts.get((self._day(), key), 0)
+
+    def purge(self):
+        pass
+
+
+class QuotaManager:
+    def __init__(self, settings=None, counters=None, clock=time.monotonic, sleep=time.sleep, shared=None):
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        if counters is None:
+            limits = self.settings["limits"].values()
+            # Nothing to persist without daily budgets, nor to share without rate limits
+            daily = any(limit.get("daily") for limit in limits)
+            counters = DailyCounters(self.settings["state"]) if daily else MemoryCounters()
+            if any(limit.get("rate_per_minute") or limit.get("tokens_per_minute") for limit in limits):
+                shared = SharedLimits(self.settings["state"])
+        self.counters = counters
+        # None keeps buckets and leases in this process (tests, or no state file)
+        self.shared = shared
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets = {}
+        self._local_leases = {}
+        self._lock = threading.Lock()
+
+    def _limit_key(self, provider, endpoint=None):
+        limits = self.settings["limits"]
+        if endpoint and f"{provider}:{endpoint}" in limits:
+            return f"{provider}:{endpoint}"
+        return provider if provider in limits else None
+
+    def _bucket(self, key, kind="requests"):
+        limit = self.settings["limits"][key]
+        per_minute = limit.get("rate_per_minute") if kind == "requests" else limit.get("tokens_per_minute")
+        if not per_minute:
+            return None
+        with self._lock:
+            bucket = self._buckets.get((key, kind))
+            if bucket is None:
+                capacity = limit.get("burst", 1) if kind == "requests" else per_minute
+                if self.shared is not None:
+                    bucket = SharedBucket(self.shared, f"{key}:{kind}", per_minute / 60.0, capacity)
+                else:
+                    bucket = TokenBucket(per_minute / 60.0, capacity, self._clock)
+                self._buckets[(key, kind)] = bucket
+            return bucket
+
+    def acquire(self, provider, endpoint=None, max_wait=None):
+        """Wait for room for one request and return the seconds waited, or raise QuotaExceededError
+
+        max_wait overrides the configured wait; float("inf") queues for as
+        long as the rate limits need (the Gemini dispatcher does this).
+        """
+        key = self._limit_key(provider, endpoint)
+        if key is None:
+            return 0.0
+        max_wait = self.settings["max_wait"] if max_wait is None else max_wait
+        limit = self.settings["limits"][key]
+        daily = limit.get("daily")
+        # Cheap early rejection; the budget is only spent by take() below
+        if daily and self.counters.get(key) >= daily:
+            self._reject_daily(key, daily)
+
+        waits = []
+        # A token check reserves nothing, so it goes first and a rejection never spends a request
+        for kind in ("tokens", "requests"):
+            bucket = self._bucket(key, kind)
+            if bucket is None:
+                continue
+            wait = bucket.reserve(1 if kind == "requests" else 0, max_wait)
+            if wait is None:
+                metrics.increment("upstream_quota_rejected_total", provider=key, reason="rate")
+                raise QuotaExceededError(f"{key} {kind} rate limit reached")
+            waits.append(wait)
+        if daily:
+            if not self.counters.take(key, daily):
+                self._reject_daily(key, daily)
+        else:
+            self.counters.add(key)
+        wait = max(waits, default=0.0)
+        if wait > 0:
+            metrics.increment("upstream_quota_waits_total", provider=key)
+            self._sleep(wait)
+
+        self._export(key)
+        return wait
+
+    def _reject_daily(self, key, daily):
+        metrics.increment("upstream_quota_rejected_total", provider=key, reason="daily")
+        raise QuotaExceededError(f"{key} daily budget of {daily} requests is used up")
+
+    @contextmanager
+    def concurrency_slot(self, name, limit, lease=600.0, poll=0.05):
+        """Hold one of limit slots called name, shared across processes, waiting for one as long as needed
+
+        A slot whose holder died is freed after lease seconds.
+        """
+        if self.shared is None:
+            with self._lock:
+                semaphore = self._local_leases.get((name, limit))
+                if semaphore is None:
+                    semaphore = self._local_leases[(name, limit)] = threading.BoundedSemaphore(limit)
+            with semaphore:
+                yield
+            return
+        holder = uuid.uuid4().hex
+        while not self.shared.claim(name, holder, limit, lease):
+            self._sleep(poll)
+        try:
+            yield
+        finally:
+            self.shared.release(name, holder)
+
+    def record_tokens(self, provider, tokens, endpoint=None):
+        """Count model tokens against a tokens_per_minute limit"""
+        key = self._limit_key(provider, endpoint)
+        bucket = self._bucket(key, "tokens") if key else None
+        if bucket is not None and tokens:
+            bucket.drain(tokens)
+
+    def remaining(self, provider, endpoint=None):
+        """Requests left in today's budget, or None if the provider has no daily limit"""
+        key = self._limit_key(provider, endpoint)
+        daily = self.settings["limits"][key].get("daily") if key else None
+        if not daily:
+            return None
+        return max(0, daily - self.counters.get(key))
+
+    def level(self, provider, endpoint=None):
+        """normal, low, critical or exhausted, from the share of the daily budget left"""
+        key = self._limit_key(provider, endpoint)
+        remaining = self.remaining(provider, endpoint)
+        if remaining is None:
+            return "normal"
+        share = remaining / self.settings["limits"][key]["daily"]
+        if remaining == 0:
+            return "exhausted"
+        if share <= self.settings["critical_fraction"]:
+            return "critical"
+        if share <= self.settings["low_fraction"]:
+            return "low"
+        return "normal"
+
+    def ttl_multiplier(self, provider):
+        return self.settings["ttl_multiplier"].get(self.level(provider), 1)
+
+    def geocell(self, provider, lat, lon):
+        """lat/lon snapped to the provider's current geocell size (unchanged while the budget is healthy)"""
+        degrees = self.settings["geocell_degrees"].get(self.level(provider))
+        if not degrees or lat is None or lon is None:
+            return lat, lon
+        snap = lambda value: f"{round(float(value) / degrees) * degrees:.4f}".rstrip("0").rstrip(".")
+        return snap(lat), snap(lon)
+
+    def optional_allowed(self, provider, endpoint=None):
+        """Whether nice-to-have calls should still be made"""
+        return self.level(provider, endpoint) in ("normal", "low")
+
+    def _export(self, key):
+        remaining = self.remaining(*key.split(":", 1))
+        if remaining is not None:
+            metrics.set_gauge("upstream_quota_remaining", remaining, provider=key)
+
+    def status(self):
+        """Remaining daily budget and level for every configured limit"""
+        result = {}
+        for key in self.settings["limits"]:
+            provider, _, endpoint = key.partition(":")
+            result[key] = {"remaining": self.remaining(provider, endpoint or None),
+                           "level": self.level(provider, endpoint or None)}
+            self._export(key)
+        return result
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            settings = get_settings()
+            try:
+                _manager = QuotaManager(settings)
+            except sqlite3.Error as e:
+                # Counting in memory still enforces the limits for this process
+                logger.warning("Quota state %s unavailable, counting in memory: %s", settings['state'], e)
+                _manager = QuotaManager(settings, counters=MemoryCounters())
+        return _manager
+
+
+def configure(manager=None, settings=None):
+    """Replace the process-wide quota manager (used by tests and benchmarks)"""
+    global _manager
+    with _manager_lock:
+        _manager = manager if manager is not None else QuotaManager({**get_settings(), **(settings or {})})
+        return _manager
+
+
+def acquire(provider, endpoint=None, max_wait=None):
+    return get_manager().acquire(provider, endpoint, max_wait)
+
+
+def concurrency_slot(name, limit):
+    return get_manager().concurrency_slot(name, limit)
+
+
+def record_tokens(provider, tokens, endpoint=None):
+    get_manager().record_tokens(provider, tokens, endpoint)
+
+
+def ttl_multiplier(provider):
+    return get_manager().ttl_multiplier(provider)
+
+
+def geocell(provider, lat, lon):
+    return get_manager().geocell(provider, lat, lon)
+
+
+def optional_allowed(provider, endpoint=None):
+    return get_manager().optional_allowed(provider, endpoint)
+
+
+def status():
+    return get_manager().status()
@@ -0,0 +1,285 @@
+"""
+Isolated worker processes for report generation.
+
+When enabled, report jobs (data collection, prompt building and the Gemini
+call) run in a pool of worker processes so CPU-heavy bursts cannot starve
+the Discord gateway heartbeat in the bot process. Configured in the
+"report_workers" section of config.json:
+
+    "report_workers": {"enabled": true, "count": 2, "timeout": 120}
+
+Setting REPORT_WORKERS=<count> in the environment enables the pool with
+that many workers regardless of config.json.
+
+A crashed worker only fails the jobs it was running; the pool is rebuilt
+for the next job. Jobs that exceed the timeout return an error to the user
+and retire the pool: its workers are terminated, since one of them is stuck,
+and new jobs go to fresh workers. The timeout counts from when a worker
+picks the job up, so a job that only waited in the queue never trips it.
+"""
+
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import app_config
+import gemini_usage
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {"enabled": False, "count": 2, "timeout": 120}
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+
+class ReportTimeoutError(Exception):
+    """Raised when a report job does not finish within the configured timeout"""
+
+
+class WorkerCrashedError(Exception):
+    """Raised when the worker running a report job died"""
+
+
+def get_settings():
+    settings = app_config.section("report_workers", DEFAULT_SETTINGS)
+    env_count = os.getenv("REPORT_WORKERS")
+    if env_count:
+        settings["count"] = int(env_count)
+        settings["enabled"] = settings["count"] > 0
+    return settings
+
+
+# In a worker: where _run_job reports that it has picked up a job
+_starts = None
+
+
+def _init_worker(starts=None): # pragma: no cover
+    global _starts
+    # Ctrl-C is handled by the bot process, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _starts = starts
+
+
+def _run_job(job_id, func, args, kwargs, forced_model):
+    """Runs inside a worker: returns the job result and any Gemini usage it recorded"""
+    if _starts is not None:
+        _starts.send(job_id)
+    gemini_usage.forced_model = forced_model
+    gemini_usage.usage_tracker.reset()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        gemini_usage.forced_model = None
+    return result, gemini_usage.usage_tracker.events()
+
+
+class _LockedConnection:
+    """The writing end of a pipe shared by several processes"""
+
+    def __init__(self, connection, lock):
+        self.connection = connection
+        self.lock = lock
+
+    def send(self, obj):
+        with self.lock:
+            self.connection.send(obj)
+
+
+class _StartWatcher:
+    """Tells the bot process when a worker picks up each job, so timeouts don't count queueing"""
+
+    def __init__(self, context):
+        self._reader, writer = context.Pipe(duplex=False)
+        # Workers share the writing end; the lock keeps their messages whole
+        self.writer = _LockedConnection(writer, context.Lock())
+        self._waiting = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="report-job-starts", daemon=True)
+        self._thread.start()
+
+    def expect(self, job_id):
+        """An asyncio.Event set when a worker starts job_id"""
+        event = asyncio.Event()
+        with self._lock:
+            self._waiting[job_id] = (asyncio.get_running_loop(), event)
+        return event
+
+    def forget(self, job_id):
+        with self._lock:
+            self._waiting.pop(job_id, None)
+
+    def _run(self):
+        while not self._closed.is_set():
+            try:
+                if not self._reader.poll(0.2):
+                    continue
+                job_id = self._reader.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                waiter = self._waiting.pop(job_id, None)
+            if waiter is not None:
+                loop, event = waiter
+                loop.call_soon_threadsafe(event.set)
+        self._reader.close()
+        self.writer.connection.close()
+
+    def close(self):
+        self._closed.set()
+
+
+def _terminate_workers(executor):
+    """Kill an executor's worker processes, whatever they are running"""
+    terminate = getattr(executor, "terminate_workers", None)
+    if terminate is not None:
+        terminate()
+        return
+    # Before Python 3.14 there is no public way to stop a running job
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        process.terminate()
+
+
+class WorkerPool:
+    """Process pool with crash recovery, result timeouts and queue metrics"""
+
+    def __init__(self, count=2, timeout=120):
+        self.count = count
+        self.timeout = timeout
+        self._executor = None
+        self._watcher = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._job_ids = itertools.count()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                logger.info("Starting %d report worker processes", self.count)
+                # spawn avoids forking a process that is running the event loop and threads
+                context = multiprocessing.get_context("spawn")
+                self._watcher = _StartWatcher(context)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.count,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(self._watcher.writer,),
+                )
+            return self._executor, self._watcher
+
+    def start(self):
+        """Spawn the workers ahead of the first report so users don't pay the start-up cost"""
+        executor, _ = self._get_executor()
+        for _ in range(self.count):
+            executor.submit(os.getpid)
+
+    def _discard_executor(self, executor, watcher, terminate=False):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self._watcher = None
+        if terminate:
+            _terminate_workers(executor)
+        executor.shutdown(wait=False)
+        watcher.close()
+
+    def _track(self, delta):
+        with self._lock:
+            self._in_flight += delta
+            metrics.set_gauge("report_jobs_in_flight", self._in_flight)
+
+    async def submit(self, func, *args, user_id=None, **kwargs):
+        """Run func(*args, **kwargs) in a worker and return its result
+
+        The timeout runs from when a worker picks the job up, so time spent
+        queued behind other reports never counts against it.
+        """
+        forced_model = None
+        model = gemini_usage.choose_model(DEFAULT_MODEL, user_id)
+        if model != DEFAULT_MODEL:
+            forced_model = model
+        if user_id is not None:
+            kwargs["user_id"] = user_id
+
+        executor, watcher = self._get_executor()
+        name = getattr(func, "__name__", str(func))
+        job_id = next(self._job_ids)
+        picked_up = watcher.expect(job_id)
+        started = time.perf_counter()
+        self._track(1)
+        try:
+            future = executor.submit(_run_job, job_id, func, args, kwargs, forced_model)
+            result_future = asyncio.wrap_future(future)
+            waiter = asyncio.ensure_future(picked_up.wait())
+            try:
+                await asyncio.wait({result_future, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+            # shield: on timeout we decide what happens to the job, not wait_for
+            result, usage_events = await asyncio.wait_for(asyncio.shield(result_future), self.timeout)
+        except asyncio.TimeoutError:
+            metrics.increment("report_jobs_total", job=name, outcome="timeout")
+            # Nobody awaits the job any more, whatever becomes of it
+            result_future.cancel()
+            if future.cancel():
+                logger.error("Report job %s timed out before it started", name)
+            else:
+                # Its worker is stuck on it; stop that pool rather than leave the process running
+                logger.error("Report job %s timed out after %ss; restarting pool", name, self.timeout)
+                self._discard_executor(executor, watcher, terminate=True)
+            raise ReportTimeoutError(f"Report generation timed out after {self.timeout} seconds")
+        except BrokenProcessPool:
+            metrics.increment("report_jobs_total", job=name, outcome="crashed")
+            logger.error("Report worker crashed while running %s; restarting pool", name)
+            self._discard_executor(executor, watcher)
+            raise WorkerCrashedError("Report worker crashed")
+        finally:
+            watcher.forget(job_id)
+            self._track(-1)
+
+        for event in usage_events:
+            gemini_usage.usage_tracker.ingest(event)
+        metrics.increment("report_jobs_total", job=name, outcome="ok")
+        metrics.observe("report_job_seconds", time.perf_counter() - started, job=name)
+        return result
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            watcher, self._watcher = self._watcher, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+            watcher.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def enabled():
+    return bool(get_settings()["enabled"])
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            settings = get_settings()
+            _pool = WorkerPool(settings["count"], settings["timeout"])
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
@@ -0,0 +1,244 @@
+"""
+Timeouts, retries and circuit breakers for upstream calls.
+
+Settings come from the "upstream" section of config.json, keyed by provider
+or by "provider:endpoint" for a single endpoint:
+
+    "upstream": {
+        "timeouts": {"default": [3.05, 10], "noaa:datagetter": [3.05, 15]},
+        "retries": {"max_attempts": 3, "base_delay": 0.25, "max_delay": 2.0},
+        "circuit_breaker": {"failure_threshold": 5, "reset_timeout": 30}
+    }
+
+Timeouts are (connect, read) seconds. Retries use exponential backoff with
+full jitter and only fire for connection errors, timeouts, 429 and 5xx.
+
+The section is read on first use and kept for the life of the process; edits
+to config.json take effect on restart, or when reload_settings() is called.
+"""
+
+import logging
+import random
+import threading
+import time
+
+import requests
+
+import app_config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = (3.05, 10.0)
+DEFAULT_RETRIES = {"max_attempts": 3, "base_delay": 0.25, "max_delay": 2.0}
+DEFAULT_BREAKER = {"failure_threshold": 5, "reset_timeout": 30.0}
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised when an upstream's circuit breaker is open"""
+
+
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def get_settings():
+    """The "upstream" section, cached until reload_settings()"""
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            _settings = app_config.section("upstream")
+        return _settings
+
+
+def reload_settings(settings=None):
+    """Re-read settings from config.json (or use the given dict) and reset breakers"""
+    global _settings
+    with _settings_lock:
+        _settings = settings if settings is not None else app_config.section("upstream")
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def _lookup(section, provider, endpoint, default):
+    values = get_settings().get(section, {})
+    for key in (f"{provider}:{endpoint}", provider, "default"):
+        if key in values:
+            return values[key]
+    return default
+
+
+def get_timeout(provider, endpoint, default=None):
+    """(connect, read) timeout for an endpoint"""
+    value = _lookup("timeouts", provider, endpoint, None)
+    if value is None:
+        value = default if default is not None else DEFAULT_TIMEOUT
+    if isinstance(value, (int, float)):
+        return (min(float(value), DEFAULT_TIMEOUT[0]), float(value))
+    return tuple(value)
+
+
+def _policy(section, provider, endpoint, defaults):
+    """Merge a flat policy, or one keyed like the timeouts, over the defaults"""
+    policy = dict(defaults)
+    values = get_settings().get(section, {})
+    if any(key in values for key in defaults):
+        policy.update(values)
+    else:
+        policy.update(_lookup(section, provider, endpoint, {}))
+    return policy
+
+
+def get_retry_policy(provider, endpoint):
+    return _policy("retries", provider, endpoint, DEFAULT_RETRIES)
+
+
+def backoff_delay(attempt, base_delay, max_delay, rng=random):
+    """Exponential backoff with full jitter for the given retry attempt (0-based)"""
+    return rng.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open probe after a cool-down"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._set_state(self.HALF_OPEN)
+            self._probe_in_flight = False
+
+    def _set_state(self, state):
+        if state != self._state:
+            logger.warning("Circuit for %s is now %s", self.name, state)
+        self._state = state
+        metrics.set_gauge("upstream_circuit_open", 0 if state == self.CLOSED else 1, provider=self.name)
+
+    def allow(self):
+        """Whether a request may be sent now"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            self._set_state(self.CLOSED)
+
+    def release(self):
+        """End an attempt that says nothing about the upstream's health"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+                self._set_state(self.OPEN)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider):
+    with _breakers_lock:
+        breaker = _breakers.get(provider)
+        if breaker is None:
+            settings = _policy("circuit_breaker", provider, None, DEFAULT_BREAKER)
+            breaker = CircuitBreaker(provider, settings["failure_threshold"], settings["reset_timeout"])
+            _breakers[provider] = breaker
+        return breaker
+
+
+def is_retryable_response(response):
+    return getattr(response, "status_code", None) in RETRYABLE_STATUS
+
+
+def is_retryable_exception(exc):
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    # google.genai APIError and similar expose the HTTP status as .code
+    return getattr(exc, "code", None) in RETRYABLE_STATUS
+
+
+def call(provider, endpoint, attempt_fn, default_timeout=None, sleep=time.sleep, rng=random):
+    """Run attempt_fn(timeout) with retries under the provider's circuit breaker
+
+    attempt_fn may return a response (retried on 429/5xx) or raise. The last
+    response is returned even if it is an error status; the last exception
+    is re-raised once attempts run out.
+    """
+    breaker = get_breaker(provider)
+    policy = get_retry_policy(provider, endpoint)
+    timeout = get_timeout(provider, endpoint, default_timeout)
+    max_attempts = max(1, int(policy["max_attempts"]))
+
+    for attempt in range(max_attempts):
+        if not breaker.allow():
+            metrics.increment("upstream_requests_total", provider=provider, endpoint=endpoint, outcome="circuit_open")
+            raise CircuitOpenError(f"Circuit open for {provider}")
+
+        started = time.perf_counter()
+        try:
+            response = attempt_fn(timeout)
+        except Exception as e:
+            metrics.observe("upstream_latency_seconds", time.perf_counter() - started, provider=provider)
+            if not is_retryable_exception(e):
+                # A bug or a rejected request, not an outage: leave the breaker's
+                # state alone, but let a half-open breaker send another probe
+                breaker.release()
+                metrics.increment("upstream_requests_total", provider=provider, endpoint=endpoint, outcome="error")
+                raise
+            breaker.record_failure()
+            metrics.increment("upstream_requests_total", provider=provider, endpoint=endpoint, outcome="error")
+            if attempt + 1 >= max_attempts:
+                raise
+            logger.warning("%s %s failed (%s), retrying (%d/%d)", provider, endpoint, e, attempt + 1, max_attempts - 1)
+        else:
+            metrics.observe("upstream_latency_seconds", time.perf_counter() - started, provider=provider)
+            if not is_retryable_response(response):
+                breaker.record_success()
+                metrics.increment("upstream_requests_total", provider=provider, endpoint=endpoint, outcome="ok")
+                return response
+            breaker.record_failure()
+            metrics.increment("upstream_requests_total", provider=provider, endpoint=endpoint,
+                              outcome=str(response.status_code))
+            if attempt + 1 >= max_attempts:
+                return response
+            logger.warning("%s %s returned %s, retrying (%d/%d)", provider, endpoint, response.status_code,
+                           attempt + 1, max_attempts - 1)
+
+        metrics.increment("upstream_retries_total", provider=provider, endpoint=endpoint)
+        sleep(backoff_delay(attempt, policy["base_delay"], policy["max_delay"], rng))
@@ -0,0 +1,86 @@
+"""
+Gateway sharding for the Discord client.
+
+The bot runs on discord.AutoShardedClient. By default one process runs
+every shard and Discord picks the shard count. Large deployments can
+split the shards across processes by giving each one a shard range in
+the "sharding" section of config.json or in the environment:
+
+    "sharding": {"shard_count": 8, "shard_ids": "0-3"}
+
+    SHARD_COUNT=8 SHARD_IDS=4-7 python main.py
+
+Each process only sends the daily reports of subscribers whose channel
+belongs to one of its shards. Only the process running shard 0 syncs
+slash commands and runs the precompute job, so they are not duplicated.
+"""
+
+import logging
+import os
+
+import app_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {"shard_count": None, "shard_ids": None}
+
+
+def parse_shard_ids(value):
+    """Shard ids from "0-3", "0,2,4", a mix of both, or a list; None means all"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (list, tuple)):
+        return sorted({int(shard) for shard in value})
+    shard_ids = set()
+    for part in str(value).split(","):
+        first, _, last = part.strip().partition("-")
+        shard_ids.update(range(int(first), int(last or first) + 1))
+    return sorted(shard_ids)
+
+
+def get_settings():
+    settings = app_config.section("sharding", DEFAULT_SETTINGS)
+    if os.getenv("SHARD_COUNT"):
+        settings["shard_count"] = int(os.getenv("SHARD_COUNT"))
+    if os.getenv("SHARD_IDS"):
+        settings["shard_ids"] = os.getenv("SHARD_IDS")
+    settings["shard_ids"] = parse_shard_ids(settings["shard_ids"])
+    if settings["shard_ids"] is not None and not settings["shard_count"]:
+        raise ValueError("shard_ids needs an explicit shard_count")
+    return settings
+
+
+def client_options(settings=None):
+    """Keyword arguments for discord.AutoShardedClient"""
+    settings = settings or get_settings()
+    options = {}
+    if settings["shard_count"]:
+        options["shard_count"] = settings["shard_count"]
+    if settings["shard_ids"] is not None:
+        options["shard_ids"] = settings["shard_ids"]
+    return options
+
+
+def shard_for(guild_id, shard_count):
+    """Shard that receives a guild's events (direct messages go to shard 0)"""
+    if not guild_id:
+        return 0
+    return (int(guild_id) >> 22) % (shard_count or 1)
+
+
+def local_shards(client):
+    shard_ids = getattr(client, "shard_ids", None)
+    return set(shard_ids) if shard_ids is not None else set(range(client.shard_count or 1))
+
+
+def is_primary(client):
+    """Whether this process runs shard 0 and so does the once-per-bot work"""
+    return 0 in local_shards(client)
+
+
+def owns_subscriber(client, user_data):
+    """Whether a daily report subscriber's channel belongs to one of this process's shards"""
+    if "daily_report_guild" not in user_data:
+        # Subscriptions saved before guild ids were stored: only our shards' channels are cached
+        return client.get_channel(user_data.get("daily_report_channel")) is not None
+    return shard_for(user_data["daily_report_guild"], client.shard_count) in local_shards(client)
@@ -0,0 +1,146 @@
+import threading
+
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+
+import admission
+import command_logic
+
+
+def _controller(**settings):
+    return admission.AdmissionController({"enabled": True, "capacity": 1, **settings})
+
+
+def test_levels_follow_queue_depth():
+    controller = _controller(degrade_queue_depth=2, max_queue_depth=3)
+    assert controller.level() == admission.NORMAL
+    # One running plus two queued
+    with controller.track(), controller.track(), controller.track():
+        assert controller.queue_depth() == 2
+        assert controller.level() == admission.DEGRADED
+        with controller.track():
+            assert controller.level() == admission.BUSY
+    assert controller.in_flight() == 0
+    assert controller.level() == admission.NORMAL
+
+
+def test_admission_counts_the_report_at_once():
+    controller = _controller(degrade_queue_depth=1, max_queue_depth=2)
+    first, second = controller.admit(), controller.admit()
+    assert (first.level, second.level) == (admission.NORMAL, admission.NORMAL)
+    assert controller.in_flight() == 2
+    # The third sees the second queued before either report has started
+    third = controller.admit()
+    assert third.level == admission.DEGRADED
+    with third:
+        pass
+    with first, second:
+        pass
+    assert controller.in_flight() == 0
+
+
+def test_burst_cannot_all_pass_the_check():
+    controller = _controller(degrade_queue_depth=1000, max_queue_depth=5)
+    start = threading.Barrier(20)
+    levels = []
+
+    def command():
+        start.wait()
+        levels.append(controller.admit().level)
+
+    threads = [threading.Thread(target=command) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    # capacity 1 plus 4 queued; the sixth would make the queue 5 deep
+    assert levels.count(admission.NORMAL) == 6
+    assert controller.in_flight() == 6
+
+
+def test_slow_reports_degrade_until_the_window_passes():
+    now = [0.0]
+    controller = admission.AdmissionController(
+        {"enabled": True, "capacity": 0, "degrade_latency": 30, "max_latency": 90, "latency_window": 300},
+        clock=lambda: now[0])
+    with controller.track():
+        now[0] += 45
+    assert controller.latency() == 45
+    # Latency only matters while reports are queued
+    assert controller.level() == admission.NORMAL
+    with controller.track():
+        assert controller.level() == admission.DEGRADED
+        now[0] += 301
+        assert controller.level() == admission.NORMAL
+
+
+def test_disabled_by_default():
+    assert admission.DEFAULT_SETTINGS["enabled"] is False
+    controller = admission.AdmissionController({"capacity": 0, "max_queue_depth": 0})
+    assert controller.admit().level == admission.NORMAL
+
+
+@pytest.mark.asyncio
+async def test_commands_shed_load():
+    controller = admission.configure(_controller(degrade_queue_depth=1, max_queue_depth=2))
+    try:
+        with patch("command_logic.get_quick_report", return_value="quick") as quick, \
+                patch("command_logic.precompute.lookup", return_value=None), \
+                patch("command_logic.run_report") as run_report:
+            with controller.track(), controller.track():
+                assert await command_logic.get_today_report("29414", "kayak", user_id=1) == "quick"
+                assert await command_logic.get_time_window_report(
+                    "2026-01-02 06:00", "2026-01-03 09:00", "29414", "kayak", user_id=1) == "quick"
+                with controller.track():
+                    assert await command_logic.get_weekly_report("29414", "kayak", user_id=1) == admission.BUSY_MESSAGE
+                # Scheduled reports are never shed
+                run_report.return_value = "full"
+                assert await command_logic.get_today_report("29414", "kayak", user_id=1, priority="daily") == "full"
+            # Admitted reports hand their place in flight to run_report
+            assert await command_logic.get_weekly_report("29414", "kayak", user_id=1) == "full"
+            assert run_report.call_args.kwargs["admitted"].level == admission.NORMAL
+        assert quick.call_args.kwargs == {"first": "2026-01-02", "last": "2026-01-03", "days": 1}
+    finally:
+        admission.configure(admission.AdmissionController())
+
+
+def test_release_gives_the_place_back_without_a_latency():
+    controller = _controller()
+    admitted = controller.admit()
+    admitted.release()
+    with admitted:
+        pass
+    assert controller.in_flight() == 0
+    assert controller.latency() is None
+
+
+@pytest.mark.asyncio
+async def test_busy_commands_are_answered_before_deferring():
+    controller = admission.configure(_controller(degrade_queue_depth=1, max_queue_depth=1))
+    interaction = AsyncMock()
+    interaction.user.id = 42
+    try:
+        with patch("command_logic.get_location", Mock(return_value="29414")), \
+                patch("command_logic.precompute.lookup", return_value=None), \
+                patch("command_logic.get_weekly_report", new_callable=AsyncMock) as report:
+            with controller.track(), controller.track():
+                await command_logic.week_logic(interaction, None, None)
+        interaction.response.send_message.assert_awaited_once_with(admission.BUSY_MESSAGE, ephemeral=True)
+        interaction.response.defer.assert_not_awaited()
+        report.assert_not_awaited()
+        assert controller.in_flight() == 0
+    finally:
+        admission.configure(admission.AdmissionController())
+
+
+@pytest.mark.asyncio
+async def test_degraded_report_without_cached_data_is_busy():
+    controller = admission.configure(_controller(degrade_queue_depth=1, max_queue_depth=2))
+    try:
+        with patch("command_logic.get_quick_report", return_value=None), \
+                patch("command_logic.run_report") as run_report:
+            with controller.track(), controller.track():
+                assert await command_logic.get_weekly_report("29414", "kayak", user_id=1) == admission.BUSY_MESSAGE
+        run_report.assert_not_called()
+    finally:
+        admission.configure(admission.AdmissionController())
@@ -0,0 +1,32 @@
+import json
+
+import app_config
+from gemini_usage import UsageTracker, choose_model
+
+
+def write(path, config):
+    path.write_text(json.dumps(config), encoding="utf-8")
+
+
+def test_config_is_read_once_until_reloaded(tmp_path, monkeypatch):
+    path = tmp_path / "config.json"
+    write(path, {"gemini_budget": {"global_daily_tokens": 10, "fallback_model": "lite"}})
+    monkeypatch.setattr(app_config, "CONFIG_FILE", str(path))
+    app_config.configure()
+    assert app_config.section("gemini_budget")["global_daily_tokens"] == 10
+
+    # Edits and even a missing file go unnoticed until reload()
+    path.unlink()
+    assert app_config.section("gemini_budget", {"x": 1}) == {"x": 1, "global_daily_tokens": 10, "fallback_model": "lite"}
+    write(path, {"gemini_budget": {}})
+    assert app_config.section("gemini_budget")["fallback_model"] == "lite"
+    app_config.reload()
+    assert app_config.section("gemini_budget") == {}
+    assert choose_model("gemini-2.5-flash", 1, UsageTracker()) == "gemini-2.5-flash"
+
+
+def test_sections_are_copies():
+    app_config.configure({"cache": {"ttl": {"noaa": 60}}})
+    app_config.section("cache")["ttl"]["noaa"] = 0
+    assert app_config.section("cache") == {"ttl": {"noaa": 60}}
+    assert app_config.read("missing.json") == {}
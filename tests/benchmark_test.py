@@ -0,0 +1,63 @@
+import pytest
+
+import call_gemini
+import fish
+import weather
+from noaa_tides_currents import NOAACoOpsAPI
+from benchmarks.stub_servers import Latency, StubServer
+from benchmarks.load_benchmark import run_benchmark
+
+@pytest.fixture
+def restore_upstreams(monkeypatch):
+    # configure_upstreams repoints module globals at the stubs; undo that afterwards
+    monkeypatch.setattr(weather, "OPEN_WEATHER_BASE_URL", weather.OPEN_WEATHER_BASE_URL)
+    monkeypatch.setattr(fish, "INATURALIST_BASE_URL", fish.INATURALIST_BASE_URL)
+    monkeypatch.setattr(NOAACoOpsAPI, "BASE_URL", NOAACoOpsAPI.BASE_URL)
+    monkeypatch.setattr(call_gemini, "_client", None)
+    monkeypatch.setenv("OPEN_WEATHER_TOKEN", "stub-token")
+    monkeypatch.setenv("GEMINI_API_KEY", "stub-key")
+    for name in ("GEMINI_BASE_URL", "OPEN_WEATHER_BASE_URL", "INATURALIST_BASE_URL", "NOAA_BASE_URL"):
+        monkeypatch.delenv(name, raising=False)
+
+def test_latency_parse():
+    assert Latency.parse("fixed:0.5").sample() == 0.5
+    uniform = Latency.parse("uniform:0.1:0.2")
+    assert 0.1 <= uniform.sample() <= 0.2
+    with pytest.raises(ValueError):
+        Latency.parse("gaussian:1")
+
+def test_stub_error_rate():
+    import requests
+    with StubServer("inaturalist", error_rate=1.0) as stub:
+        response = requests.get(f"{stub.url}/v1/observations/species_counts", timeout=5)
+    assert response.status_code == 503
+    assert stub.errors == 1
+
+def test_run_benchmark_smoke(restore_upstreams):
+    results = run_benchmark(concurrency=3, total_requests=6, seed=1)
+
+    assert results["requests"] == 6
+    for stats in results["commands"].values():
+        assert stats["requests"] == 2
+        assert stats["errors"] == 0
+        assert stats["p50"] is not None
+    # Identical prompts are answered from the cache
+    assert 3 <= results["upstream_requests"]["gemini"] <= 6
+    assert results["threads_peak"] >= 1
+
+def test_decode_benchmark_smoke():
+    from benchmarks.decode_benchmark import format_results, run_benchmark as run_decode
+    results = run_decode(iterations=2, days=1, interval="6")
+    assert set(results["sources"]) == {"openweather", "noaa", "inaturalist", "noaa_csv"}
+    assert results["sources"]["noaa_csv"]["bytes"] < results["sources"]["noaa"]["bytes"]
+    assert results["model_bytes_per_report"] < results["dict_bytes_per_report"]
+    assert "Memory per report" in format_results(results)
+
+def test_import_benchmark_keeps_heavy_modules_lazy():
+    from benchmarks.import_benchmark import format_results, parse_importtime, run_benchmark as run_imports
+    assert parse_importtime("import time: self [us] | cumulative | imported package\n"
+                            "import time:       120 |        340 | json\n") == {"json": (120, 340)}
+    results = run_imports(modules=("command_logic",), runs=1)
+    assert results["failures"] == []
+    assert results["modules"]["command_logic"]["median_ms"] > 0
+    assert "command_logic: median" in format_results(results)
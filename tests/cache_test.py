@@ -0,0 +1,164 @@
+import pytest
+import requests
+import threading
+import time
+
+from unittest.mock import Mock
+import cache
+import upstream
+from benchmarks.stub_servers import RedisStub
+
+def test_encode_compresses_large_values():
+    small = {"a": 1}
+    large = {"data": ["x" * 10] * 200}
+    assert cache.encode(small)[:1] == b"j"
+    assert cache.encode(large)[:1] == b"z"
+    assert len(cache.encode(large)) < len(str(large))
+    assert cache.decode(cache.encode(large)) == large
+
+def test_memory_cache_lru_and_expiry():
+    now = [0.0]
+    memory = cache.MemoryCache(max_entries=2, clock=lambda: now[0])
+    memory.set("a", 1)
+    memory.set("b", 2, ttl=10)
+    assert memory.get("a") == 1     # a is now most recently used
+    memory.set("c", 3)
+    assert memory.get_many(["a", "b", "c"]) == {"a": 1, "c": 3}
+
+    memory.set("d", 4, ttl=10)
+    now[0] = 11
+    assert memory.get("d") is None
+
+def test_sqlite_cache_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    writer = cache.SQLiteCache(path)
+    writer.set_many({"a": {"x": 1}, "b": "text"}, ttl=60)
+    writer.set("expired", 1, ttl=-1)
+
+    reader = cache.SQLiteCache(path)
+    assert reader.get_many(["a", "b", "expired", "missing"]) == {"a": {"x": 1}, "b": "text"}
+    reader.delete("a")
+    assert writer.get("a") is None
+
+def test_redis_cache_against_stub():
+    with RedisStub() as stub:
+        redis = cache.RedisCache(stub.url)
+        redis.set_many({"a": [1, 2], "b": {"y": "z" * 1000}}, ttl=60)
+        assert redis.get_many(["a", "b", "c"]) == {"a": [1, 2], "b": {"y": "z" * 1000}}
+        redis.set("short", 1, ttl=0.001)
+        redis.delete("a")
+        assert redis.get("a") is None
+        assert b"boomhauer:b" in stub.data
+        # MGET and the pipelined SETs are one round trip each
+        commands = stub.commands
+        redis.get_many(["a", "b"])
+        assert stub.commands == commands + 1
+
+def test_redis_pipeline_error_leaves_connection_in_sync():
+    with RedisStub() as stub:
+        redis = cache.RedisCache(stub.url)
+        conn = redis._conn()
+        with pytest.raises(cache.RedisError):
+            conn.pipeline([("SET", "x", "1"), ("BOGUS",), ("SET", "y", "2")])
+        # The replies after the error were consumed, so the next command
+        # reads its own reply
+        assert conn.execute("PING") == "PONG"
+        assert redis._conn() is conn
+        assert set(stub.data) == {b"x", b"y"}
+
+def test_redis_drops_connection_on_garbled_reply():
+    with RedisStub() as stub:
+        redis = cache.RedisCache(stub.url)
+        conn = redis._conn()
+        with pytest.raises(ValueError):
+            redis._call(lambda c: int("not a reply"))
+        assert redis._conn() is not conn
+
+def test_cache_errors_are_misses():
+    broken = Mock()
+    broken.get.side_effect = ConnectionError("down")
+    broken.set.side_effect = ConnectionError("down")
+    cache.configure(broken)
+    assert cache.get("key") is None
+    cache.set("key", 1)
+
+def test_upstream_serves_fresh_responses_from_cache():
+    cache.configure(cache.MemoryCache(), {"ttl": {"inaturalist": 60}})
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b'{"results": []}'
+    session = Mock()
+    session.get.return_value = response
+
+    url = "https://example.test/v1/observations/species_counts"
+    first = upstream.get("inaturalist", url, params={"lat": 1}, session=session)
+    second = upstream.get("inaturalist", url, params={"lat": 1}, session=session)
+    assert first.json() == second.json() == {"results": []}
+    assert session.get.call_count == 1
+
+    upstream.get("inaturalist", url, params={"lat": 2}, session=session)
+    assert session.get.call_count == 2
+
+def test_gemini_responses_cached_by_prompt():
+    cache.configure(cache.MemoryCache(), {"ttl": {"gemini": 60}})
+    client = Mock()
+    client.models.generate_content.return_value.text = "Fish the outgoing tide"
+
+    upstream.generate(client, "gemini-2.5-flash", "prompt")
+    cached = upstream.generate(client, "gemini-2.5-flash", "prompt")
+    assert cached.text == "Fish the outgoing tide"
+    assert cached.from_cache
+    assert client.models.generate_content.call_count == 1
+
+    upstream.generate(client, "gemini-2.5-flash-lite", "prompt")
+    assert client.models.generate_content.call_count == 2
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        cache.create_backend({"backend": "memcached"})
+
+def test_get_or_load_stale_while_revalidate(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    loader = Mock(side_effect=["v1", "v2"])
+
+    assert cache.get_or_load("k", loader, ttl=10, grace=60) == ("v1", 1000.0)
+    now[0] = 1005
+    assert cache.get_or_load("k", loader, ttl=10, grace=60) == ("v1", 1000.0)
+    assert loader.call_count == 1
+
+    # Past the TTL but inside the grace window: stale value now, refresh behind
+    now[0] = 1020
+    assert cache.get_or_load("k", loader, ttl=10, grace=60) == ("v1", 1000.0)
+    while cache._inflight:
+        time.sleep(0.01)
+    assert cache.get_or_load("k", loader, ttl=10, grace=60) == ("v2", 1020.0)
+    assert loader.call_count == 2
+
+def test_get_or_load_single_flight():
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        return {"tide": "high"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("tides", loader, ttl=60)))
+               for _ in range(5)]
+    for t in threads:
+        t.start()
+    while not cache._inflight:
+        pass
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert [value for value, _ in results] == [{"tide": "high"}] * 5
+
+def test_get_or_load_does_not_cache_errors():
+    loader = Mock(return_value={"error": "upstream down"})
+    cache.get_or_load("fish", loader, ttl=60, is_valid=lambda v: "error" not in v)
+    cache.get_or_load("fish", loader, ttl=60, is_valid=lambda v: "error" not in v)
+    assert loader.call_count == 2
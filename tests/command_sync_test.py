@@ -0,0 +1,43 @@
+import pytest
+import discord
+from discord import app_commands
+from unittest.mock import AsyncMock
+
+import command_sync
+
+
+def build_tree(choices=("shore", "boat")):
+    tree = app_commands.CommandTree(discord.Client(intents=discord.Intents.none()))
+    group = app_commands.Group(name="fish", description="Fishing report commands")
+
+    @group.command(name="today", description="Today's report")
+    @app_commands.choices(fishing_type=[app_commands.Choice(name=c, value=c) for c in choices])
+    async def today(interaction: discord.Interaction, fishing_type: app_commands.Choice[str] = None):
+        pass
+
+    tree.add_command(group)
+    tree.sync = AsyncMock()
+    return tree
+
+
+def test_fingerprint_tracks_command_schema():
+    assert command_sync.fingerprint(build_tree()) == command_sync.fingerprint(build_tree())
+    assert command_sync.fingerprint(build_tree()) != command_sync.fingerprint(build_tree(("shore", "kayak")))
+
+
+@pytest.mark.asyncio
+async def test_sync_only_when_changed(tmp_path, monkeypatch):
+    monkeypatch.delenv("FORCE_COMMAND_SYNC", raising=False)
+    path = str(tmp_path / "command_sync.json")
+    tree = build_tree()
+    assert await command_sync.sync_if_changed(tree, 1, path)
+    assert not await command_sync.sync_if_changed(tree, 1, path)
+    tree.sync.assert_awaited_once()
+
+    # Another application id, a changed schema or a forced sync all sync again
+    assert await command_sync.sync_if_changed(tree, 2, path)
+    changed = build_tree(("shore", "kayak"))
+    assert await command_sync.sync_if_changed(changed, 1, path)
+    assert not await command_sync.sync_if_changed(changed, 1, path)
+    assert await command_sync.sync_if_changed(changed, 1, path, force=True)
+    assert command_sync.last_synced(1, path) == command_sync.fingerprint(changed)
@@ -0,0 +1,33 @@
+import pytest
+
+import app_config
+import cache
+import quota
+import warehouse
+
+@pytest.fixture(autouse=True)
+def fresh_config():
+    # Tests may swap in their own config; read config.json again afterwards
+    yield
+    app_config.configure()
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    # Upstream responses are cached process-wide; start every test empty
+    cache.configure(cache.MemoryCache(), {"backend": "memory"})
+    yield
+    cache.configure(cache.MemoryCache(), {"backend": "memory"})
+
+@pytest.fixture(autouse=True)
+def fresh_warehouse(tmp_path):
+    # Never write test readings to the real warehouse file
+    store = warehouse.configure(warehouse.Warehouse(str(tmp_path / "warehouse.sqlite3")))
+    yield store
+    warehouse.configure(None)
+
+@pytest.fixture(autouse=True)
+def no_quotas():
+    # Configured limits would throttle the stub servers; quota tests build their own manager
+    quota.configure(quota.QuotaManager({"limits": {}}))
+    yield
+    quota.configure(quota.QuotaManager({"limits": {}}))
@@ -1,9 +1,16 @@
 import pytest
 import logging
 import json
+import threading
+import time
+from types import SimpleNamespace
 
 from unittest.mock import Mock, AsyncMock, patch
-from call_gemini import combine_api_data
+import cache
+import metrics
+import quota
+from call_gemini import GeminiDispatcher, combine_api_data, get_quick_report
+from models import SpeciesCount, SpeciesReport
 
 @patch("call_gemini.genai", new_callable=Mock)
 def test_combine_api_date(mock_genai):
@@ -12,7 +19,7 @@ def test_combine_api_date(mock_genai):
     fishing_type.value = "shore"
 
 
-    fish = '{"fish":"red drum"}'
+    fish = SpeciesReport(33.0, -80.0, 4, 1, [SpeciesCount(1, "Sciaenops ocellatus", "Red Drum", 4)])
     weather = "cloudy with a chance of meatballs"
     tides = {'data': "high tide"}
 
@@ -21,6 +28,137 @@ def test_combine_api_date(mock_genai):
     
     assert data["location"] == zip_code
     assert data["fishing_type"] == fishing_type
-    assert data["fish_data"] == json.loads(fish)
+    assert data["fish_data"] is fish
     assert data["tides_data"] == tides.get('data')
     assert data["weather_data"] == weather
+    assert set(data["as_of"]) == {"fish_data", "tides_data", "weather_data"}
+
+
+def test_quick_report_reads_only_the_cache():
+    cache.configure(cache.MemoryCache(), {"ttl": {"inaturalist": 600, "noaa": 600, "openweather": 600}})
+    fish = SpeciesReport(33.0, -80.0, 4, 1, [SpeciesCount(1, "Sciaenops ocellatus", "Red Drum", 4)])
+    loaders = {"get_weather": Mock(return_value={"list": [{"dt": 0}]}), "get_tide": Mock(return_value={"data": {"water_level": []}}),
+               "get_fish": Mock(return_value=fish)}
+    with patch("call_gemini.zip_to_coords", return_value=("32.8", "-79.9")), \
+            patch.multiple("call_gemini", **loaders):
+        # Nothing cached yet: no report, and nothing fetched to build one
+        assert get_quick_report("29414", "kayak") is None
+        assert not any(loader.called for loader in loaders.values())
+
+        combine_api_data("29414", "kayak")
+        for loader in loaders.values():
+            loader.reset_mock()
+        assert get_quick_report("29414", "kayak")
+        assert not any(loader.called for loader in loaders.values())
+
+
+def _wait_for_depth(dispatcher, depth):
+    for _ in range(500):
+        if dispatcher.depth() == depth:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"queue never reached depth {depth}")
+
+
+def test_dispatcher_serves_interactive_before_prewarm():
+    metrics.reset()
+    dispatcher = GeminiDispatcher({"concurrency": 1})
+    release = threading.Event()
+    order = []
+
+    def submit(name, priority, block=False):
+        def call():
+            if block:
+                release.wait(5)
+            order.append(name)
+        return threading.Thread(target=dispatcher.run, args=(call, priority))
+
+    threads = [submit("running", "interactive", block=True)]
+    threads[0].start()
+    for name, priority in (("prewarm", "prewarm"), ("daily", "daily"), ("interactive", "interactive")):
+        thread = submit(name, priority)
+        thread.start()
+        threads.append(thread)
+        _wait_for_depth(dispatcher, len(threads) - 1)
+    assert metrics.get_gauge("gemini_queue_depth") == 3
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ["running", "interactive", "daily", "prewarm"]
+    assert metrics.get_gauge("gemini_queue_depth") == 0
+    assert metrics.observation_count("gemini_queue_wait_seconds", priority="prewarm") == 1
+
+
+def test_dispatcher_ages_waiting_requests():
+    now = [0.0]
+    dispatcher = GeminiDispatcher({"concurrency": 1, "aging_seconds": 30}, clock=lambda: now[0])
+    release = threading.Event()
+    order = []
+
+    blocker = threading.Thread(target=dispatcher.run, args=(lambda: release.wait(5), "interactive"))
+    blocker.start()
+    prewarm = threading.Thread(target=dispatcher.run, args=(lambda: order.append("prewarm"), "prewarm"))
+    prewarm.start()
+    _wait_for_depth(dispatcher, 1)
+    # Two ranks behind, but queued 61s earlier than the interactive request
+    now[0] = 61.0
+    interactive = threading.Thread(target=dispatcher.run, args=(lambda: order.append("interactive"), "interactive"))
+    interactive.start()
+    _wait_for_depth(dispatcher, 2)
+    release.set()
+    for thread in (blocker, prewarm, interactive):
+        thread.join(5)
+
+    assert order == ["prewarm", "interactive"]
+
+
+def test_dispatcher_paces_on_the_shared_gemini_quota():
+    now = [0.0]
+    sleeps = []
+    quota.configure(quota.QuotaManager(
+        {"max_wait": 0.0, "limits": {"gemini": {"rate_per_minute": 60, "burst": 1, "tokens_per_minute": 600}}},
+        counters=quota.MemoryCounters(), clock=lambda: now[0], sleep=sleeps.append))
+    dispatcher = GeminiDispatcher({}, clock=lambda: now[0])
+    response = SimpleNamespace(text="ok")
+
+    assert dispatcher.run(lambda: response) is response
+    assert sleeps == []
+    # Tokens are counted once, in the quota buckets, as upstream.generate does
+    quota.record_tokens("gemini", 700, "generate_content")
+    # 100 tokens in debt at 10 a second: outside the dispatcher that fails fast...
+    with pytest.raises(quota.QuotaExceededError):
+        quota.acquire("gemini", "generate_content")
+    # ...while a dispatched request waits for the same bucket
+    dispatcher.run(lambda: response)
+    assert sleeps == [pytest.approx(10.0)]
+
+
+def test_dispatchers_in_different_processes_share_the_concurrency_cap(tmp_path):
+    path = str(tmp_path / "quota.sqlite3")
+    active = []
+    overlaps = []
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            active.append(1)
+            overlaps.append(len(active))
+        time.sleep(0.02)
+        with lock:
+            active.pop()
+
+    # One dispatcher and quota manager per report worker process, sharing the state file
+    dispatchers = []
+    for _ in range(3):
+        manager = quota.QuotaManager({"limits": {}}, counters=quota.MemoryCounters(),
+                                     shared=quota.SharedLimits(path))
+        dispatchers.append(GeminiDispatcher({"concurrency": 1}, acquire=manager.acquire,
+                                            slot=manager.concurrency_slot))
+    threads = [threading.Thread(target=d.run, args=(call,)) for d in dispatchers for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert len(overlaps) == 9
+    assert max(overlaps) == 1
@@ -0,0 +1,181 @@
+import calendar
+import math
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+import harmonics
+import hedging
+from benchmarks.stub_servers import StubServer
+from models import TideSeries, parse_noaa_time
+from noaa_tides_currents import NOAACoOpsAPI, fetch_and_save_data, predict_water_level
+
+def _m2_only(**overrides):
+    values = dict(station_id="1", units="metric", names=["M2"], amplitudes=[1.0], phases=[0.0],
+                  speeds=[28.9841042], datums={"MSL": 1.0, "MLLW": 0.0})
+    values.update(overrides)
+    return harmonics.HarmonicConstants(**values)
+
+def test_equilibrium_arguments():
+    midnight = calendar.timegm((2025, 3, 1, 0, 0, 0))
+    assert harmonics.equilibrium_argument("S2", midnight) == pytest.approx(0, abs=1e-6)
+    assert harmonics.equilibrium_argument("S2", midnight + 6 * 3600) == pytest.approx(180)
+
+def test_nodal_factors():
+    assert harmonics._basic_factors(0)["M2"][0] == pytest.approx(0.9633)
+    moment = calendar.timegm((2025, 7, 2, 12, 0, 0))
+    m2, k1 = harmonics.nodal_factors("M2", moment), harmonics.nodal_factors("K1", moment)
+    mk3 = harmonics.nodal_factors("MK3", moment)
+    assert mk3[0] == pytest.approx(m2[0] * k1[0])
+    assert mk3[1] == pytest.approx(m2[1] + k1[1])
+    assert harmonics.nodal_factors("S2", moment) == (1.0, 0.0)
+
+def test_vectorized_sum_matches_naive_loop():
+    constants = harmonics.HarmonicConstants(
+        "1", "metric", ["M2", "S2", "K1", "O1"], [0.8, 0.12, 0.1, 0.08], [224.0, 245.0, 108.0, 111.0],
+        [28.9841042, 30.0, 15.0410686, 13.9430356])
+    times = numpy.arange(calendar.timegm((2025, 12, 31, 0, 0, 0)), calendar.timegm((2026, 1, 2, 0, 0, 0)), 3600)
+    expected = []
+    for t in times.tolist():
+        year = time.gmtime(t).tm_year
+        epoch, middle = calendar.timegm((year, 1, 1, 0, 0, 0)), calendar.timegm((year, 7, 2, 12, 0, 0))
+        total = 0.0
+        for name, amplitude, lag, speed in zip(constants.names, constants.amplitudes, constants.phases, constants.speeds):
+            f, u = harmonics.nodal_factors(name, middle)
+            v0 = harmonics.equilibrium_argument(name, epoch)
+            total += f * amplitude * math.cos(math.radians(speed * (t - epoch) / 3600 + v0 + u - lag))
+        expected.append(total)
+    assert harmonics.heights(constants, times) == pytest.approx(expected, abs=1e-9)
+
+def test_high_low_of_pure_m2():
+    series = harmonics.predict_series(_m2_only(), "20250101", "20250103", interval="hilo")
+    assert isinstance(series, TideSeries)
+    highs = [t for t, label in zip(series.times, series.labels) if label == "H"]
+    assert set(series.labels) == {"H", "L"}
+    assert all(abs((b - a) / 3600 - 12.42) < 0.05 for a, b in zip(highs, highs[1:]))
+    # Heights are relative to MLLW: MSL sits 1.0 above it
+    assert max(series.values()) == pytest.approx(1.0 + harmonics.nodal_factors("M2", parse_noaa_time("2025-07-02 12:00"))[0], abs=1e-3)
+
+def test_local_time_zones():
+    constants = _m2_only(timezone_offset=-5, observes_dst=True)
+    gmt = harmonics.predict_series(constants, "20250701", "20250701", time_zone="gmt")
+    local = harmonics.predict_series(constants, "20250701", "20250702", time_zone="lst_ldt")
+    # 04:00 EDT is 08:00 GMT
+    assert local.values()[4] == gmt.values()[8]
+    winter = harmonics.predict_series(constants, "20250115", "20250115", time_zone="lst_ldt")
+    winter_gmt = harmonics.predict_series(constants, "20250115", "20250115", time_zone="gmt")
+    assert winter.values()[0] == winter_gmt.values()[5]
+
+def test_future_ranges_need_no_requests_once_constants_are_cached(monkeypatch):
+    monkeypatch.setattr(hedging, "get_settings", lambda: dict(hedging.DEFAULT_SETTINGS))
+    begin = (datetime.now() + timedelta(days=10)).strftime("%Y%m%d")
+    end = (datetime.now() + timedelta(days=16)).strftime("%Y%m%d")
+    config = {"station_id": "8665530", "begin_date": begin, "end_date": end, "units": "metric",
+              "data_types": ["water_level", "air_temperature"], "time_zone": "lst_ldt",
+              "harmonic_predictions": True}
+    monkeypatch.setattr("noaa_tides_currents.load_config", lambda config_file: dict(config))
+    with StubServer("noaa") as stub:
+        monkeypatch.setattr(NOAACoOpsAPI, "BASE_URL", f"{stub.url}/api/prod")
+        monkeypatch.setattr(NOAACoOpsAPI, "METADATA_URL", f"{stub.url}/mdapi/prod/webapi")
+        first = fetch_and_save_data(quiet=True)["data"]
+        assert stub.requests == 3
+        second = fetch_and_save_data(quiet=True)["data"]
+        assert stub.requests == 3
+
+    water_level = second["data_types"]["water_level"]
+    # High and low tides, about four a day
+    assert 26 <= len(water_level) <= 28
+    assert set(water_level.labels) == {"H", "L"}
+    assert water_level.metadata["source"] == "harmonic"
+    assert "error" in second["data_types"]["air_temperature"]
+    assert first["station_info"]["metadata"]["name"] == "Charleston, Cooper River Entrance"
+
+def test_disabled_or_past_ranges_use_noaa(monkeypatch):
+    monkeypatch.setattr(hedging, "get_settings", lambda: dict(hedging.DEFAULT_SETTINGS))
+    config = {"station_id": "8665530", "begin_date": "20250101", "end_date": "20250102", "units": "metric",
+              "data_types": ["water_level"], "time_zone": "gmt", "harmonic_predictions": True}
+    monkeypatch.setattr("noaa_tides_currents.load_config", lambda config_file: dict(config))
+    with StubServer("noaa") as stub:
+        monkeypatch.setattr(NOAACoOpsAPI, "BASE_URL", f"{stub.url}/api/prod")
+        monkeypatch.setattr(NOAACoOpsAPI, "METADATA_URL", f"{stub.url}/mdapi/prod/webapi")
+        data = fetch_and_save_data(quiet=True)["data"]
+        # station info and the datagetter water level request
+        assert stub.requests == 2
+    assert "source" not in data["data_types"]["water_level"].metadata
+
+def test_harmonic_predictions_are_off_by_default():
+    # Until a recorded NOAA fixture checks the engine in CI
+    assert predict_water_level(None, {"station_id": "8665530"}) is None
+
+def _moon_and_sun(seconds):
+    """sin(2 dec) cos(hour angle) at Greenwich for the Moon and Sun, from a low-precision ephemeris
+
+    Deliberately independent of harmonics.astronomical_arguments: ecliptic
+    longitude and latitude from the Astronomical Almanac's short series,
+    rotated to right ascension and declination.
+    """
+    days = seconds / 86400.0 - 10957.5
+    T = days / 36525
+    sin = lambda degrees: math.sin(math.radians(degrees))
+    moon_lon = (218.32 + 481267.881 * T + 6.29 * sin(134.9 + 477198.85 * T) - 1.27 * sin(259.2 - 413335.38 * T)
+                + 0.66 * sin(235.7 + 890534.23 * T) + 0.21 * sin(269.9 + 954397.70 * T)
+                - 0.19 * sin(357.5 + 35999.05 * T) - 0.11 * sin(186.6 + 966404.05 * T))
+    moon_lat = (5.13 * sin(93.3 + 483202.03 * T) + 0.28 * sin(228.2 + 960400.87 * T)
+                - 0.28 * sin(318.3 + 6003.18 * T) - 0.17 * sin(217.6 - 407332.20 * T))
+    anomaly = 357.529 + 0.98560028 * days
+    sun_lon = 280.459 + 0.98564736 * days + 1.915 * sin(anomaly) + 0.020 * sin(2 * anomaly)
+    obliquity = math.radians(23.439)
+    sidereal = math.radians(280.46061837 + 360.98564736629 * days)
+    terms = []
+    for lon, lat in ((moon_lon, moon_lat), (sun_lon, 0.0)):
+        lon, lat = math.radians(lon), math.radians(lat)
+        ra = math.atan2(math.sin(lon) * math.cos(obliquity) - math.tan(lat) * math.sin(obliquity), math.cos(lon))
+        dec = math.asin(math.sin(lat) * math.cos(obliquity) + math.cos(lat) * math.sin(obliquity) * math.sin(lon))
+        terms.append(math.sin(2 * dec) * math.cos(sidereal - ra))
+    return terms
+
+def test_diurnal_phases_follow_the_equilibrium_tide():
+    # With zero Greenwich lags and equilibrium amplitudes, K1+O1+P1+Q1 is the
+    # diurnal equilibrium tide at Greenwich, which peaks where sin(2 dec) cos(H) does.
+    # A sign error in any diurnal offset breaks the match (the old offsets gave -0.996).
+    constants = harmonics.HarmonicConstants(
+        "1", "metric", ["K1", "O1", "P1", "Q1"], [0.3688, 0.2622, 0.1220, 0.0502], [0.0] * 4,
+        [15.0410686, 13.9430356, 14.9589314, 13.3986609])
+    start = calendar.timegm((2025, 1, 1, 0, 0, 0))
+    times = numpy.arange(start, start + 60 * 86400, 3600)
+    # Solar diurnal potential is 0.46 of the lunar
+    expected = [moon + 0.46 * sun for moon, sun in map(_moon_and_sun, times.tolist())]
+    assert numpy.corrcoef(harmonics.heights(constants, times), expected)[0, 1] > 0.99
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "harmonics_8665530.json")
+
+@pytest.mark.skipif(not os.path.exists(FIXTURE), reason=(
+    "record with: python -m harmonics 8665530 --begin 20250101 --end 20250131 "
+    "--datum MLLW --record tests/fixtures/harmonics_8665530.json"))
+def test_matches_recorded_noaa_predictions():
+    constants, noaa, noaa_hilo, fixture = harmonics.load_fixture(FIXTURE)
+    result = harmonics.compare(constants, noaa, noaa_hilo, fixture["begin_date"], fixture["end_date"],
+                               fixture["datum"])
+    assert result["samples"] == len(noaa)
+    assert result["tides"] >= len(noaa_hilo) - 1
+    assert result["rmse"] < 0.03
+    assert result["mean_timing_minutes"] < 6
+    assert result["max_timing_minutes"] < 20
+
+def test_record_round_trips_through_compare(tmp_path):
+    path = str(tmp_path / "fixture.json")
+    with StubServer("noaa") as stub:
+        api = NOAACoOpsAPI()
+        api.BASE_URL, api.METADATA_URL = f"{stub.url}/api/prod", f"{stub.url}/mdapi/prod/webapi"
+        recorded = harmonics.record(path, "8665530", "20250101", "20250102", api=api)
+    constants, noaa, noaa_hilo, fixture = harmonics.load_fixture(path)
+    assert fixture["station"] == "8665530" and fixture["begin_date"] == "20250101"
+    assert constants.to_dict() == recorded["constants"]
+    assert list(noaa.times) == list(TideSeries.from_dict(recorded["predictions"]).times)
+    assert noaa_hilo.labels and set(noaa_hilo.labels) <= {"H", "L", "HH", "LL"}
+    result = harmonics.compare(constants, noaa, noaa_hilo, "20250101", "20250102")
+    assert result["samples"] == len(noaa) and result["rmse"] is not None
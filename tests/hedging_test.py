@@ -0,0 +1,76 @@
+import threading
+import time
+import pytest
+
+import hedging
+import metrics
+import resilience
+
+@pytest.fixture(autouse=True)
+def settings():
+    metrics.reset()
+    hedging.reset()
+    resilience.reload_settings({"hedging": {"enabled": True, "providers": ["noaa"], "percentile": 90,
+                                            "max_hedge_rate": 0.5, "min_samples": 5, "min_delay": 0.01}})
+    yield
+    resilience.reload_settings()
+    hedging.reset()
+
+def warm_up(provider, seconds=0.02, count=5):
+    for _ in range(count):
+        metrics.observe(hedging.LATENCY_SERIES, seconds, provider=provider)
+
+def test_no_hedge_without_history():
+    assert hedging.hedge_delay("noaa") is None
+    assert hedging.run("noaa", lambda: "ok") == "ok"
+    assert metrics.get_counter("upstream_hedges_total", provider="noaa") == 0
+
+def test_slow_primary_is_hedged():
+    warm_up("noaa")
+    calls = []
+    lock = threading.Lock()
+
+    def fetch():
+        with lock:
+            calls.append(1)
+            first = len(calls) == 1
+        time.sleep(1.0 if first else 0.0)
+        return "slow" if first else "fast"
+
+    started = time.perf_counter()
+    assert hedging.run("noaa", fetch) == "fast"
+    assert time.perf_counter() - started < 0.5
+    assert metrics.get_counter("upstream_hedges_total", provider="noaa") == 1
+    assert metrics.get_counter("upstream_hedge_wins_total", provider="noaa") == 1
+
+def test_hedge_rate_cap():
+    warm_up("noaa")
+    resilience.reload_settings({"hedging": {"enabled": True, "providers": ["noaa"], "max_hedge_rate": 0.0,
+                                            "min_samples": 5, "min_delay": 0.01}})
+    assert hedging.run("noaa", lambda: time.sleep(0.1) or "ok") == "ok"
+    assert metrics.get_counter("upstream_hedges_total", provider="noaa") == 0
+
+def test_provider_not_hedged():
+    warm_up("openweather")
+    assert hedging.run("openweather", lambda: "ok") == "ok"
+    assert metrics.get_counter("upstream_hedges_total", provider="openweather") == 0
+
+def test_busy_pool_runs_unhedged_in_the_caller():
+    warm_up("noaa")
+    # Losing requests from earlier tests may still hold workers
+    baseline = hedging._busy
+    resilience.reload_settings({"hedging": {"enabled": True, "providers": ["noaa"], "max_hedge_rate": 0.0,
+                                            "min_samples": 5, "min_delay": 0.01, "max_workers": baseline + 2}})
+    release = threading.Event()
+    blocker = threading.Thread(target=hedging.run, args=("noaa", lambda: release.wait(5)))
+    blocker.start()
+    deadline = time.time() + 5
+    while hedging._busy < baseline + 1 and time.time() < deadline:
+        time.sleep(0.005)
+
+    # One of our two workers is taken, so there is no room for a hedged pair
+    caller = threading.current_thread()
+    assert hedging.run("noaa", lambda: threading.current_thread() is caller) is True
+    assert metrics.get_counter("upstream_hedges_skipped_total", provider="noaa") == 1
+    release.set()
+    blocker.join(5)
@@ -26,6 +26,7 @@ def mock_interaction():
     interaction.followup = AsyncMock()
     interaction.followup.send = AsyncMock()
     interaction.channel_id = 42
+    interaction.guild_id = 7
     return interaction
 
 def random_string(length):
@@ -148,6 +149,7 @@ async def test_fish_daily(caplog):
     assert config['daily_report_time_range'] == time_range
     assert config['daily_report_enabled'] == True
     assert config['daily_report_channel'] == interaction.channel_id
+    assert config['daily_report_guild'] == interaction.guild_id
 
     interaction.response.send_message.assert_awaited_with(
         f"✅ Daily fishing report configured!\n"
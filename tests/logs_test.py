@@ -0,0 +1,87 @@
+import io
+import json
+import logging
+
+import pytest
+from unittest.mock import AsyncMock
+
+import logs
+
+
+@pytest.fixture
+def json_logs():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    stream = io.StringIO()
+    logs.configure({"format": "json", "level": "INFO", "sample": {"chatty": 0.25}}, stream=stream)
+
+    def events():
+        logs.shutdown()
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    yield events
+    logs.shutdown()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+@pytest.mark.asyncio
+async def test_traced_handler_logs_request_id_and_stages(json_logs):
+    logger = logging.getLogger("command_logic")
+
+    @logs.traced("today")
+    async def handler(interaction):
+        with logs.stage(logger, "tides_data", provider="noaa"):
+            logger.info("Report for %s", "29414")
+
+    await handler(AsyncMock(id=1234))
+    logger.info("outside any request")
+    events = json_logs()
+
+    report, tides, command, outside = events
+    assert report["message"] == "Report for 29414" and report["request_id"] == "1234"
+    assert tides["stage"] == "tides_data" and tides["provider"] == "noaa" and tides["outcome"] == "ok"
+    assert command["stage"] == "command" and command["command"] == "today" and command["request_id"] == "1234"
+    assert command["duration_ms"] >= 0 and command["logger"] == __name__
+    assert "request_id" not in outside
+
+
+def test_sampling_and_deferred_formatting(json_logs):
+    chatty = logging.getLogger("chatty.child")
+    for i in range(8):
+        chatty.info("line %d", i)
+    chatty.warning("always kept")
+    with logs.stage(chatty, "gemini"):
+        pass
+    values = ["before"]
+    logging.getLogger("quiet").info("args %s", values)
+    values[0] = "after"
+    messages = [event["message"] for event in json_logs()]
+
+    assert messages[:3] == ["line 0", "line 4", "always kept"]
+    assert messages[3].startswith("gemini finished in")
+    # The message is fixed when logged even though formatting happens on the writer thread
+    assert messages[4] == "args ['before']"
+
+
+def test_log_calls_format_lazily():
+    # f-strings are formatted even when the line is filtered out; use %s arguments
+    import ast
+    import glob
+    import os
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    levels = {"debug", "info", "warning", "error", "exception", "critical"}
+    eager = []
+    for path in glob.glob(os.path.join(root, "*.py")) + glob.glob(os.path.join(root, "benchmarks", "*.py")):
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in levels
+                    and isinstance(node.func.value, ast.Name) and node.func.value.id in ("logger", "logging")
+                    and node.args and isinstance(node.args[0], ast.JoinedStr)):
+                eager.append(f"{os.path.relpath(path, root)}:{node.lineno}")
+    assert eager == []
@@ -0,0 +1,104 @@
+import json
+import math
+
+import pytest
+
+import cache
+import models
+from benchmarks.stub_servers import _inaturalist_payload, _noaa_payload, _onecall_payload
+
+def body(payload):
+    return json.dumps(payload).encode()
+
+def test_decode_onecall_keeps_report_fields():
+    snapshot = models.decode_onecall(body(_onecall_payload(32.7, -79.9)))
+    assert isinstance(snapshot, models.WeatherSnapshot)
+    assert snapshot.current.conditions == "Clouds"
+    assert len(snapshot.hourly) == 48 and len(snapshot.daily) == 8
+    assert snapshot.daily[0].temp_max == 294.8
+    assert len(snapshot.minutely) == 61
+    assert models.decode_onecall(body({"cod": 401, "message": "bad key"})) == {"cod": 401, "message": "bad key"}
+
+def test_decode_noaa_is_columnar():
+    series = models.decode_noaa(body(_noaa_payload({"begin_date": "20250101", "end_date": "20250101"})))
+    assert len(series) == 24
+    assert list(series.columns) == ["v"]
+    assert series.values()[0] == 1.234
+    assert series.to_dict()["data"][1] == {"t": "2025-01-01 01:00", "v": 1.234}
+    currents = models.decode_noaa(body(_noaa_payload({"product": "currents", "begin_date": "20250101",
+                                                      "end_date": "20250101"})))
+    assert list(currents.columns) == ["s", "d"]
+    assert models.decode_noaa(body({"error": {"message": "No data"}})) == {"error": {"message": "No data"}}
+
+def test_tide_series_slicing_and_missing_values():
+    series = models.TideSeries.decode_rows([
+        {"t": "2025-01-01 23:00", "v": "1.0"}, {"t": "2025-01-02 00:00", "v": ""},
+        {"t": "2025-01-02 06:00", "v": "2.5"},
+    ])
+    day = series.on_date("2025-01-02")
+    assert len(day) == 2
+    assert math.isnan(day.values()[0])
+    assert day.to_dict()["data"][0] == {"t": "2025-01-02 00:00", "v": None}
+    assert len(series.between(models.parse_noaa_time("2025-01-02 06:00"), 2 ** 40)) == 1
+
+def test_species_report_matches_prompt_shape():
+    report = models.decode_species_counts(body(_inaturalist_payload()), 32.7, -79.9)
+    assert report.species_found == 50
+    plain = report.to_dict()
+    assert len(plain["fish_species"]) == models.SpeciesReport.TOP
+    assert plain["fish_species"][0] == {"species": "Stubfish species0", "common_name": "Stub Fish 0",
+                                        "count": 500, "id": 47000}
+    assert models.decode_species_counts(b'{"results": []}', 1, 2).to_dict()["message"]
+
+def test_models_round_trip_through_cache():
+    snapshot = models.decode_onecall(body(_onecall_payload(32.7, -79.9)))
+    tides = models.decode_noaa(body(_noaa_payload({})))
+    value = {"weather": snapshot, "tides": tides}
+    decoded = cache.decode(cache.encode(value))
+    assert isinstance(decoded["weather"], models.WeatherSnapshot)
+    assert decoded["weather"].to_dict() == snapshot.to_dict()
+    assert decoded["tides"].to_dict() == tides.to_dict()
+
+def test_to_plain_for_prompts():
+    report = models.SpeciesReport(1, 2)
+    assert json.loads(json.dumps({"fish": report}, default=models.to_plain))["fish"]["source"] == "iNaturalist"
+
+WATER_LEVEL_CSV = (b"Date Time, Water Level, Sigma, O or I (for verified), F, R, L, Quality\n"
+                   b"2025-01-01 00:00,1.234,0.012,0,0,0,0,p\n"
+                   b"2025-01-01 00:06,,0.012,0,1,0,0,v\n")
+
+def test_decode_noaa_csv():
+    series = models.decode_noaa(WATER_LEVEL_CSV, format="csv")
+    assert series.to_dict()["data"] == [{"t": "2025-01-01 00:00", "v": 1.234}, {"t": "2025-01-01 00:06", "v": None}]
+    wind = models.decode_noaa(b"Date Time, Speed, Direction, Direction, Gust, X, R \n"
+                              b"2025-01-01 00:00, 3.1, 200.00, SSW, 5.2,0,0\n", format="csv")
+    assert wind.to_dict()["data"] == [{"t": "2025-01-01 00:00", "s": 3.1, "d": 200.0, "g": 5.2}]
+    assert models.decode_noaa(b"Error: No data was found.", format="csv") == {
+        "error": {"message": "Error: No data was found."}}
+
+def test_columnar_series_from_json_and_csv():
+    numpy = pytest.importorskip("numpy")
+    json_series = models.decode_noaa(body(_noaa_payload({"begin_date": "20250101", "end_date": "20250101",
+                                                          "interval": "6"})), columnar=True)
+    assert len(json_series) == 240
+    assert json_series.time.dtype == numpy.dtype("datetime64[m]")
+    assert json_series.time[1] - json_series.time[0] == numpy.timedelta64(6, "m")
+    assert json_series.flags.shape == (240, 4)
+
+    csv_series = models.decode_noaa(WATER_LEVEL_CSV, format="csv", columnar=True)
+    assert numpy.isnan(csv_series.column()[1])
+    assert csv_series.values["s"].tolist() == [0.012, 0.012]
+    assert csv_series.flags.tolist() == [[0, 0, 0, 0], [0, 1, 0, 0]]
+    assert csv_series.quality.tolist() == ["p", "v"]
+    assert csv_series.to_dict() == models.decode_noaa(WATER_LEVEL_CSV, format="csv").to_dict()
+
+def test_columnar_concat_dedupes():
+    pytest.importorskip("numpy")
+    first = models.decode_noaa(WATER_LEVEL_CSV, format="csv", columnar=True)
+    second = models.decode_noaa(b"Date Time, Water Level, Sigma, O or I (for verified), F, R, L, Quality\n"
+                                b"2025-01-01 00:06,9,0.1,0,0,0,0,p\n2025-01-01 00:12,2,0.1,0,0,0,1,p\n",
+                                format="csv", columnar=True)
+    merged = models.ColumnarSeries.concat([first, second])
+    assert len(merged) == 3
+    assert merged.quality.tolist() == ["p", "v", "p"]
+    assert merged.flags[2].tolist() == [0, 0, 0, 1]
@@ -0,0 +1,68 @@
+import csv
+import json
+
+import pytest
+
+import noaa_export
+from benchmarks.stub_servers import StubServer
+from noaa_tides_currents import NOAACoOpsAPI
+
+@pytest.fixture
+def noaa_stub(monkeypatch):
+    with StubServer("noaa") as stub:
+        monkeypatch.setattr(NOAACoOpsAPI, "BASE_URL", f"{stub.url}/api/prod")
+        monkeypatch.setattr(NOAACoOpsAPI, "METADATA_URL", f"{stub.url}/mdapi/prod/webapi")
+        yield stub
+
+def test_stations_in_box():
+    stations = [{"id": "1", "lat": 32.7, "lng": -79.9}, {"id": "2", "lat": 40.7, "lng": -74.0}, {"id": "3"}]
+    assert noaa_export.stations_in_box(stations, 32, -81, 34, -78) == ["1"]
+
+def test_export_ndjson_streams_every_chunk(noaa_stub, tmp_path):
+    output = tmp_path / "tides.ndjson"
+    summary = noaa_export.export(["8665530", "8661070"], ["water_level", "currents"],
+                                 "20250101", "20250210", str(output), workers=3)
+
+    # water_level hourly: one chunk per station; currents: 2 chunks of 31 days per station
+    assert summary["requests"] == 6
+    rows = [json.loads(line) for line in output.read_text().splitlines()]
+    # The stub serves currents hourly
+    assert len(rows) == summary["rows"] == 2 * 2 * 41 * 24
+    assert rows[0].keys() <= set(noaa_export.FIELDS)
+    currents = [row for row in rows if row["product"] == "currents" and row["station"] == "8665530"]
+    assert {"s", "d"} <= currents[0].keys() and "v" not in currents[0]
+    assert all(not stats["errors"] for stats in summary["stations"].values())
+
+def test_export_csv_and_errors(noaa_stub, tmp_path):
+    api = NOAACoOpsAPI()
+    get_water_level = api.get_water_level
+    def flaky(station, *args, **kwargs):
+        if station == "bad":
+            raise RuntimeError("station offline")
+        return get_water_level(station, *args, **kwargs)
+    api.get_water_level = flaky
+
+    output = tmp_path / "tides.csv"
+    summary = noaa_export.export(["8665530", "bad"], ["water_level"], "20250101", "20250101", str(output), api=api)
+    with open(output, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 24 and rows[0]["station"] == "8665530" and rows[0]["s"] == ""
+    assert summary["stations"]["bad"]["errors"] == ["water_level 20250101-20250101: station offline"]
+    assert "1 errors" in noaa_export.format_summary(summary)
+
+def test_export_parquet_from_bbox(noaa_stub, tmp_path, capsys):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    output = tmp_path / "tides.parquet"
+    summary = noaa_export.main(["--bbox", "32,-81,34,-78", "--begin", "01012025", "--end", "01022025",
+                                "--output", str(output)])
+    assert sorted(summary["stations"]) == ["8661070", "8665530", "8670870"]
+    table = parquet.read_table(output)
+    assert table.num_rows == 3 * 48
+    assert table.column("v").null_count == 0 and table.column("s").null_count == table.num_rows
+    assert "Exported 144 rows from 3 stations" in capsys.readouterr().out
+
+def test_unknown_product_and_format(tmp_path):
+    with pytest.raises(ValueError):
+        noaa_export.export(["1"], ["tides"], "20250101", "20250101", str(tmp_path / "x.ndjson"))
+    with pytest.raises(ValueError):
+        noaa_export.output_format("out.txt")
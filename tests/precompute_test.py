@@ -0,0 +1,89 @@
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import command_logic
+import precompute
+
+@pytest.fixture(autouse=True)
+def history():
+    precompute.reset()
+    yield
+    precompute.reset()
+
+CONFIG = {
+    "user_preferences": {
+        "1": {"zip_code": "29414"},
+        "2": {"zip_code": 29414},
+        "3": {"zip_code": "29072"},
+        "4": {"fishing_type": "boat"},
+    },
+    "precompute": {"fishing_types": ["shore", "kayak"], "concurrency": 2, "requests_per_minute": 0},
+}
+
+def test_rank_locations_by_subscribers_and_requests():
+    for _ in range(7):
+        precompute.note_request("90210")
+    precompute.note_request(29072)
+    assert precompute.rank_locations(CONFIG) == ["29414", "90210", "29072"]
+    assert precompute.rank_locations(CONFIG, limit=1) == ["29414"]
+
+def test_old_requests_expire():
+    precompute.note_request("90210", now=0)
+    precompute.note_request("29072", now=precompute.REQUEST_WINDOW_SECONDS + 1)
+    assert precompute.request_counts() == {"29072": 1}
+
+@pytest.mark.asyncio
+async def test_run_stores_reports_for_each_type():
+    generated = []
+    prefetched = []
+
+    async def generate(kind, zip_code, fishing_type):
+        generated.append((kind, zip_code, fishing_type))
+        if zip_code == "29072" and kind == "tomorrow":
+            return "❌ Error: upstream down"
+        return f"{kind} report for {zip_code} ({fishing_type})"
+
+    async def prefetch(zip_code):
+        prefetched.append(zip_code)
+
+    stored = await precompute.run(generate, prefetch, config=CONFIG)
+    assert sorted(prefetched) == ["29072", "29414"]
+    assert len(generated) == 8
+    assert stored == 6
+    assert precompute.lookup("today", 29414, "kayak").endswith("\ntoday report for 29414 (kayak)")
+    assert precompute.lookup("tomorrow", "29414", "shore").endswith("\ntomorrow report for 29414 (shore)")
+    assert precompute.lookup("tomorrow", "29072", "shore") is None
+    assert precompute.lookup("today", "29414", "boat") is None
+
+@pytest.mark.asyncio
+async def test_today_report_served_from_store():
+    precompute.store("today", "29414", "kayak", datetime.now().strftime("%Y-%m-%d"), "precomputed")
+    with patch("command_logic.run_report") as run_report:
+        assert (await command_logic.get_today_report("29414", "kayak", user_id=1)).endswith("\nprecomputed")
+    run_report.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_any_type_is_precomputed_for_users_without_one():
+    config = {**CONFIG, "precompute": {**CONFIG["precompute"], "fishing_types": ["any"]}}
+    generated = []
+
+    async def generate(kind, zip_code, fishing_type):
+        generated.append(fishing_type)
+        return f"{kind} report for {zip_code}"
+
+    await precompute.run(generate, config=config)
+    assert set(generated) == {None}
+    assert precompute.lookup("today", "29414", None).endswith("\ntoday report for 29414")
+
+def test_today_reports_are_labelled_and_expire():
+    generated = datetime(2026, 5, 1, 4, 30)
+    with patch("precompute.time.time", return_value=generated.timestamp()):
+        precompute.store("today", "29414", "kayak", "2026-05-01", "calm seas")
+        precompute.store("tomorrow", "29414", "kayak", "2026-05-02", "windy")
+    assert precompute.lookup("today", "29414", "kayak", now=generated + timedelta(hours=2)) == \
+        "_Prepared at 04:30_\ncalm seas"
+    max_age = timedelta(minutes=precompute.DEFAULT_SETTINGS["today_max_age_minutes"] + 1)
+    assert precompute.lookup("today", "29414", "kayak", now=generated + max_age) is None
+    # Tomorrow's report is a forecast made the night before
+    assert precompute.lookup("tomorrow", "29414", "kayak", now=generated + max_age) == "_Prepared at 04:30_\nwindy"
@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+import cache
+import hedging
+import metrics
+import quota
+import upstream
+from benchmarks.stub_servers import StubServer
+
+class Clock:
+    def __init__(self, now=1_750_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def manager(limits, clock=None, counters=None, **settings):
+    clock = clock or Clock()
+    sleeps = []
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock.now += seconds
+    qm = quota.QuotaManager({"limits": limits, "max_wait": 1.0, **settings},
+                            counters=counters or quota.MemoryCounters(clock), clock=clock, sleep=sleep)
+    return qm, sleeps
+
+def test_token_bucket_waits_then_rejects():
+    qm, sleeps = manager({"noaa": {"rate_per_minute": 60, "burst": 2}})
+    for _ in range(3):
+        qm.acquire("noaa", "datagetter")
+    # The third request borrowed a token a second ahead
+    assert sleeps == [pytest.approx(1.0)]
+
+    # Concurrent callers reserve ahead without the clock moving
+    bucket = quota.TokenBucket(1.0, 2, Clock())
+    assert [bucket.reserve(1, 1.0) for _ in range(4)] == [0.0, 0.0, 1.0, None]
+    qm, _ = manager({"noaa": {"rate_per_minute": 60, "burst": 1}}, max_wait=0)
+    qm.acquire("noaa")
+    with pytest.raises(quota.QuotaExceededError):
+        qm.acquire("noaa")
+
+def test_daily_budget_levels_and_policy():
+    qm, _ = manager({"openweather": {"daily": 20}, "openweather:zip": {"rate_per_minute": 600, "burst": 10}})
+    assert qm.level("openweather") == "normal"
+    assert qm.geocell("openweather", "32.7808", "-79.9236") == ("32.7808", "-79.9236")
+    for _ in range(16):
+        qm.acquire("openweather", "onecall")
+    # Geocoding has its own limit and doesn't spend the One Call budget
+    qm.acquire("openweather", "zip")
+    assert qm.remaining("openweather") == 4
+    assert qm.level("openweather") == "low"
+    assert qm.ttl_multiplier("openweather") == 4
+    assert qm.geocell("openweather", "32.7808", "-79.9236") == ("32.8", "-79.9")
+    assert qm.optional_allowed("openweather", "timemachine")
+    for _ in range(3):
+        qm.acquire("openweather", "onecall")
+    assert qm.level("openweather") == "critical"
+    assert qm.geocell("openweather", 32.7808, -79.9236) == ("32.75", "-80")
+    assert not qm.optional_allowed("openweather", "timemachine")
+    qm.acquire("openweather")
+    assert qm.status()["openweather"] == {"remaining": 0, "level": "exhausted"}
+    assert metrics.get_gauge("upstream_quota_remaining", provider="openweather") == 0
+    with pytest.raises(quota.QuotaExceededError):
+        qm.acquire("openweather")
+    # Unconfigured providers are never limited
+    qm.acquire("noaa")
+
+def test_daily_counts_are_persisted_and_roll_over(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / "quota.sqlite3")
+    first, _ = manager({"gemini": {"daily": 3}}, clock, quota.DailyCounters(path, clock))
+    first.acquire("gemini", "generate_content")
+    first.acquire("gemini", "generate_content")
+    # A restarted bot (or a report worker process) sees the same counts
+    second, _ = manager({"gemini": {"daily": 3}}, clock, quota.DailyCounters(path, clock))
+    assert second.remaining("gemini") == 1
+    clock.now += 86400
+    assert second.remaining("gemini") == 3
+
+def test_daily_budget_is_never_overspent_by_concurrent_processes(tmp_path):
+    path = str(tmp_path / "quota.sqlite3")
+    counters = quota.DailyCounters(path)
+    start = threading.Barrier(8)
+    taken = []
+
+    def worker():
+        # A connection per thread, like separate processes sharing the file
+        start.wait()
+        taken.extend(counters.take("gemini", 10) for _ in range(5))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert taken.count(True) == 10
+    assert counters.get("gemini") == 10
+
+def test_rate_limits_hold_across_processes(tmp_path):
+    path = str(tmp_path / "quota.sqlite3")
+    limits = {"gemini": {"rate_per_minute": 60, "burst": 2}}
+    # Two report workers, each with its own manager, spend one bucket
+    first, second = (quota.QuotaManager({"limits": limits, "max_wait": 0}, counters=quota.MemoryCounters(),
+                                        shared=quota.SharedLimits(path)) for _ in range(2))
+    first.acquire("gemini")
+    second.acquire("gemini")
+    with pytest.raises(quota.QuotaExceededError):
+        first.acquire("gemini")
+
+def test_concurrency_slots_are_shared(tmp_path):
+    path = str(tmp_path / "quota.sqlite3")
+    first, second = quota.SharedLimits(path), quota.SharedLimits(path)
+    assert first.claim("gemini:dispatch", "a", 1, lease=60)
+    assert not second.claim("gemini:dispatch", "b", 1, lease=60)
+    first.release("gemini:dispatch", "a")
+    assert second.claim("gemini:dispatch", "b", 1, lease=60)
+    # A holder that died without releasing only blocks the slot until its lease runs out
+    late = quota.SharedLimits(path, clock=lambda: time.time() + 61)
+    assert late.claim("gemini:dispatch", "c", 1, lease=60)
+
+def test_tokens_per_minute():
+    qm, sleeps = manager({"gemini": {"rate_per_minute": 600, "burst": 10, "tokens_per_minute": 6000}}, max_wait=5.0)
+    qm.acquire("gemini")
+    qm.record_tokens("gemini", 6300)
+    qm.acquire("gemini")
+    # 300 tokens over the minute's allowance take 3 seconds to earn back
+    assert sleeps == [pytest.approx(3.0)]
+
+def test_upstream_serves_stale_when_over_quota(monkeypatch):
+    monkeypatch.setattr(hedging, "get_settings", lambda: dict(hedging.DEFAULT_SETTINGS))
+    # No fresh cache hits, only stale fallbacks
+    cache.configure(cache.MemoryCache(), {"backend": "memory", "ttl": {"noaa": 0}})
+    quota.configure(manager({"noaa": {"daily": 1}})[0])
+    with StubServer("noaa") as stub:
+        url = f"{stub.url}/api/prod/datagetter"
+        params = {"product": "water_level", "station": "8665530", "begin_date": "20250101", "end_date": "20250101"}
+        assert upstream.get("noaa", url, params).reason != "Stale"
+        stale = upstream.get("noaa", url, params)
+        assert stale.reason == "Stale" and stale.json()["data"]
+        with pytest.raises(quota.QuotaExceededError):
+            upstream.get("noaa", url, dict(params, station="8661070"))
+        assert stub.requests == 1
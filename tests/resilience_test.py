@@ -0,0 +1,111 @@
+import pytest
+import requests
+
+from unittest.mock import Mock
+import cache
+import resilience
+import upstream
+from resilience import CircuitBreaker, CircuitOpenError
+
+@pytest.fixture(autouse=True)
+def settings():
+    resilience.reload_settings({
+        "retries": {"max_attempts": 3, "base_delay": 0.01, "max_delay": 0.02},
+        "circuit_breaker": {"failure_threshold": 2, "reset_timeout": 30},
+        "timeouts": {"default": [1, 2], "noaa:datagetter": [1, 5]},
+    })
+    yield
+    resilience.reload_settings()
+
+def response(status):
+    r = requests.Response()
+    r.status_code = status
+    r._content = b'{"ok": true}'
+    return r
+
+def test_timeouts():
+    assert resilience.get_timeout("noaa", "datagetter") == (1, 5)
+    assert resilience.get_timeout("inaturalist", "species_counts") == (1, 2)
+
+def test_backoff_delay_is_capped():
+    for attempt in range(10):
+        assert 0 <= resilience.backoff_delay(attempt, 0.5, 2.0) <= 2.0
+
+def test_circuit_breaker_transitions():
+    now = [0.0]
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    now[0] = 11
+    assert breaker.allow()          # single half-open probe
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    now[0] = 22
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_call_retries_then_succeeds():
+    resilience.reload_settings({"retries": {"max_attempts": 3, "base_delay": 0.01},
+                                "timeouts": {"default": [1, 2]}})
+    attempts = Mock(side_effect=[requests.exceptions.ConnectionError("boom"), response(503), response(200)])
+    sleep = Mock()
+    result = resilience.call("inaturalist", "species_counts", attempts, sleep=sleep)
+    assert result.status_code == 200
+    assert attempts.call_count == 3
+    assert sleep.call_count == 2
+    attempts.assert_called_with((1, 2))
+
+def test_call_does_not_retry_client_errors():
+    attempts = Mock(return_value=response(404))
+    assert resilience.call("inaturalist", "species_counts", attempts, sleep=Mock()).status_code == 404
+    assert attempts.call_count == 1
+
+def test_non_retryable_errors_do_not_reset_the_breaker():
+    breaker = resilience.get_breaker("gemini")
+    breaker.record_failure()
+    with pytest.raises(ValueError):
+        resilience.call("gemini", "generate_content", Mock(side_effect=ValueError("bad prompt")), sleep=Mock())
+    # Still one failure in, so the next one opens the circuit
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+def test_non_retryable_error_frees_the_half_open_probe():
+    now = [0.0]
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    now[0] = 11
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+def test_call_raises_after_retries_and_opens_circuit():
+    attempts = Mock(side_effect=requests.exceptions.Timeout("slow"))
+    # failure_threshold is 2, so the third attempt is refused by the open circuit
+    with pytest.raises(CircuitOpenError):
+        resilience.call("noaa", "datagetter", attempts, sleep=Mock())
+    assert attempts.call_count == 2
+    with pytest.raises(CircuitOpenError):
+        resilience.call("noaa", "datagetter", attempts, sleep=Mock())
+
+def test_upstream_serves_last_good_while_down():
+    # No fresh hits, so every call goes to the session
+    cache.configure(cache.MemoryCache(), {"ttl": {"noaa": 0}, "stale_ttl": 60})
+    session = Mock()
+    session.get.return_value = response(200)
+    url = "https://example.test/api/prod/datagetter"
+    assert upstream.get("noaa", url, params={"station": "1"}, session=session).status_code == 200
+
+    session.get.side_effect = requests.exceptions.ConnectionError("down")
+    stale = upstream.get("noaa", url, params={"station": "1"}, session=session)
+    assert stale.json() == {"ok": True}
+
+    with pytest.raises(requests.exceptions.RequestException):
+        upstream.get("noaa", url, params={"station": "2"}, session=session)
@@ -0,0 +1,49 @@
+import pytest
+from types import SimpleNamespace
+
+import app_config
+import sharding
+
+
+def client(shard_count, shard_ids=None, channels=()):
+    return SimpleNamespace(shard_count=shard_count, shard_ids=shard_ids,
+                           get_channel=lambda channel_id: object() if channel_id in channels else None)
+
+
+def test_parse_shard_ids():
+    assert sharding.parse_shard_ids("0-3") == [0, 1, 2, 3]
+    assert sharding.parse_shard_ids("0, 2,5-6") == [0, 2, 5, 6]
+    assert sharding.parse_shard_ids([3, 1]) == [1, 3]
+    assert sharding.parse_shard_ids("") is None
+
+
+def test_settings_from_environment(monkeypatch):
+    monkeypatch.setenv("SHARD_COUNT", "8")
+    monkeypatch.setenv("SHARD_IDS", "4-7")
+    settings = sharding.get_settings()
+    assert sharding.client_options(settings) == {"shard_count": 8, "shard_ids": [4, 5, 6, 7]}
+
+    monkeypatch.delenv("SHARD_COUNT")
+    app_config.configure({})
+    with pytest.raises(ValueError):
+        sharding.get_settings()
+    monkeypatch.delenv("SHARD_IDS")
+    assert sharding.client_options() == {}
+
+
+def test_daily_reports_partitioned_by_shard():
+    guild = (5 << 22) + 1234  # (guild >> 22) % 4 == 1
+    assert sharding.shard_for(guild, 4) == 1
+    assert sharding.shard_for(None, 4) == 0
+
+    first, second = client(4, [0, 1]), client(4, [2, 3], channels={42})
+    subscriber = {"daily_report_channel": 42, "daily_report_guild": guild}
+    assert sharding.owns_subscriber(first, subscriber)
+    assert not sharding.owns_subscriber(second, subscriber)
+    # Direct-message subscriptions belong to shard 0
+    assert sharding.owns_subscriber(first, {"daily_report_guild": None})
+    # Older subscriptions without a guild fall back to the channel cache
+    assert sharding.owns_subscriber(second, {"daily_report_channel": 42})
+    assert not sharding.owns_subscriber(first, {"daily_report_channel": 42})
+    assert sharding.is_primary(first) and not sharding.is_primary(second)
+    assert sharding.is_primary(client(2))
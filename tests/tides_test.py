@@ -1,7 +1,14 @@
+import calendar
+import time
+
 import pytest
 
+from datetime import datetime, timedelta, timezone
 from unittest.mock import MagicMock, patch
-from noaa_tides_currents import fetch_and_save_data
+from noaa_tides_currents import NOAACoOpsAPI, fetch_and_save_data, merge_series, split_range, station_now
+from benchmarks.stub_servers import StubServer
+import hedging
+import models
 
 @patch("noaa_tides_currents.NOAACoOpsAPI")
 @patch("noaa_tides_currents.load_config")
@@ -32,3 +39,102 @@ def test_fetch_and_save(mock_load_config, mock_api):
     assert data['data_types']['water_level'] == "some water level"
     assert data['data_types']['currents'] == "some current data"
 
+
+def test_csv_and_columnar_responses(monkeypatch):
+    with StubServer("noaa") as stub:
+        monkeypatch.setattr(NOAACoOpsAPI, "BASE_URL", f"{stub.url}/api/prod")
+        api = NOAACoOpsAPI()
+        from_json = api.get_water_level("8665530", "20250101", "20250101", interval="6", quiet=True)
+        from_csv = api.get_water_level("8665530", "20250101", "20250101", interval="6", quiet=True, format="csv")
+        columnar = api.get_currents("8665530", "20250101", "20250101", quiet=True, format="csv", columnar=True)
+
+    assert len(from_csv) == 240
+    # NOAA CSV responses carry no station metadata
+    assert from_csv.to_dict()["data"] == from_json.to_dict()["data"]
+    if models.numpy is not None:
+        assert list(columnar.values) == ["s", "d"]
+
+def test_split_range():
+    assert split_range("20250101", "20250131", 31) == [("20250101", "20250131")]
+    assert split_range("20250101", "20250301", 31) == [("20250101", "20250131"), ("20250201", "20250301")]
+    assert len(split_range("20200101", "20241231", 365)) == 6
+    assert split_range("20250101 10:00", "20250301", 31) == [("20250101 10:00", "20250301")]
+
+def test_merge_series_orders_and_dedupes():
+    first = models.TideSeries.decode_rows([{"t": "2025-01-02 00:00", "v": "2"}, {"t": "2025-01-02 01:00", "v": "3"}])
+    second = models.TideSeries.decode_rows([{"t": "2025-01-01 23:00", "v": "1"}, {"t": "2025-01-02 00:00", "v": "9"}])
+    merged = merge_series([first, {"error": {"message": "No data"}}, second])
+    assert [row["v"] for row in merged.to_dict()["data"]] == [1.0, 2.0, 3.0]
+    assert merge_series([{"error": {"message": "No data"}}]) == {"error": {"message": "No data"}}
+
+def test_long_ranges_are_fetched_in_chunks(monkeypatch):
+    # Hedged duplicates would inflate the request count
+    monkeypatch.setattr(hedging, "get_settings", lambda: dict(hedging.DEFAULT_SETTINGS))
+    with StubServer("noaa") as stub:
+        monkeypatch.setattr(NOAACoOpsAPI, "BASE_URL", f"{stub.url}/api/prod")
+        api = NOAACoOpsAPI()
+        hourly = api.get_water_level("8665530", "20240101", "20250131", quiet=True)
+        assert stub.requests == 2
+        six_minute = api.get_water_level("8665530", "20250101", "20250315", interval="6", quiet=True)
+        assert stub.requests == 5
+
+    assert len(hourly) == 397 * 24
+    assert len(six_minute) == 74 * 240
+    times = six_minute.times
+    assert all(a < b for a, b in zip(times, times[1:]))
+
+def test_forward_ranges_use_prediction_products(monkeypatch):
+    monkeypatch.setattr(hedging, "get_settings", lambda: dict(hedging.DEFAULT_SETTINGS))
+    begin = (datetime.now() + timedelta(days=2)).strftime("%Y%m%d")
+    end = (datetime.now() + timedelta(days=4)).strftime("%Y%m%d")
+    config = {"station_id": "8665530", "current_station": "cs0201", "begin_date": begin, "end_date": end,
+              "units": "english", "data_types": ["water_level", "currents"], "time_zone": "lst_ldt",
+              "harmonic_predictions": False}
+    monkeypatch.setattr("noaa_tides_currents.load_config", lambda config_file: dict(config))
+    with StubServer("noaa") as stub:
+        monkeypatch.setattr(NOAACoOpsAPI, "BASE_URL", f"{stub.url}/api/prod")
+        monkeypatch.setattr(NOAACoOpsAPI, "METADATA_URL", f"{stub.url}/mdapi/prod/webapi")
+        data = fetch_and_save_data(quiet=True)["data"]
+
+    tides, currents = data["data_types"]["water_level"], data["data_types"]["currents"]
+    assert tides.metadata["product"] == "predictions"
+    assert set(tides.labels) == {"H", "L"} and len(tides) < 3 * 6
+    assert currents.metadata["product"] == "currents_predictions"
+    assert currents.labels[:4] == ["slack", "flood", "slack", "ebb"]
+    # Speeds are signed with the flood positive, and the direction follows the flow
+    assert list(currents.values()[1:4]) == [1.62, 0.0, -1.85]
+    assert list(currents.values("d")[1:4]) == [300.0, 300.0, 125.0]
+
+def test_ranges_through_today_split_at_now(monkeypatch):
+    monkeypatch.setattr(hedging, "get_settings", lambda: dict(hedging.DEFAULT_SETTINGS))
+    today = datetime.now(timezone.utc)
+    config = {"station_id": "8665530", "begin_date": today.strftime("%Y%m%d"),
+              "end_date": (today + timedelta(days=1)).strftime("%Y%m%d"), "units": "english",
+              "data_types": ["water_level", "currents"], "time_zone": "gmt", "harmonic_predictions": False}
+    monkeypatch.setattr("noaa_tides_currents.load_config", lambda config_file: dict(config))
+    with StubServer("noaa") as stub:
+        monkeypatch.setattr(NOAACoOpsAPI, "BASE_URL", f"{stub.url}/api/prod")
+        monkeypatch.setattr(NOAACoOpsAPI, "METADATA_URL", f"{stub.url}/mdapi/prod/webapi")
+        started = time.time()
+        data = fetch_and_save_data(quiet=True)["data"]["data_types"]
+
+    # This morning's observations are kept, and predictions only cover what is still to come
+    assert "product" not in data["water_level"].metadata and len(data["water_level"])
+    assert data["water_level"].times[0] == models.parse_noaa_time(today.strftime("%Y-%m-%d 00:00"))
+    predicted = data["water_level_predictions"]
+    assert predicted.metadata["product"] == "predictions" and set(predicted.labels) <= {"H", "L"}
+    assert len(predicted) and predicted.times[0] > started
+    # A water level station has no current predictions, so none are requested without a current_station
+    assert "product" not in data["currents"].metadata
+    assert "currents_predictions" not in data
+
+def test_station_now_uses_the_station_clock():
+    api = MagicMock()
+    api.get_station_details.return_value = {"timezonecorr": -5, "observedst": True}
+    # 03:30 UTC on 2025-07-02 is still July 1st in Charleston
+    moment = calendar.timegm((2025, 7, 2, 3, 30, 0))
+    assert station_now(api, "8665530", "gmt", moment) == moment
+    assert station_now(api, "8665530", "lst", moment) == moment - 5 * 3600
+    assert station_now(api, "8665530", "lst_ldt", moment) == moment - 4 * 3600
+    winter = calendar.timegm((2025, 1, 2, 3, 30, 0))
+    assert station_now(api, "8665530", "lst_ldt", winter) == winter - 5 * 3600
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from call_gemini import combine_api_data
+from models import TideSeries, decode_onecall
+from time_window import TimeWindow
+
+NOW = datetime(2026, 3, 10, 12, 0)
+
+def window(start_hours, end_hours):
+    return TimeWindow(NOW + timedelta(hours=start_hours), NOW + timedelta(hours=end_hours))
+
+def test_parse_and_noaa_range():
+    w = TimeWindow.parse("2026-03-11 00:30", "2026-03-11 23:59")
+    assert w.noaa_range() == ("20260310", "20260312")
+    assert w.key() == "202603110030-202603112359"
+
+def test_onecall_sections_follow_the_window():
+    assert window(0.5, 2).onecall_exclude(NOW) == []
+    assert window(3, 5).onecall_exclude(NOW) == ["current", "minutely"]
+    assert window(72, 80).onecall_exclude(NOW) == ["current", "minutely", "hourly", "alerts"]
+    assert window(24 * 10, 24 * 10 + 2).onecall_exclude(NOW) is None
+    assert window(-5, -2).onecall_exclude(NOW) is None
+
+def test_history_times_for_past_hours():
+    assert window(1, 3).history_times(NOW) == []
+    assert len(window(-3, 1).history_times(NOW)) == 3
+    assert len(window(-24, -1).history_times(NOW)) <= 6
+
+def test_slice_weather_and_tides():
+    w = window(2, 4)
+    base = int(NOW.timestamp())
+    weather = decode_onecall(json.dumps({
+        "timezone_offset": 0,
+        "hourly": [{"dt": base + h * 3600} for h in range(48)],
+        "daily": [{"dt": base + d * 86400} for d in range(8)],
+        "alerts": [{"start": base + 3 * 3600, "end": base + 5 * 3600}, {"start": base + 90000, "end": base + 99000}],
+    }))
+    sliced = w.slice_weather(weather)
+    assert [row.dt for row in sliced.hourly] == [base + h * 3600 for h in (1, 2, 3, 4)]
+    assert len(sliced.daily) == 1
+    assert len(sliced.alerts) == 1
+    assert len(weather.hourly) == 48
+
+    tides = {"station_id": "1", "data_types": {"water_level": TideSeries.decode_rows([
+        {"t": "2026-03-10 09:00", "v": "1"}, {"t": "2026-03-10 14:00", "v": "2"}, {"t": "2026-03-11 14:00", "v": "3"},
+    ]), "currents": {"error": "no data"}}}
+    sliced = w.slice_tides(tides)
+    assert sliced["data_types"]["water_level"].to_dict()["data"] == [{"t": "2026-03-10 14:00", "v": 2.0}]
+    assert sliced["data_types"]["currents"] == {"error": "no data"}
+    assert len(tides["data_types"]["water_level"]) == 3
+
+def test_slice_tides_keeps_the_events_around_the_window():
+    w = TimeWindow.parse("2026-03-10 13:00", "2026-03-10 15:00")
+    events = TideSeries.decode_rows([
+        {"t": "2026-03-10 03:02", "v": "1.9", "type": "H"}, {"t": "2026-03-10 09:14", "v": "-0.1", "type": "L"},
+        {"t": "2026-03-10 15:26", "v": "1.8", "type": "H"}, {"t": "2026-03-10 21:38", "v": "0.0", "type": "L"},
+    ])
+    sliced = w.slice_tides({"data_types": {"water_level": events}})["data_types"]["water_level"]
+    # The high inside the window plus the low either side of it
+    assert [row["t"] for row in sliced.to_dict()["data"]] == ["2026-03-10 09:14", "2026-03-10 15:26", "2026-03-10 21:38"]
+    assert sliced.labels == ["L", "H", "L"]
+    before = TimeWindow.parse("2026-03-10 00:00", "2026-03-10 01:00").slice_tides({"data_types": {"water_level": events}})
+    assert before["data_types"]["water_level"].labels == ["H"]
+
+def test_combine_api_data_fetches_for_the_window():
+    w = TimeWindow(datetime.now() + timedelta(days=3), datetime.now() + timedelta(days=3, hours=2))
+    with patch("call_gemini.get_weather", return_value={"daily": []}) as get_weather, \
+         patch("call_gemini.get_tide", return_value={"data": {"data_types": {}}}) as get_tide, \
+         patch("call_gemini.get_fish", return_value={"error": "down"}), \
+         patch("call_gemini.zip_to_coords", return_value=("32.7", "-79.9")):
+        combine_api_data("29414", "kayak", window=w)
+
+    begin_date, end_date = w.noaa_range()
+    get_tide.assert_called_once_with(quiet=True, begin_date=begin_date, end_date=end_date, time_zone="lst_ldt")
+    get_weather.assert_called_once_with("32.7", "-79.9", exclude=["current", "minutely", "hourly", "alerts"])
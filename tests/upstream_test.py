@@ -0,0 +1,69 @@
+import json
+import pytest
+
+from unittest.mock import Mock
+import upstream
+from benchmarks.stub_servers import StubServer
+
+@pytest.fixture
+def recording(monkeypatch, tmp_path):
+    path = str(tmp_path / "recording.jsonl")
+    monkeypatch.setattr(upstream, "UPSTREAM_RECORDING", path)
+    return path
+
+def test_record_then_replay(monkeypatch, recording):
+    params = {"station": "8665530", "product": "water_level", "begin_date": "20250101",
+              "end_date": "20250102", "appid": "secret"}
+
+    monkeypatch.setattr(upstream, "UPSTREAM_MODE", "record")
+    with StubServer("noaa") as stub:
+        url = f"{stub.url}/api/prod/datagetter"
+        live = upstream.get("noaa", url, params=params)
+
+    with open(recording, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    assert len(entries) == 1
+    assert entries[0]["params"]["appid"] == "<redacted>"
+    assert "secret" not in entries[0]["key"]
+
+    # The stub is stopped, so this can only be served from the recording
+    monkeypatch.setattr(upstream, "UPSTREAM_MODE", "replay")
+    replayed = upstream.get("noaa", url, params=params)
+    assert replayed.status_code == 200
+    assert replayed.json() == live.json()
+
+    # Different dates still match on the loose key
+    params["begin_date"] = "20260101"
+    assert upstream.get("noaa", url, params=params).json() == live.json()
+
+    with pytest.raises(upstream.ReplayMissError):
+        upstream.get("noaa", url, params={"station": "0000000"})
+
+def test_gemini_record_then_replay(monkeypatch, recording):
+    client = Mock()
+    client.models.generate_content.return_value.text = "Go fishing at dawn"
+    client.models.generate_content.return_value.usage_metadata.prompt_token_count = 12
+    client.models.generate_content.return_value.usage_metadata.total_token_count = 20
+
+    monkeypatch.setattr(upstream, "UPSTREAM_MODE", "record")
+    upstream.generate(client, "gemini-2.5-flash", "prompt text", template="template_today.txt")
+
+    monkeypatch.setattr(upstream, "UPSTREAM_MODE", "replay")
+    response = upstream.generate(None, "gemini-2.5-flash", "prompt text")
+    assert response.text == "Go fishing at dawn"
+    assert response.usage_metadata.prompt_token_count == 12
+
+    # A new prompt falls back to any recording for the same model and template
+    response = upstream.generate(None, "gemini-2.5-flash", "other prompt", template="template_today.txt")
+    assert response.text == "Go fishing at dawn"
+
+def test_cache_only_never_reaches_the_network():
+    with StubServer("noaa") as stub:
+        url = f"{stub.url}/api/prod/datagetter"
+        with upstream.cache_only(), pytest.raises(upstream.CacheOnlyMiss):
+            upstream.get("noaa", url, params={"station": "8665530"})
+        assert stub.requests == 0
+        live = upstream.get("noaa", url, params={"station": "8665530"})
+        with upstream.cache_only():
+            assert upstream.get("noaa", url, params={"station": "8665530"}).json() == live.json()
+        assert stub.requests == 1
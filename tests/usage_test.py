@@ -0,0 +1,62 @@
+import pytest
+
+from unittest.mock import Mock
+import metrics
+from gemini_usage import UsageTracker, choose_model, estimate_cost, extract_usage
+
+def mock_response(prompt=1000, output=200, cached=0, total=None):
+    response = Mock()
+    response.usage_metadata.prompt_token_count = prompt
+    response.usage_metadata.candidates_token_count = output
+    response.usage_metadata.cached_content_token_count = cached
+    response.usage_metadata.thoughts_token_count = 0
+    response.usage_metadata.total_token_count = total if total is not None else prompt + output
+    return response
+
+def test_extract_usage_missing_metadata():
+    response = Mock(spec=["text"])
+    usage = extract_usage(response)
+    assert usage["prompt_tokens"] == 0
+    assert usage["total_tokens"] == 0
+
+def test_estimate_cost():
+    usage = {"prompt_tokens": 1_000_000, "output_tokens": 1_000_000, "cached_tokens": 0, "thoughts_tokens": 0}
+    pricing = {"cheap": {"input": 1.0, "output": 2.0}}
+    assert estimate_cost(usage, "cheap", pricing) == pytest.approx(3.0)
+    assert estimate_cost(usage, "unknown-model", pricing) == 0.0
+
+def test_record_and_summary():
+    metrics.reset()
+    tracker = UsageTracker(window_seconds=60, pricing={})
+    tracker.record(mock_response(), "gemini-2.5-flash", report_type="today", template="template_today.txt",
+                   fishing_type="kayak", user_id=42, now=100)
+    tracker.record(mock_response(500, 100), "gemini-2.5-flash", report_type="weekly", user_id=7, now=110)
+
+    assert tracker.tokens_used(now=110) == 1800
+    assert tracker.tokens_used(user_id=42, now=110) == 1200
+
+    by_type = tracker.summary("report_type", now=110)
+    assert by_type["today"]["requests"] == 1
+    assert by_type["weekly"]["prompt_tokens"] == 500
+
+    assert metrics.get_counter("gemini_tokens_total", kind="prompt", report_type="today",
+                               model="gemini-2.5-flash", template="template_today.txt",
+                               fishing_type="kayak") == 1000
+
+    # Events roll out of the window
+    assert tracker.tokens_used(now=165) == 600
+
+    with pytest.raises(ValueError):
+        tracker.summary("zip_code")
+
+def test_choose_model_budgets():
+    tracker = UsageTracker(pricing={})
+    tracker.record(mock_response(total=5000), "gemini-2.5-flash", user_id=42)
+    budget = {"per_user_daily_tokens": 4000, "global_daily_tokens": 10000, "fallback_model": "lite"}
+
+    assert choose_model("gemini-2.5-flash", 42, tracker, budget) == "lite"
+    assert choose_model("gemini-2.5-flash", 7, tracker, budget) == "gemini-2.5-flash"
+
+    budget["global_daily_tokens"] = 5000
+    assert choose_model("gemini-2.5-flash", 7, tracker, budget) == "lite"
+    assert choose_model("gemini-2.5-flash", 7, tracker, {}) == "gemini-2.5-flash"
@@ -0,0 +1,102 @@
+import pytest
+
+import hedging
+import warehouse
+from benchmarks.stub_servers import StubServer
+from models import HourlyPoint, TideSeries, format_noaa_time, parse_noaa_time
+from noaa_tides_currents import NOAACoOpsAPI, fetch_and_save_data
+
+DAY = 86400
+JAN1 = parse_noaa_time("2025-01-01 00:00")
+
+def hourly(begin, end):
+    start = parse_noaa_time(f"{begin[:4]}-{begin[4:6]}-{begin[6:]} 00:00")
+    stop = parse_noaa_time(f"{end[:4]}-{end[4:6]}-{end[6:]} 00:00") + DAY
+    return TideSeries.decode_rows([{"t": format_noaa_time(t), "v": str(t % 7)} for t in range(start, stop, 3600)],
+                                  {"id": "1"})
+
+def test_coverage_merges_and_reports_gaps(fresh_warehouse):
+    fresh_warehouse.cover("x", 10, 20)
+    fresh_warehouse.cover("x", 30, 40)
+    assert fresh_warehouse.missing("x", 0, 50) == [(0, 10), (20, 30), (40, 50)]
+    fresh_warehouse.cover("x", 20, 30)
+    assert fresh_warehouse.missing("x", 0, 50) == [(0, 10), (40, 50)]
+    assert fresh_warehouse.missing("x", 15, 35) == []
+
+def test_fetch_dates_only_fetches_missing_days(fresh_warehouse):
+    calls = []
+
+    def fetcher(begin, end):
+        calls.append((begin, end))
+        return hourly(begin, end)
+
+    first = fresh_warehouse.fetch_dates("noaa:1:water_level", "20250103", "20250104", fetcher,
+                                        complete_before=JAN1 + 30 * DAY)
+    wider = fresh_warehouse.fetch_dates("noaa:1:water_level", "20250101", "20250106", fetcher,
+                                        complete_before=JAN1 + 30 * DAY)
+    assert calls == [("20250103", "20250104"), ("20250101", "20250102"), ("20250105", "20250106")]
+    assert len(first) == 48 and len(wider) == 6 * 24
+    assert wider.metadata == {"id": "1"}
+    assert list(wider.between(JAN1 + 2 * DAY, JAN1 + 4 * DAY - 1).values()) == list(first.values())
+
+    # Days from complete_before on may still be filling in, so they are fetched again
+    fresh_warehouse.fetch_dates("noaa:1:air_temperature", "20250101", "20250102", fetcher, complete_before=JAN1 + DAY)
+    fresh_warehouse.fetch_dates("noaa:1:air_temperature", "20250101", "20250102", fetcher, complete_before=JAN1 + DAY)
+    assert calls[-2:] == [("20250101", "20250102"), ("20250102", "20250102")]
+
+def test_station_day_in_progress_is_refetched(fresh_warehouse):
+    calls = []
+
+    def fetcher(begin, end):
+        calls.append((begin, end))
+        return hourly(begin, end)
+
+    # 22:00 on January 2nd at the station, already January 3rd in UTC
+    now = JAN1 + DAY + 22 * 3600
+    for _ in range(2):
+        warehouse.fetch_noaa("1", "water_level", "20250101", "20250102", fetcher, time_zone="lst_ldt", now=now)
+    assert calls == [("20250101", "20250102"), ("20250102", "20250102")]
+
+def test_fetch_dates_returns_errors_when_nothing_is_stored(fresh_warehouse):
+    error = {"error": {"message": "No data was found"}}
+    assert fresh_warehouse.fetch_dates("noaa:1:wind", "20250101", "20250101", lambda b, e: error) == error
+
+def test_read_columnar(fresh_warehouse):
+    numpy = pytest.importorskip("numpy")
+    fresh_warehouse.write("noaa:1:water_level", hourly("20250101", "20250101"))
+    columnar = fresh_warehouse.read_columnar("noaa:1:water_level", JAN1, JAN1 + DAY)
+    assert list(columnar.values) == ["v"]
+    assert len(columnar.time) == 24
+    assert columnar.time[1] == numpy.datetime64("2025-01-01T01:00")
+
+def test_weather_history_is_fetched_once(fresh_warehouse):
+    calls = []
+    hour = JAN1 + 5 * 3600
+
+    def fetch():
+        calls.append(hour)
+        return [HourlyPoint(hour + 600, temp=281.5, pressure=1018, conditions="light rain")]
+
+    first = warehouse.weather_history("32.7808", "-79.9236", hour + 900, fetch)
+    second = warehouse.weather_history(32.78, -79.92, hour + 1200, fetch)
+    assert len(calls) == 1
+    assert [(p.dt, p.temp, p.pressure, p.conditions, p.humidity) for p in second] == \
+        [(hour + 600, 281.5, 1018.0, "light rain", None)]
+    assert first[0].temp == second[0].temp
+
+def test_repeat_reports_only_fetch_new_days(monkeypatch):
+    monkeypatch.setattr(hedging, "get_settings", lambda: dict(hedging.DEFAULT_SETTINGS))
+    config = {"station_id": "8665530", "begin_date": "20250101", "end_date": "20250107", "units": "english",
+              "data_types": ["water_level", "water_temperature"], "time_zone": "gmt"}
+    monkeypatch.setattr("noaa_tides_currents.load_config", lambda config_file: dict(config))
+    with StubServer("noaa") as stub:
+        monkeypatch.setattr(NOAACoOpsAPI, "BASE_URL", f"{stub.url}/api/prod")
+        fetch_and_save_data(quiet=True)
+        assert stub.requests == 3
+        config["end_date"] = "20250110"
+        data = fetch_and_save_data(quiet=True)["data"]
+        # Station info comes from the response cache; only 20250108-20250110 is fetched for each product
+        assert stub.requests == 5
+
+    assert len(data["data_types"]["water_level"]) == 10 * 24
+    assert data["data_types"]["water_level"].metadata["name"] == "Stub Station"
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+import weekly
+from models import TideSeries, decode_onecall
+
+DAY = 24 * 60 * 60
+START = 1767268800  # 2026-01-01 12:00 UTC
+
+def forecast(winds, pressures=None):
+    pressures = pressures or [1015] * len(winds)
+    return {
+        "weather_data": decode_onecall(json.dumps({
+            "timezone_offset": -5 * 3600,
+            "daily": [{
+                "dt": START + i * DAY,
+                "sunrise": START + i * DAY,
+                "sunset": START + i * DAY + 10 * 3600,
+                "temp": {"min": 10.2, "max": 18.7},
+                "wind_speed": wind,
+                "pressure": pressure,
+                "pop": 0.1,
+                "moon_phase": 0.25,
+                "weather": [{"main": "Clear"}],
+            } for i, (wind, pressure) in enumerate(zip(winds, pressures))],
+        })),
+        "tides_data": {"data_types": {"water_level": TideSeries.decode_rows([
+            {"t": "2026-01-01 00:00", "v": "0.5"}, {"t": "2026-01-01 06:00", "v": "6.1"},
+        ])}},
+    }
+
+def test_split_days_uses_local_dates_and_tides():
+    pieces = weekly.split_days(forecast([2, 3]))
+    assert [p["date"] for p in pieces] == ["2026-01-01", "2026-01-02"]
+    assert pieces[0]["weekday"] == "Thursday"
+    assert pieces[0]["tides"] == {"water_level": {"min": 0.5, "max": 6.1}}
+    assert pieces[1]["tides"] == {}
+    assert weekly.split_days({"weather_data": {"error": "down"}}) == []
+
+def test_score_day_penalises_wind_for_kayaks():
+    calm, windy = weekly.split_days(forecast([2, 9]))
+    assert weekly.score_day(calm, "kayak")["score"] > weekly.score_day(windy, "kayak")["score"]
+    assert weekly.score_day(windy, "boat")["score"] > weekly.score_day(windy, "kayak")["score"]
+    assert weekly.score_day(calm, "kayak")["windows"] == ["06:00-08:00", "16:00-18:00"]
+
+def test_only_changed_days_are_rescored():
+    data = forecast([2, 3, 4, 5, 6, 7, 8])
+    days, rescored = weekly.score_week(data, "29414", "kayak")
+    assert (len(days), rescored) == (7, 7)
+
+    days, rescored = weekly.score_week(data, "29414", "kayak")
+    assert rescored == 0
+
+    # Small forecast noise rounds away; a real change on one day does not
+    data["weather_data"].daily[0].wind_speed = 2.1
+    data["weather_data"].daily[5].wind_speed = 12
+    days, rescored = weekly.score_week(data, "29414", "kayak")
+    assert rescored == 1
+
+def test_report_reused_until_ranking_changes():
+    days, _ = weekly.score_week(forecast([2, 3, 9, 9, 9, 9, 9]), "29414", "kayak")
+    best = weekly.ranking(days)
+    assert best[:2] == ["2026-01-01", "2026-01-02"]
+    assert weekly.cached_report("29414", "kayak", best) is None
+
+    weekly.store_report("29414", "kayak", best, "Weekly report")
+    assert weekly.cached_report("29414", "kayak", best) == "Weekly report"
+    assert weekly.cached_report("29414", "kayak", list(reversed(best))) is None
+    assert weekly.cached_report("29414", "boat", best) is None
+
+def test_quick_report_covers_requested_dates():
+    data = forecast([2, 9, 3])
+    data["weather_data"].daily[0].temp_min = 288.15
+    report = weekly.quick_report(data, "kayak")
+    assert "**Thursday 2026-01-01**" in report
+    assert "59°F" in report and "water level 0.5 to 6.1 ft" in report
+    assert "2026-01-02" not in report
+
+    report = weekly.quick_report(data, "kayak", first="2026-01-02", last="2026-01-03")
+    assert "2026-01-01" not in report
+    assert "Windy at 9 m/s" in report and "2026-01-03" in report
+    assert "No forecast" in weekly.quick_report({"weather_data": None})
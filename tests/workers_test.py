@@ -0,0 +1,50 @@
+import asyncio
+import os
+import time
+import pytest
+
+import metrics
+from report_workers import WorkerPool, WorkerCrashedError, ReportTimeoutError
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(count=1, timeout=5)
+    yield pool
+    pool.shutdown()
+
+@pytest.mark.asyncio
+async def test_worker_runs_job(pool):
+    assert await pool.submit(pow, 2, 10) == 1024
+
+@pytest.mark.asyncio
+async def test_worker_crash_is_isolated(pool):
+    with pytest.raises(WorkerCrashedError):
+        await pool.submit(os._exit, 1)
+    # The pool is rebuilt for the next job
+    assert await pool.submit(pow, 3, 2) == 9
+
+@pytest.mark.asyncio
+async def test_worker_timeout(pool):
+    pool.timeout = 0.2
+    pool.start()
+    executor, _ = pool._get_executor()
+    processes = list(executor._processes.values())
+    with pytest.raises(ReportTimeoutError):
+        await pool.submit(time.sleep, 30)
+    # The stuck worker is killed, not left running beside a new pool
+    for process in processes:
+        process.join(5)
+        assert not process.is_alive()
+    pool.timeout = 5
+    assert await pool.submit(pow, 2, 3) == 8
+
+@pytest.mark.asyncio
+async def test_time_in_the_queue_does_not_count_towards_the_timeout(pool):
+    metrics.reset()
+    pool.timeout = 1.5
+    pool.start()
+    # One worker: the second job waits about a second before it starts
+    first = asyncio.ensure_future(pool.submit(time.sleep, 1))
+    second = asyncio.ensure_future(pool.submit(time.sleep, 1))
+    await asyncio.gather(first, second)
+    assert metrics.get_counter("report_jobs_total", job="sleep", outcome="timeout") == 0
@@ -0,0 +1,118 @@
+"""
+Fetch planning and slicing for time-window reports (/fish time, /fish tomorrow).
+
+The requested window decides what is fetched: the NOAA date range, which
+One Call sections are needed (minutely covers the next hour, hourly the
+next 48 hours, daily the next 8 days) and which past hours need One Call
+timemachine lookups. The fetched data is then cut down to the window so
+Gemini only sees rows that matter.
+"""
+
+import math
+from datetime import datetime, timedelta, timezone
+
+from models import TideSeries, WeatherSnapshot, parse_noaa_time
+
+WINDOW_FORMAT = "%Y-%m-%d %H:%M"
+
+ONECALL_SECTIONS = ("current", "minutely", "hourly", "daily", "alerts")
+
+# How far ahead each One Call section reaches
+MINUTELY_HORIZON = timedelta(hours=1)
+HOURLY_HORIZON = timedelta(hours=48)
+DAILY_HORIZON = timedelta(days=8)
+
+# Past windows are sampled with at most this many timemachine calls
+MAX_HISTORY_CALLS = 6
+
+# Rows this close to the window edges are kept for context (e.g. the tide turning just before)
+EDGE_PADDING = timedelta(hours=1)
+
+# NOAA timestamps in station local time line up with the user's window
+NOAA_TIME_ZONE = "lst_ldt"
+
+
+class TimeWindow:
+    """A report window in the bot's local time"""
+
+    __slots__ = ("start", "end")
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def parse(cls, start, end):
+        return cls(datetime.strptime(start, WINDOW_FORMAT), datetime.strptime(end, WINDOW_FORMAT))
+
+    def key(self):
+        return f"{self.start:%Y%m%d%H%M}-{self.end:%Y%m%d%H%M}"
+
+    def noaa_range(self):
+        """(begin_date, end_date) in NOAA's YYYYMMDD format"""
+        begin = self.start - EDGE_PADDING
+        end = self.end + EDGE_PADDING
+        return begin.strftime("%Y%m%d"), end.strftime("%Y%m%d")
+
+    def onecall_exclude(self, now=None):
+        """One Call sections to exclude, or None if no forecast is needed (window is past)"""
+        now = now or datetime.now()
+        if self.end <= now:
+            return None
+        needed = {"daily"} if self.start < now + DAILY_HORIZON else set()
+        if self.start < now + MINUTELY_HORIZON:
+            needed.update(("current", "minutely"))
+        if self.start < now + HOURLY_HORIZON:
+            needed.update(("hourly", "alerts"))
+        if not needed:
+            return None
+        return [section for section in ONECALL_SECTIONS if section not in needed]
+
+    def history_times(self, now=None):
+        """Unix times of past hours in the window to look up with timemachine"""
+        now = now or datetime.now()
+        past_end = min(self.end, now)
+        if self.start >= past_end:
+            return []
+        hours = max(1, math.ceil((past_end - self.start).total_seconds() / 3600))
+        step = max(1, math.ceil(hours / MAX_HISTORY_CALLS))
+        start = self.start.replace(minute=0)
+        return [int((start + timedelta(hours=h)).timestamp()) for h in range(0, hours, step)]
+
+    def slice_weather(self, weather):
+        """Keep only the One Call rows that fall in the window"""
+        if not isinstance(weather, WeatherSnapshot):
+            return weather
+        start_ts = (self.start - EDGE_PADDING).timestamp()
+        end_ts = self.end.timestamp()
+        offset = timedelta(seconds=weather.timezone_offset or 0)
+        first_day, last_day = self.start.date(), self.end.date()
+        return weather.copy(
+            minutely=[(dt, mm) for dt, mm in weather.minutely or () if start_ts <= dt <= end_ts] or None,
+            hourly=[row for row in weather.hourly if start_ts <= row.dt <= end_ts],
+            daily=[row for row in weather.daily
+                   if first_day <= (datetime.fromtimestamp(row.dt, timezone.utc) + offset).date() <= last_day],
+            alerts=[a for a in weather.alerts if a.get("start", 0) <= end_ts and a.get("end", 0) >= start_ts],
+        )
+
+    def slice_tides(self, tides):
+        """Keep only the NOAA rows that fall in the window"""
+        if not isinstance(tides, dict) or not isinstance(tides.get("data_types"), dict):
+            return tides
+        # NOAA stamps are station local time, stored as if they were UTC
+        low = parse_noaa_time((self.start - EDGE_PADDING).strftime(WINDOW_FORMAT))
+        high = parse_noaa_time((self.end + EDGE_PADDING).strftime(WINDOW_FORMAT))
+        sliced = dict(tides)
+        sliced["data_types"] = {
+            data_type: self._slice_series(series, low, high) if isinstance(series, TideSeries) else series
+            for data_type, series in tides["data_types"].items()
+        }
+        return sliced
+
+    @staticmethod
+    def _slice_series(series, low, high):
+        # High/low and slack/max predictions are hours apart, so keep the
+        # events either side of the window too
+        if series.labels is not None:
+            return series.around(low, high)
+        return series.between(low, high)
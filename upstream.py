@@ -0,0 +1,368 @@
+"""
+Shared HTTP layer for upstream APIs (OpenWeather, NOAA, iNaturalist) with
+record/replay support.
+
+UPSTREAM_MODE selects how requests are served:
+    live    - talk to the network (default)
+    record  - talk to the network and append every request/response to
+              UPSTREAM_RECORDING as JSON lines
+    replay  - serve responses from UPSTREAM_RECORDING without touching
+              the network
+
+UPSTREAM_REPLAY_LATENCY is "zero" (default) to replay instantly or
+"original" to sleep for the recorded response time.
+
+Live requests take a slot from the provider's quota (see quota.py) and
+run through resilience.call (timeouts, retries and circuit breakers) and,
+for long-tail upstreams, hedging.run. Successful responses
+are kept in the shared cache (see cache.py): they are served directly for
+the provider's cache TTL and, while an upstream's circuit is open or once
+retries are exhausted, served stale for up to the cache's stale_ttl.
+Requests refused by a quota are served stale the same way.
+
+Inside cache_only(), requests are answered from the cache (fresh or last
+good) and never reach the network; a request with nothing cached raises
+CacheOnlyMiss. Admission control builds its degraded reports this way.
+"""
+
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import requests
+
+import cache
+import hedging
+import metrics
+import quota
+import resilience
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_MODE = os.getenv("UPSTREAM_MODE", "live").lower()
+UPSTREAM_RECORDING = os.getenv("UPSTREAM_RECORDING", "upstream_recording.jsonl")
+UPSTREAM_REPLAY_LATENCY = os.getenv("UPSTREAM_REPLAY_LATENCY", "zero").lower()
+
+# Query parameters that are never written to a recording
+SECRET_PARAMS = {"appid", "key", "api_key", "apikey", "token"}
+
+# Parameters ignored when an exact replay match is not found (they change
+# from run to run, e.g. NOAA date ranges computed from today's date)
+VOLATILE_PARAMS = {"begin_date", "end_date", "date", "dt"}
+
+
+class ReplayMissError(Exception):
+    """Raised in replay mode when no recorded response matches a request"""
+
+
+class CacheOnlyMiss(Exception):
+    """Raised inside cache_only() when a request has nothing cached to serve"""
+
+
+_cache_only = contextvars.ContextVar("upstream_cache_only", default=False)
+
+
+@contextmanager
+def cache_only():
+    """Serve upstream requests in this block from the cache alone"""
+    token = _cache_only.set(True)
+    try:
+        yield
+    finally:
+        _cache_only.reset(token)
+
+
+def is_cache_only():
+    return _cache_only.get()
+
+
+def _redact(params):
+    return {k: ("<redacted>" if k.lower() in SECRET_PARAMS else v) for k, v in (params or {}).items()}
+
+
+def request_key(provider, method, url, params=None, ignore=()):
+    """Stable key identifying an upstream request (secrets excluded)
+
+    Only the URL path is used, so a recording made against one host (e.g.
+    the benchmark stubs) replays against another.
+    """
+    path = urlparse(url).path
+    items = sorted(
+        (str(k), str(v)) for k, v in (params or {}).items()
+        if k.lower() not in SECRET_PARAMS and k not in ignore
+    )
+    return json.dumps([provider, method.upper(), path, items])
+
+
+def prompt_key(model, prompt):
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return json.dumps(["gemini", model, digest])
+
+
+class Recorder:
+    """Append-only JSONL writer for upstream exchanges"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, entry):
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class Replayer:
+    """Serves recorded exchanges, cycling through repeated recordings of a key"""
+
+    def __init__(self, path):
+        self.path = path
+        self._exact = defaultdict(list)
+        self._loose = defaultdict(list)
+        self._positions = defaultdict(int)
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning("Skipping malformed line in %s", self.path)
+                        continue
+                    if "key" not in entry:
+                        continue
+                    self._exact[entry["key"]].append(entry)
+                    if entry.get("loose_key"):
+                        self._loose[entry["loose_key"]].append(entry)
+        except FileNotFoundError:
+            logger.warning("Replay file %s not found; every request will miss", self.path)
+        logger.info("Loaded %d recorded upstream responses", sum(len(v) for v in self._exact.values()))
+
+    def lookup(self, key, loose_key=None):
+        for index, k in ((self._exact, key), (self._loose, loose_key)):
+            entries = index.get(k) if k else None
+            if entries:
+                with self._lock:
+                    position = self._positions[k] % len(entries)
+                    self._positions[k] += 1
+                return entries[position]
+        raise ReplayMissError(f"No recorded response for {key}")
+
+
+_recorder = None
+_replayer = None
+_state_lock = threading.Lock()
+
+
+def get_recorder():
+    global _recorder
+    with _state_lock:
+        if _recorder is None or _recorder.path != UPSTREAM_RECORDING:
+            _recorder = Recorder(UPSTREAM_RECORDING)
+        return _recorder
+
+
+def get_replayer():
+    global _replayer
+    with _state_lock:
+        if _replayer is None or _replayer.path != UPSTREAM_RECORDING:
+            _replayer = Replayer(UPSTREAM_RECORDING)
+        return _replayer
+
+
+def endpoint_name(url):
+    """Last URL path segment, used to key per-endpoint settings (e.g. datagetter)"""
+    return urlparse(url).path.rstrip("/").rsplit("/", 1)[-1] or "root"
+
+
+def _cache_key(key):
+    return "upstream:" + hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _serve_stale(provider, key, reason):
+    entry = cache.get(_cache_key(key))
+    if entry is None:
+        return None
+    logger.warning("Serving last good %s response (%s)", provider, reason)
+    metrics.increment("upstream_stale_served_total", provider=provider)
+    return _build_response(entry, "Stale")
+
+
+def _replay_delay(entry):
+    if UPSTREAM_REPLAY_LATENCY == "original":
+        time.sleep(entry.get("elapsed", 0))
+
+
+def _build_response(entry, reason="Replayed"):
+    response = requests.Response()
+    response.status_code = entry["status"]
+    response._content = entry["body"].encode("utf-8")
+    response.encoding = "utf-8"
+    response.url = entry["url"]
+    response.headers["Content-Type"] = entry.get("content_type", "application/json")
+    response.reason = reason
+    return response
+
+
+def _cached_fresh(provider, key):
+    """Cached response for key if it is younger than the provider's TTL (longer while its quota is low)"""
+    ttl = cache.ttl_for(provider) * quota.ttl_multiplier(provider)
+    if not ttl:
+        return None
+    entry = cache.get(_cache_key(key))
+    if entry is None or time.time() - entry.get("fetched_at", 0) > ttl:
+        return None
+    return _build_response(entry, "Cached")
+
+
+def _store(provider, key, url, response):
+    cache.set(_cache_key(key), {
+        "status": response.status_code,
+        "url": url,
+        "content_type": response.headers.get("Content-Type", "application/json"),
+        "body": response.text,
+        "fetched_at": time.time(),
+    }, ttl=max(cache.ttl_for(provider), cache.stale_ttl()))
+
+
+def get(provider, url, params=None, timeout=30, session=None, headers=None):
+    """GET an upstream URL, honouring UPSTREAM_MODE. Returns a requests.Response"""
+    key = request_key(provider, "GET", url, params)
+    if UPSTREAM_MODE == "replay":
+        entry = get_replayer().lookup(key, request_key(provider, "GET", url, params, VOLATILE_PARAMS))
+        _replay_delay(entry)
+        return _build_response(entry)
+
+    if _cache_only.get():
+        cached = _cached_fresh(provider, key) or _serve_stale(provider, key, "cache only")
+        if cached is None:
+            raise CacheOnlyMiss(f"No cached {provider} response for {endpoint_name(url)}")
+        return cached
+
+    # Recordings always capture real exchanges
+    if UPSTREAM_MODE != "record":
+        cached = _cached_fresh(provider, key)
+        if cached is not None:
+            return cached
+
+    http = session or requests
+    endpoint = endpoint_name(url)
+    started = time.perf_counter()
+    try:
+        quota.acquire(provider, endpoint)
+        response = resilience.call(
+            provider, endpoint,
+            lambda t: hedging.run(provider, lambda: http.get(url, params=params, timeout=t, headers=headers)),
+            default_timeout=timeout,
+        )
+    except requests.exceptions.RequestException as e:
+        stale = _serve_stale(provider, key, str(e))
+        if stale is None:
+            raise
+        return stale
+    elapsed = time.perf_counter() - started
+
+    if resilience.is_retryable_response(response):
+        stale = _serve_stale(provider, key, f"status {response.status_code}")
+        if stale is not None:
+            return stale
+    elif response.ok:
+        _store(provider, key, url, response)
+
+    if UPSTREAM_MODE == "record":
+        get_recorder().write({
+            "provider": provider,
+            "method": "GET",
+            "url": url,
+            "params": _redact(params),
+            "key": key,
+            "loose_key": request_key(provider, "GET", url, params, VOLATILE_PARAMS),
+            "status": response.status_code,
+            "content_type": response.headers.get("Content-Type", "application/json"),
+            "body": response.text,
+            "elapsed": round(elapsed, 4),
+            "recorded_at": time.time(),
+        })
+    return response
+
+
+def _usage_to_dict(usage):
+    fields = ("prompt_token_count", "candidates_token_count", "cached_content_token_count",
+              "thoughts_token_count", "total_token_count")
+    values = {f: getattr(usage, f, None) for f in fields} if usage is not None else {}
+    return {f: v for f, v in values.items() if isinstance(v, int)}
+
+
+def generate(client, model, prompt, template=None, dispatch=None):
+    """Call Gemini generate_content, honouring UPSTREAM_MODE
+
+    Identical prompts within the gemini cache TTL are answered from the
+    cache; those responses have from_cache set and no usage_metadata.
+    Live calls are handed to dispatch(call) when given, so only requests
+    that actually reach Gemini wait for a dispatcher slot; the dispatcher
+    then takes the gemini quota itself. Without one the quota is taken here.
+    In replay mode the returned object only provides .text and
+    .usage_metadata, which is all the report pipeline reads.
+    """
+    key = prompt_key(model, prompt)
+    loose_key = json.dumps(["gemini", model, template])
+    if UPSTREAM_MODE == "replay":
+        entry = get_replayer().lookup(key, loose_key)
+        _replay_delay(entry)
+        return SimpleNamespace(text=entry["body"], usage_metadata=SimpleNamespace(**entry.get("usage", {})))
+
+    ttl = cache.ttl_for("gemini")
+    cache_key = "gemini:" + hashlib.sha256(key.encode("utf-8")).hexdigest()
+    if ttl and UPSTREAM_MODE != "record":
+        text = cache.get(cache_key)
+        if text is not None:
+            return SimpleNamespace(text=text, usage_metadata=None, from_cache=True)
+
+    def call():
+        return resilience.call(
+            "gemini", "generate_content",
+            lambda t: client.models.generate_content(model=model, contents=prompt),
+        )
+
+    started = time.perf_counter()
+    if dispatch:
+        response = dispatch(call)
+    else:
+        quota.acquire("gemini", "generate_content")
+        response = call()
+    elapsed = time.perf_counter() - started
+    usage = _usage_to_dict(getattr(response, "usage_metadata", None))
+    quota.record_tokens("gemini", usage.get("total_token_count", 0), "generate_content")
+    if ttl and response.text:
+        cache.set(cache_key, response.text, ttl=ttl)
+
+    if UPSTREAM_MODE == "record":
+        get_recorder().write({
+            "provider": "gemini",
+            "method": "generate_content",
+            "url": model,
+            "params": {"template": template, "prompt_chars": len(prompt)},
+            "key": key,
+            "loose_key": loose_key,
+            "status": 200,
+            "body": response.text,
+            "usage": usage,
+            "elapsed": round(elapsed, 4),
+            "recorded_at": time.time(),
+        })
+    return response
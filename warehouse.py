@@ -0,0 +1,314 @@
+"""
+Local time-series warehouse for NOAA and OpenWeather readings.
+
+Fetched observations used to be thrown away after one report. They are
+now written to a SQLite file, one row per series and timestamp, along
+with a record of which time ranges of each series have been fetched in
+full. A read for a range first works out the gaps in that coverage and
+fetches only those, so a "water temperature vs. last week" or pressure
+trend query costs at most a day of new data.
+
+Series are named source:place:product[:variant], e.g.
+"noaa:8665530:water_level:english:gmt" or "openweather:32.78,-79.93:pressure".
+Each row has the NOAA value columns (v, s, d, g) and a text label.
+OpenWeather readings are stored as one series per field.
+
+Configured in the "warehouse" section of config.json, or with
+WAREHOUSE_PATH:
+
+    "warehouse": {
+        "enabled": true,
+        "path": "warehouse.sqlite3"
+    }
+
+Reads go through SQLite's memory-mapped I/O and come back as TideSeries
+arrays, or as NumPy columns with read_columnar, so multi-month queries
+don't build per-row objects. Warehouse failures are logged and never fail
+a fetch.
+"""
+
+import array
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import app_config
+from models import ColumnarSeries, HourlyPoint, TideSeries, numpy, parse_noaa_time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "path": "warehouse.sqlite3",
+}
+
+COLUMNS = ("v", "s", "d", "g")
+
+# HourlyPoint fields kept for OpenWeather; conditions are stored as labels
+WEATHER_FIELDS = ("temp", "feels_like", "pressure", "humidity", "clouds",
+                  "wind_speed", "wind_deg", "wind_gust", "pop", "rain")
+
+# Let SQLite map up to this much of the file instead of copying pages through read()
+MMAP_BYTES = 256 * 1024 * 1024
+
+DAY = 86400
+HOUR = 3600
+
+
+def series_key(source, place, *parts):
+    return ":".join(str(part) for part in (source, place, *parts))
+
+
+def weather_place(lat, lon):
+    return f"{float(lat):.2f},{float(lon):.2f}"
+
+
+def _nan(value):
+    return math.nan if value is None else value
+
+
+class Warehouse:
+    """Readings and fetched-range coverage in one SQLite file; safe to share between processes"""
+
+    def __init__(self, path="warehouse.sqlite3", clock=time.time):
+        self.path = path
+        self._clock = clock
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS readings ("
+                "series TEXT NOT NULL, t INTEGER NOT NULL, v REAL, s REAL, d REAL, g REAL, label TEXT, "
+                "PRIMARY KEY (series, t)) WITHOUT ROWID"
+            )
+            # Half-open [start, stop) ranges known to be fully stored, merged on insert
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS coverage ("
+                "series TEXT NOT NULL, start INTEGER NOT NULL, stop INTEGER NOT NULL, "
+                "PRIMARY KEY (series, start))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS metadata (series TEXT PRIMARY KEY, value TEXT)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={MMAP_BYTES}")
+            self._local.conn = conn
+        return conn
+
+    def write(self, series, data):
+        """Store a TideSeries' rows, replacing readings at the same times"""
+        columns = [data.columns.get(name) for name in COLUMNS]
+        labels = data.labels
+        rows = [(series, t, *(None if column is None or math.isnan(column[i]) else column[i] for column in columns),
+                 labels[i] if labels is not None else None)
+                for i, t in enumerate(data.times)]
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO readings VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            if data.metadata:
+                conn.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?)", (series, json.dumps(data.metadata)))
+
+    def cover(self, series, start, stop):
+        """Record that every reading in [start, stop) is stored"""
+        if stop <= start:
+            return
+        with self._connect() as conn:
+            touching = conn.execute(
+                "SELECT start, stop FROM coverage WHERE series = ? AND start <= ? AND stop >= ?",
+                (series, stop, start)).fetchall()
+            start = min([start] + [row[0] for row in touching])
+            stop = max([stop] + [row[1] for row in touching])
+            conn.executemany("DELETE FROM coverage WHERE series = ? AND start = ?",
+                             [(series, row[0]) for row in touching])
+            conn.execute("INSERT INTO coverage VALUES (?, ?, ?)", (series, start, stop))
+
+    def missing(self, series, start, stop):
+        """The [start, stop) ranges within [start, stop) that have not been stored"""
+        covered = self._connect().execute(
+            "SELECT start, stop FROM coverage WHERE series = ? AND start < ? AND stop > ? ORDER BY start",
+            (series, stop, start)).fetchall()
+        gaps = []
+        cursor = start
+        for low, high in covered:
+            if low > cursor:
+                gaps.append((cursor, low))
+            cursor = max(cursor, high)
+        if cursor < stop:
+            gaps.append((cursor, stop))
+        return gaps
+
+    def _rows(self, series, start, stop):
+        return self._connect().execute(
+            "SELECT t, v, s, d, g, label FROM readings WHERE series = ? AND t >= ? AND t < ? ORDER BY t",
+            (series, start, stop)).fetchall()
+
+    def _metadata(self, series):
+        row = self._connect().execute("SELECT value FROM metadata WHERE series = ?", (series,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def read(self, series, start, stop):
+        """Stored readings in [start, stop) as a TideSeries; columns never filled are left out"""
+        rows = self._rows(series, start, stop)
+        columns = {}
+        for index, name in enumerate(COLUMNS, start=1):
+            if any(row[index] is not None for row in rows):
+                columns[name] = array.array("d", (_nan(row[index]) for row in rows))
+        labels = [row[5] for row in rows] if any(row[5] is not None for row in rows) else None
+        return TideSeries(self._metadata(series), array.array("q", (row[0] for row in rows)), columns, labels)
+
+    def read_columnar(self, series, start, stop):
+        """Stored readings in [start, stop) as a ColumnarSeries (needs numpy)"""
+        if numpy is None:
+            raise RuntimeError("Columnar reads need numpy (pip install numpy)")
+        rows = self._rows(series, start, stop)
+        table = numpy.array([row[:5] for row in rows], dtype=float).reshape(len(rows), 5)
+        times = table[:, 0].astype("int64").astype("datetime64[s]").astype("datetime64[m]")
+        values = {name: table[:, i] for i, name in enumerate(COLUMNS, start=1)
+                  if not numpy.isnan(table[:, i]).all()}
+        return ColumnarSeries(self._metadata(series), times, values)
+
+    def fetch_dates(self, series, begin_date, end_date, fetcher, complete_before=None):
+        """Readings for inclusive YYYYMMDD dates, calling fetcher(begin_date, end_date) only for missing days
+
+        fetcher returns a TideSeries, or an error dict which is returned as
+        is when nothing for the range is stored. Days from complete_before
+        (epoch seconds on the series' clock; default the start of today in
+        UTC, right for gmt series) are refetched every time because they
+        may still be filling in.
+        """
+        start = parse_noaa_time(f"{begin_date[:4]}-{begin_date[4:6]}-{begin_date[6:8]} 00:00")
+        stop = parse_noaa_time(f"{end_date[:4]}-{end_date[4:6]}-{end_date[6:8]} 00:00") + DAY
+        if complete_before is None:
+            complete_before = int(self._clock()) // DAY * DAY
+        error = None
+        for low, high in self.missing(series, start, stop):
+            part = fetcher(time.strftime("%Y%m%d", time.gmtime(low)), time.strftime("%Y%m%d", time.gmtime(high - DAY)))
+            if not isinstance(part, TideSeries):
+                error = part
+                continue
+            self.write(series, part)
+            self.cover(series, low, min(high, complete_before))
+        stored = self.read(series, start, stop)
+        if not len(stored) and error is not None:
+            return error
+        return stored
+
+    def record_weather(self, lat, lon, points, start=None, stop=None):
+        """Store HourlyPoints for a location; start/stop mark a fully fetched range"""
+        points = [point for point in points if point is not None]
+        place = weather_place(lat, lon)
+        times = array.array("q", (int(point.dt) for point in points))
+        for field in WEATHER_FIELDS:
+            values = array.array("d", (_nan(getattr(point, field)) for point in points))
+            self.write(series_key("openweather", place, field), TideSeries(None, times, {"v": values}))
+        self.write(series_key("openweather", place, "conditions"),
+                   TideSeries(None, times, {}, [point.conditions for point in points]))
+        if start is not None and stop is not None:
+            self.cover(series_key("openweather", place), start, stop)
+
+    def weather_missing(self, lat, lon, start, stop):
+        return self.missing(series_key("openweather", weather_place(lat, lon)), start, stop)
+
+    def weather_points(self, lat, lon, start, stop):
+        """Stored HourlyPoints for a location in [start, stop)"""
+        place = weather_place(lat, lon)
+        points = {}
+        for field in WEATHER_FIELDS:
+            for row in self._rows(series_key("openweather", place, field), start, stop):
+                points.setdefault(row[0], {})[field] = row[1]
+        for row in self._rows(series_key("openweather", place, "conditions"), start, stop):
+            points.setdefault(row[0], {})["conditions"] = row[5]
+        return [HourlyPoint(dt, **fields) for dt, fields in sorted(points.items())]
+
+
+def get_settings():
+    settings = app_config.section("warehouse", DEFAULT_SETTINGS)
+    if os.getenv("WAREHOUSE_PATH"):
+        settings["path"] = os.getenv("WAREHOUSE_PATH")
+    return settings
+
+
+_warehouse = None
+_configured = False
+_lock = threading.Lock()
+
+
+def get_warehouse():
+    """The process-wide warehouse, or None when it is disabled"""
+    global _warehouse, _configured
+    with _lock:
+        if not _configured:
+            settings = get_settings()
+            if settings.get("enabled", True):
+                try:
+                    _warehouse = Warehouse(settings["path"])
+                    logger.info("Storing readings in %s", settings['path'])
+                except Exception as e:
+                    logger.warning("Warehouse unavailable: %s", e)
+            _configured = True
+        return _warehouse
+
+
+def configure(warehouse=None):
+    """Replace the process-wide warehouse; None disables it (used by tests and benchmarks)"""
+    global _warehouse, _configured
+    with _lock:
+        _warehouse = warehouse
+        _configured = True
+        return _warehouse
+
+
+def fetch_noaa(station_id, data_type, begin_date, end_date, fetcher, units="metric", time_zone="gmt", now=None):
+    """A NOAA observation product through the warehouse, fetching only the days not stored yet
+
+    now is the current time on the series' clock, read like NOAA's stamps
+    (noaa_tides_currents.station_now); the station's day in progress is
+    never stored as complete. Without it the day is taken in UTC, which
+    is only right for gmt series.
+    """
+    store = get_warehouse()
+    if store is None or len(begin_date) != 8 or len(end_date) != 8:
+        return fetcher(begin_date, end_date)
+    complete_before = int(now) // DAY * DAY if now is not None else None
+    try:
+        return store.fetch_dates(series_key("noaa", station_id, data_type, units, time_zone),
+                                 begin_date, end_date, fetcher, complete_before)
+    except sqlite3.Error as e:
+        logger.warning("Warehouse read failed, fetching directly: %s", e)
+        return fetcher(begin_date, end_date)
+
+
+def record_weather(lat, lon, points, start=None, stop=None):
+    """Store OpenWeather readings for a location, if the warehouse is enabled"""
+    store = get_warehouse()
+    if store is None or lat is None or lon is None:
+        return
+    try:
+        store.record_weather(lat, lon, points, start, stop)
+    except sqlite3.Error as e:
+        logger.warning("Warehouse write failed: %s", e)
+
+
+def weather_history(lat, lon, dt, fetcher):
+    """Timemachine readings for the hour containing dt, calling fetcher() only if that hour isn't stored"""
+    store = get_warehouse()
+    if store is None:
+        return fetcher()
+    hour = int(dt) - int(dt) % HOUR
+    try:
+        if not store.weather_missing(lat, lon, hour, hour + HOUR):
+            return store.weather_points(lat, lon, hour, hour + HOUR)
+    except sqlite3.Error as e:
+        logger.warning("Warehouse read failed, fetching directly: %s", e)
+        return fetcher()
+    points = fetcher()
+    # The current hour can still change, so only finished hours count as stored
+    finished = hour + HOUR <= time.time()
+    record_weather(lat, lon, points, *((hour, hour + HOUR) if finished else ()))
+    return points
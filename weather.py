@@ -1,7 +1,8 @@
-import urllib.request
-import urllib.parse
 import json
 import os
+import upstream
+import warehouse
+from models import decode_onecall, decode_timemachine
 
 # Try to load dotenv, but don't fail if it's not available
 try: # pragma: no cover
@@ -10,6 +11,9 @@ try: # pragma: no cover
 except ImportError: # pragma: no cover
     pass  # dotenv not available, environment variables must be set another way
 
+# Base URL for OpenWeather (override to point at a local stub server)
+OPEN_WEATHER_BASE_URL = os.getenv("OPEN_WEATHER_BASE_URL", "https://api.openweathermap.org")
+
 def load_config(config_file: str = "config.json"): # pragma: no cover
     """Load configuration from JSON file"""
     with open(config_file, 'r', encoding='utf-8') as f:
@@ -24,28 +28,28 @@ def zip_to_coords(zip_code: str): # pragma: no cover
             return None, None
         
         # OpenWeather Geocoding API
-        GEOCODE_URL = "http://api.openweathermap.org/geo/1.0/zip"
+        GEOCODE_URL = f"{OPEN_WEATHER_BASE_URL}/geo/1.0/zip"
         params = {
             "zip": f"{zip_code},US",
             "appid": OPEN_WEATHER_TOKEN
         }
         
-        request_url = f"{GEOCODE_URL}?{urllib.parse.urlencode(params)}"
-        req = urllib.request.Request(request_url)
+        response = upstream.get("openweather", GEOCODE_URL, params=params)
+        response.raise_for_status()
+        result = response.json()
         
-        with urllib.request.urlopen(req) as response:
-            data = response.read()
-            encoding = response.info().get_content_charset('utf-8')
-            result = json.loads(data.decode(encoding))
-            
-            if "lat" in result and "lon" in result:
-                return str(result["lat"]), str(result["lon"])
-            return None, None
+        if "lat" in result and "lon" in result:
+            return str(result["lat"]), str(result["lon"])
+        return None, None
     except Exception as e:
         # If geocoding fails, return None to fall back to config
         return None, None
 
-def get_weather(lat=None, lon=None): # pragma: no cover
+def get_weather(lat=None, lon=None, exclude=None): # pragma: no cover
+	"""One Call forecast as a models.WeatherSnapshot
+
+	exclude lists sections to skip (current, minutely, hourly, daily, alerts).
+	"""
 	# Try to load dotenv if available
 	try:
 		load_dotenv()
@@ -53,7 +57,7 @@ def get_weather(lat=None, lon=None): # pragma: no cover
 		pass  # load_dotenv not available
 	
 	OPEN_WEATHER_TOKEN = os.getenv("OPEN_WEATHER_TOKEN")
-	BASE_URL = "https://api.openweathermap.org/data/3.0/onecall"
+	BASE_URL = f"{OPEN_WEATHER_BASE_URL}/data/3.0/onecall"
 	api_key = OPEN_WEATHER_TOKEN
 
 	# Use provided lat/lon or fall back to config
@@ -73,14 +77,32 @@ def get_weather(lat=None, lon=None): # pragma: no cover
 		"lon" : lon,
 		"appid" : api_key
 		}
-		
+	if exclude:
+		params["exclude"] = ",".join(exclude)
+
+	response = upstream.get("openweather", BASE_URL, params=params)
+	response.raise_for_status()
+	snapshot = decode_onecall(response.content)
+	# Keep the observed conditions; forecast rows aren't measurements
+	if snapshot.current is not None:
+		warehouse.record_weather(lat, lon, [snapshot.current])
+	return snapshot
 
-	request_url = f"{BASE_URL}?{urllib.parse.urlencode(params)}" 
+def get_weather_history(lat, lon, dt): # pragma: no cover
+	"""One Call timemachine: models.HourlyPoint readings for the hour containing unix time dt
 
-	req = urllib.request.Request(request_url)
+	Hours already in the local warehouse are read from it instead.
+	"""
+	def fetch():
+		api_key = os.getenv("OPEN_WEATHER_TOKEN")
+		params = {
+			"lat" : lat,
+			"lon" : lon,
+			"dt" : int(dt),
+			"appid" : api_key
+			}
+		response = upstream.get("openweather", f"{OPEN_WEATHER_BASE_URL}/data/3.0/onecall/timemachine", params=params)
+		response.raise_for_status()
+		return decode_timemachine(response.content)
 
-	with urllib.request.urlopen(req) as response:
-	    data = response.read()
-	    encoding = response.info().get_content_charset('utf-8')
-	    result = json.loads(data.decode(encoding))
-	return result
+	return warehouse.weather_history(lat, lon, dt, fetch)
@@ -0,0 +1,245 @@
+"""
+Incremental weekly report building.
+
+The weekly report is assembled from per-day pieces. Each day's inputs
+(OpenWeather daily forecast plus any NOAA readings for that date) are
+reduced to a rounded summary and fingerprinted; the day's score, summary
+and fishing windows are cached under that fingerprint, so only days whose
+inputs changed are rescored. Gemini is asked for new prose only when the
+ranking of the best days changes; otherwise the last weekly report for the
+location is reused.
+"""
+
+import hashlib
+import json
+import logging
+import math
+from datetime import datetime, timedelta, timezone
+
+import cache
+import metrics
+from models import SpeciesReport, TideSeries, WeatherSnapshot
+
+logger = logging.getLogger(__name__)
+
+DAYS = 7
+
+# Number of top days whose order decides whether the prose is regenerated
+BEST_DAYS = 3
+
+# Scored days are small, so keep them for the whole forecast horizon
+DAY_TTL_SECONDS = 8 * 24 * 60 * 60
+REPORT_TTL_SECONDS = 12 * 60 * 60
+
+# Wind (m/s) above which conditions get rough, by fishing type
+WIND_LIMITS = {"kayak": 5.0, "shore": 8.0, "boat": 9.0}
+DEFAULT_WIND_LIMIT = 8.0
+
+
+def _round(value, step):
+    if value is None:
+        return None
+    return round(round(float(value) / step) * step, 2)
+
+
+def _tide_summary(tides_data, date):
+    """Daily range of each NOAA series for date ("YYYY-MM-DD")"""
+    summary = {}
+    data_types = (tides_data or {}).get("data_types", {}) if isinstance(tides_data, dict) else {}
+    for data_type, series in data_types.items():
+        if not isinstance(series, TideSeries):
+            continue
+        values = [v for v in series.on_date(date).values() if not math.isnan(v)]
+        if values:
+            summary[data_type] = {"min": _round(min(values), 0.1), "max": _round(max(values), 0.1)}
+    return summary
+
+
+def split_days(data, days=DAYS):
+    """Per-day input summaries from combine_api_data output, oldest first"""
+    weather = data.get("weather_data")
+    if not isinstance(weather, WeatherSnapshot) or not weather.daily:
+        return []
+    offset = timedelta(seconds=weather.timezone_offset or 0)
+    pieces = []
+    previous_pressure = None
+    for day in weather.daily[:days]:
+        local = datetime.fromtimestamp(day.dt, timezone.utc) + offset
+        date = local.strftime("%Y-%m-%d")
+        pieces.append({
+            "date": date,
+            "weekday": local.strftime("%A"),
+            "temp_min": _round(day.temp_min, 1),
+            "temp_max": _round(day.temp_max, 1),
+            "wind_speed": _round(day.wind_speed, 0.5),
+            "wind_gust": _round(day.wind_gust, 1),
+            "pop": _round(day.pop or 0, 0.1),
+            "clouds": _round(day.clouds, 10),
+            "pressure": _round(day.pressure, 1),
+            "pressure_change": (_round(day.pressure - previous_pressure, 1)
+                                if previous_pressure is not None and day.pressure is not None else None),
+            "moon_phase": _round(day.moon_phase, 0.05),
+            "conditions": day.conditions,
+            "sunrise": day.sunrise,
+            "sunset": day.sunset,
+            "timezone_offset": weather.timezone_offset or 0,
+            "tides": _tide_summary(data.get("tides_data"), date),
+        })
+        previous_pressure = day.pressure
+    return pieces
+
+
+def fingerprint(piece, fishing_type=None):
+    payload = json.dumps([fishing_type, piece], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _windows(piece):
+    """Dawn and dusk windows (local time), the usual best bite periods"""
+    if not piece.get("sunrise") or not piece.get("sunset"):
+        return []
+    offset = timedelta(seconds=piece["timezone_offset"])
+    windows = []
+    for event in (piece["sunrise"], piece["sunset"]):
+        local = datetime.fromtimestamp(event, timezone.utc) + offset
+        start, end = local - timedelta(hours=1), local + timedelta(hours=1)
+        windows.append(f"{start:%H:%M}-{end:%H:%M}")
+    return windows
+
+
+def score_day(piece, fishing_type=None):
+    """Score a day 0-10 and describe it in one sentence"""
+    score = 7.0
+    notes = []
+
+    wind = piece.get("wind_speed")
+    limit = WIND_LIMITS.get(fishing_type, DEFAULT_WIND_LIMIT)
+    if wind is not None:
+        if wind > limit:
+            score -= min(3.0, (wind - limit) * 0.75)
+            notes.append(f"windy at {wind:g} m/s")
+        elif wind <= limit / 2:
+            score += 0.5
+            notes.append(f"light winds {wind:g} m/s")
+
+    pop = piece.get("pop") or 0
+    if pop >= 0.5:
+        score -= 2.0 * pop
+        notes.append(f"{pop:.0%} chance of rain")
+
+    change = piece.get("pressure_change")
+    if change is not None:
+        if change <= -2:
+            score += 1.0
+            notes.append("falling pressure")
+        elif change >= 3:
+            score -= 0.5
+            notes.append("rising pressure")
+
+    moon = piece.get("moon_phase")
+    if moon is not None and (moon <= 0.1 or moon >= 0.9 or 0.4 <= moon <= 0.6):
+        score += 0.5
+        notes.append("strong tides around the new/full moon")
+
+    water_level = piece.get("tides", {}).get("water_level")
+    if water_level and water_level["max"] - water_level["min"] >= 5:
+        score += 0.5
+        notes.append("big tidal swing")
+
+    score = max(0.0, min(10.0, round(score, 1)))
+    summary = ", ".join(notes) if notes else (piece.get("conditions") or "steady conditions")
+    return {"score": score, "summary": summary[0].upper() + summary[1:] + ".", "windows": _windows(piece)}
+
+
+def _fahrenheit(kelvin):
+    return f"{(kelvin - 273.15) * 9 / 5 + 32:.0f}°F" if kelvin is not None else "?"
+
+
+def quick_report(data, fishing_type=None, first=None, last=None, days=1):
+    """Numbers-only report from combine_api_data output, used instead of Gemini under load
+
+    Covers the dates first..last ("YYYY-MM-DD") when given, otherwise the
+    first days of the forecast.
+    """
+    pieces = split_days(data)
+    if first:
+        pieces = [piece for piece in pieces if first <= piece["date"] <= (last or first)]
+    else:
+        pieces = pieces[:days]
+    lines = ["⚡ **Quick report** (the bot is busy, so this one skips the full write-up)"]
+    for piece in pieces:
+        scored = score_day(piece, fishing_type)
+        lines.append(f"**{piece['weekday']} {piece['date']}**: {scored['score']:g}/10. {scored['summary']}")
+        details = [f"{_fahrenheit(piece['temp_min'])}-{_fahrenheit(piece['temp_max'])}"]
+        if piece["wind_speed"] is not None:
+            details.append(f"wind {piece['wind_speed']:g} m/s")
+        water_level = piece["tides"].get("water_level")
+        if water_level:
+            details.append(f"water level {water_level['min']:g} to {water_level['max']:g} ft")
+        if scored["windows"]:
+            details.append("best around " + " and ".join(scored["windows"]))
+        lines.append("- " + ", ".join(details))
+    if len(lines) == 1:
+        lines.append("No forecast is available right now.")
+    fish = data.get("fish_data")
+    if isinstance(fish, SpeciesReport) and fish.species:
+        seen = [f"{s.common_name or s.name} ({s.count})" for s in fish.species[:5]]
+        lines.append("Recently caught nearby: " + ", ".join(seen))
+    return "\n".join(lines)
+
+
+def _location(zip_code):
+    return str(zip_code).strip() if zip_code else "default"
+
+
+def score_week(data, zip_code=None, fishing_type=None):
+    """Scored days for the week, rescoring only days whose inputs changed
+
+    Returns (days, rescored) where rescored is the number of days that were
+    not found in the cache.
+    """
+    pieces = split_days(data)
+    location = _location(zip_code)
+    keys = [f"weekly:day:{location}:{piece['date']}:{fingerprint(piece, fishing_type)}" for piece in pieces]
+    cached = cache.get_many(keys)
+
+    days, fresh = [], {}
+    for piece, key in zip(pieces, keys):
+        scored = cached.get(key)
+        if scored is None:
+            scored = score_day(piece, fishing_type)
+            fresh[key] = scored
+        days.append({"date": piece["date"], "weekday": piece["weekday"],
+                     "temp_min": piece["temp_min"], "temp_max": piece["temp_max"],
+                     "wind_speed": piece["wind_speed"], "conditions": piece["conditions"],
+                     "tides": piece["tides"], **scored})
+    if fresh:
+        cache.set_many(fresh, ttl=DAY_TTL_SECONDS)
+    metrics.increment("weekly_days_total", len(days) - len(fresh), outcome="cached")
+    metrics.increment("weekly_days_total", len(fresh), outcome="rescored")
+    return days, len(fresh)
+
+
+def ranking(days, best=BEST_DAYS):
+    """Dates of the best days, highest score first (earlier date breaks ties)"""
+    ordered = sorted(days, key=lambda day: (-day["score"], day["date"]))
+    return [day["date"] for day in ordered[:best]]
+
+
+def _report_key(zip_code, fishing_type):
+    return f"weekly:report:{_location(zip_code)}:{fishing_type or 'any'}"
+
+
+def cached_report(zip_code, fishing_type, current_ranking):
+    """Last weekly report for this location if the best days are unchanged"""
+    entry = cache.get(_report_key(zip_code, fishing_type))
+    if entry is None or entry["ranking"] != current_ranking:
+        metrics.increment("weekly_reports_total", outcome="regenerated")
+        return None
+    metrics.increment("weekly_reports_total", outcome="reused")
+    return entry["report"]
+
+
+def store_report(zip_code, fishing_type, current_ranking, report):
+    cache.set(_report_key(zip_code, fishing_type),
+              {"ranking": current_ranking, "report": report}, ttl=REPORT_TTL_SECONDS)